@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.metrics.MetricsMiddleware',
+    'store.querycheck.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +93,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',  # Assuming 'db.sqlite3' is in your BASE_DIR
+        'OPTIONS': {
+            # seconds a writer waits for the write lock before "database is locked"
+            'timeout': 20,
+        },
+        'TEST': {
+            # file-backed so concurrency tests see real SQLite locking
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -149,8 +159,12 @@ AUTH_USER_MODEL = "core.User"
 
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_RENDERER_CLASSES': (
+        'store.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.CachedJWTAuthentication',
     ),
 }
 
@@ -164,4 +178,86 @@ DJOSER = {
         'current_user':'core.serializers.UserSerializer',
         'user_create':'core.serializers.UserCreateSerializer'
     }
-}
\ No newline at end of file
+}
+
+CATALOG_CACHE = {
+    # Set ALIAS to a key of CACHES to share the catalog cache between workers.
+    # Without it each process keeps its own LRU of MAX_ENTRIES payloads, which
+    # only sees its own writes: other workers may serve entries up to TIMEOUT
+    # seconds old, so use an alias whenever more than one worker runs.
+    'ENABLED': True,
+    'ALIAS': getenv("CATALOG_CACHE_ALIAS"),
+    'MAX_ENTRIES': 1000,
+    'TIMEOUT': 300,
+}
+
+METRICS = {
+    # Per-view latency, SQL and serializer histograms served at /metrics.
+    # With several workers, point DIRECTORY at a directory they share: each
+    # writes its totals there every FLUSH_INTERVAL seconds and /metrics
+    # merges them. Clear it when deploying so counters start from zero.
+    # Scrapers send TOKEN as a bearer token; without one, only staff users
+    # (or anyone, with DEBUG on) can read /metrics.
+    'ENABLED': True,
+    'DIRECTORY': getenv("METRICS_DIRECTORY"),
+    'FLUSH_INTERVAL': 5.0,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'TOKEN': getenv("METRICS_TOKEN"),
+}
+
+QUERY_CHECK = {
+    # Development mode: log requests that run one query shape THRESHOLD or
+    # more times from the same serializer field, admin column or line
+    # (store.querycheck). RAISE turns the warning into an error.
+    'ENABLED': bool(DEBUG),
+    'THRESHOLD': 3,
+    'RAISE': False,
+}
+
+PRICING = {
+    # price_with_tax = unit_price less the product's largest promotion
+    # (Promotion.discount, in percent), plus TAX_RATE (a fraction, e.g. '0.2').
+    # Prices of a page are computed together (store.pricing) and kept for
+    # up to MAX_ENTRIES products until the next catalog write.
+    'TAX_RATE': getenv("TAX_RATE", "0"),
+    'MAX_ENTRIES': 100000,
+}
+
+FAST_SERIALIZERS = {
+    # GET list/retrieve of products, collections, cart items and order items
+    # build their payloads from .values() rows (store/fastserializers.py)
+    # instead of the ModelSerializers; the output is the same.
+    'ENABLED': True,
+}
+
+CARTS = {
+    # Anonymous carts idle (no item added or changed) for TTL are deleted by
+    # the purge_carts command; schedule it or run it with --loop.
+    'TTL': timedelta(days=14),
+    # "sql" keeps carts in the Cart/CartItem tables. "local" (this process
+    # only) or "cache" (the Django cache ALIAS, e.g. a FileBasedCache or
+    # redis) keep them in a key-value store that expires them after TTL;
+    # a cart is written to the tables only at checkout.
+    'BACKEND': getenv("CART_BACKEND","sql"),
+    'ALIAS': getenv("CART_STORE_ALIAS"),
+    # carts the "local" store holds before evicting the least recently used
+    'MAX_ENTRIES': 100000,
+}
+
+TAG_SETS = {
+    # Product ids per tag, held in memory for ?tags= filters (store.tagsets).
+    # Tag writes bump a version kept in the ALIAS cache so every worker
+    # reloads; without an alias other workers reload after TIMEOUT seconds.
+    'ALIAS': getenv("CATALOG_CACHE_ALIAS"),
+    'TIMEOUT': 300,
+}
+
+IDENTITY_CACHE = {
+    # Users and customers resolved from JWTs (store.authentication). Entries
+    # are dropped on save/delete; without a shared ALIAS other workers only
+    # notice after TIMEOUT seconds, so keep it short or set IDENTITY_CACHE_ALIAS.
+    'ENABLED': True,
+    'ALIAS': getenv("IDENTITY_CACHE_ALIAS"),
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+}
@@ -18,14 +18,16 @@ from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
+from store.views import metrics_view, serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("store/",include("store.urls")),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
+    path('metrics', metrics_view),
 ] 
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL,view=serve_media,document_root=settings.MEDIA_ROOT)
 
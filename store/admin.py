@@ -14,15 +14,14 @@ class CollectionAdmin(admin.ModelAdmin):
     list_display = ["title","products_count"]
     list_per_page = 10
     search_fields = ["title"]
-
-    def products_count(self,collection):
-        return collection.product_set.count()
     
 class ProductImageInline(admin.TabularInline):
     model = models.ProductImage
     readonly_fields = ['thumbnail']
 
     def thumbnail(self, instance):
+        if instance.thumbnail.name != '':
+            return format_html(f'<img src="{instance.thumbnail.url}" class="thumbnail" />')
         if instance.image.name != '':
             return format_html(f'<img src="{instance.image.url}" class="thumbnail" />')
         return ''
@@ -64,6 +63,7 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ["id","placed_at","customer_name"]
+    list_select_related = ["customer__user"]
     ordering = ["id"]
     inlines = [OrderItemInline]
     list_filter = ["placed_at"]
@@ -95,4 +95,10 @@ class CustomerAdmin(admin.ModelAdmin):
         return super().get_queryset(request).annotate(orders_count=Count("order"))
 
 
+@admin.register(models.OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ["id","event","status","attempts","created_at","available_at"]
+    list_filter = ["status","event"]
+    list_per_page = 50
+    readonly_fields = ["created_at","processed_at"]
 
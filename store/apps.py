@@ -7,3 +7,5 @@ class StoreConfig(AppConfig):
 
     def ready(self) -> None:
         import store.signals.handlers
+        from store.metrics import instrument_serializers
+        instrument_serializers()
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from store.cache import _MISSING, DjangoCatalogStore, LocalCatalogStore
+from store.models import Customer
+
+#the password hash stays out of the cache; it is loaded on first access like any deferred field
+USER_EXCLUDED_FIELDS = {"password"}
+
+
+def _field_values(instance, exclude=()):
+    names = [field.attname for field in instance._meta.concrete_fields if field.attname not in exclude]
+    return names, [getattr(instance, name) for name in names]
+
+
+class IdentityCache:
+    """Caches the User and Customer rows behind a token's user id, for TIMEOUT seconds.
+
+    Entries hold field values rather than instances, so every request gets
+    its own objects. Saving or deleting a User or Customer drops the entry
+    (see store.signals.handlers); writes that skip save(), such as
+    queryset.update(is_active=False), are only seen once the entry expires.
+    """
+
+    def __init__(self):
+        self._store = None
+
+    @property
+    def config(self):
+        return getattr(settings, "IDENTITY_CACHE", {})
+
+    @property
+    def store(self):
+        if self._store is None:
+            alias = self.config.get("ALIAS")
+            timeout = self.config.get("TIMEOUT", 60)
+            if alias:
+                self._store = DjangoCatalogStore(alias, timeout)
+            else:
+                self._store = LocalCatalogStore(self.config.get("MAX_ENTRIES", 10000), timeout)
+        return self._store
+
+    @property
+    def enabled(self):
+        return self.config.get("ENABLED", True)
+
+    def make_key(self, user_id):
+        return f"identity:{user_id}"
+
+    def get(self, user_id):
+        """Return (user, customer) rebuilt from the cache, or None."""
+        entry = self.store.get(self.make_key(user_id))
+        if entry is _MISSING:
+            return None
+        (user_fields, user_values), customer_entry = entry
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, user_fields, user_values)
+        if customer_entry is not None:
+            user.customer = Customer.from_db(DEFAULT_DB_ALIAS, *customer_entry)
+        return user
+
+    def set(self, user, customer):
+        customer_entry = _field_values(customer) if customer is not None else None
+        self.store.set(self.make_key(user.pk), (_field_values(user, USER_EXCLUDED_FIELDS), customer_entry))
+
+    def invalidate(self, user_id):
+        self.store.delete(self.make_key(user_id))
+
+
+identity_cache = IdentityCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the token's user and customer from IdentityCache.
+
+    The customer is attached as request.user.customer, so views read it
+    without another query. The parent class rejects inactive users before
+    anything is cached, and deactivating a user through save() drops the
+    entry, so their tokens fail on the next request.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        #entries are keyed by primary key; revocation compares against the password hash, which isn't cached
+        cacheable = (identity_cache.enabled and user_id is not None and not api_settings.CHECK_REVOKE_TOKEN
+                     and api_settings.USER_ID_FIELD == get_user_model()._meta.pk.name)
+        if cacheable:
+            user = identity_cache.get(user_id)
+            if user is not None:
+                return user
+        user = super().get_user(validated_token)
+        customer = Customer.objects.filter(user_id=user.pk).first()
+        if customer is not None:
+            user.customer = customer
+        if cacheable:
+            identity_cache.set(user, customer)
+        return user
+
+
+@receiver(setting_changed)
+def reset_identity_cache(setting, **kwargs):
+    if setting == "IDENTITY_CACHE":
+        identity_cache._store = None
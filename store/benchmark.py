@@ -0,0 +1,241 @@
+import json
+import math
+import platform
+import random
+import sqlite3
+import time
+from io import BytesIO
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.transaction import atomic
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from store import search
+from store.cache import catalog_cache
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, ProductImage
+from store.storage import content_addressed_storage
+
+WORDS = ["apple", "bread", "cheese", "coffee", "honey", "olive", "pasta", "pepper", "rice", "salt",
+         "sugar", "tea", "tomato", "vanilla", "walnut", "yogurt", "organic", "fresh", "smoked", "spicy"]
+
+DEFAULT_SCALE = {"collections": 20, "products": 10000, "images": 2000, "customers": 500, "orders": 5000, "carts": 200}
+
+
+def _chunks(objects, size=2000):
+    for start in range(0, len(objects), size):
+        yield objects[start:start + size]
+
+
+def seed(scale, seed=0):
+    """Fill an empty database with a deterministic dataset of the given scale (see DEFAULT_SCALE).
+
+    Rows are written with bulk_create, so the denormalized counters and the
+    search index are rebuilt at the end rather than kept by signals.
+    """
+    rng = random.Random(seed)
+    with atomic():
+        collections = Collection.objects.bulk_create(
+            [Collection(title=f"Collection {number}") for number in range(scale["collections"])])
+        products = []
+        for number in range(scale["products"]):
+            title = " ".join(rng.sample(WORDS, 3)) + f" {number}"
+            products.append(Product(
+                title=title, slug=f"product-{number}", description=" ".join(rng.choices(WORDS, k=12)),
+                unit_price=f"{rng.randint(100, 50000) / 100:.2f}", inventory=10 ** 6,
+                collection=rng.choice(collections)))
+        for chunk in _chunks(products):
+            Product.objects.bulk_create(chunk)
+
+        #a handful of distinct files shared by many rows, as the content-addressed storage would
+        names = []
+        for color in ["red", "green", "blue", "gray"]:
+            buffer = BytesIO()
+            Image.new("RGB", (64, 64), color).save(buffer, "JPEG")
+            names.append(content_addressed_storage.save("store/images/seed.jpg", ContentFile(buffer.getvalue())))
+        images = [ProductImage(product=rng.choice(products), image=rng.choice(names),
+                               derivatives_status=ProductImage.DERIVATIVES_READY) for _ in range(scale["images"])]
+        for chunk in _chunks(images):
+            ProductImage.objects.bulk_create(chunk)
+
+        password = make_password("benchmark")
+        users = [get_user_model()(username=f"customer{number}", email=f"customer{number}@example.com",
+                                  first_name="Customer", last_name=str(number), password=password)
+                 for number in range(scale["customers"])]
+        for chunk in _chunks(users):
+            get_user_model().objects.bulk_create(chunk)
+        customers = [Customer(user=user) for user in users]
+        for chunk in _chunks(customers):
+            Customer.objects.bulk_create(chunk)
+
+        orders = [Order(customer=rng.choice(customers), payment_status=rng.choice("PCF")) for _ in range(scale["orders"])]
+        for chunk in _chunks(orders):
+            Order.objects.bulk_create(chunk)
+        items = [OrderItem(order=order, product=product, quantity=rng.randint(1, 5), unit_price=product.unit_price)
+                 for order in orders for product in rng.sample(products, min(3, len(products)))]
+        for chunk in _chunks(items):
+            OrderItem.objects.bulk_create(chunk)
+
+        carts = Cart.objects.bulk_create([Cart() for _ in range(scale["carts"])])
+        cart_items = [CartItem(cart=cart, product=product, quantity=rng.randint(1, 5))
+                      for cart in carts for product in rng.sample(products, min(4, len(products)))]
+        for chunk in _chunks(cart_items):
+            CartItem.objects.bulk_create(chunk)
+
+        Collection.rebuild_products_count()
+    search.rebuild()
+
+
+class Scenario:
+    """One benchmarked route: prepare() runs untimed before each request() call."""
+
+    def __init__(self, name, request, prepare=None):
+        self.name = name
+        self.request = request
+        self.prepare = prepare
+
+
+def build_scenarios(seed=0):
+    rng = random.Random(seed)
+    product_ids = list(Product.objects.values_list("id", flat=True))
+    collection_ids = list(Collection.objects.values_list("id", flat=True))
+    customer = Customer.objects.select_related("user").filter(order__isnull=False).order_by("id").first()
+    anonymous = APIClient()
+    authenticated = APIClient()
+    authenticated.credentials(HTTP_AUTHORIZATION=f"JWT {RefreshToken.for_user(customer.user).access_token}")
+    cart = Cart.objects.create()
+
+    def product_list():
+        return anonymous.get("/store/products/")
+
+    def product_list_filtered():
+        return anonymous.get("/store/products/", {
+            "collection_id": rng.choice(collection_ids), "unit_price__gt": rng.randint(1, 200), "ordering": "unit_price"})
+
+    def product_search():
+        return anonymous.get("/store/products/", {"search": " ".join(rng.sample(WORDS, 2))})
+
+    def product_detail():
+        return anonymous.get(f"/store/products/{rng.choice(product_ids)}/")
+
+    def cart_add():
+        return anonymous.post(f"/store/carts/{cart.pk}/cartitems/", {"product_id": rng.choice(product_ids), "quantity": 1})
+
+    checkout_cart = {}
+
+    def prepare_checkout():
+        checkout_cart["id"] = Cart.objects.create().pk
+        CartItem.objects.bulk_create([CartItem(cart_id=checkout_cart["id"], product_id=product_id, quantity=1)
+                                      for product_id in rng.sample(product_ids, min(3, len(product_ids)))])
+
+    def checkout():
+        return authenticated.post("/store/orders/", {"id": str(checkout_cart["id"])})
+
+    def order_list():
+        return authenticated.get("/store/orders/")
+
+    return [
+        Scenario("product_list", product_list),
+        Scenario("product_list_filtered", product_list_filtered),
+        Scenario("product_search", product_search),
+        Scenario("product_detail", product_detail),
+        Scenario("cart_add", cart_add),
+        Scenario("checkout", checkout, prepare_checkout),
+        Scenario("order_list", order_list),
+    ]
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))]
+
+
+def run_scenario(scenario, iterations, warmup):
+    for _ in range(warmup):
+        if scenario.prepare:
+            scenario.prepare()
+        scenario.request()
+    latencies, queries, errors = [], [], 0
+    elapsed = 0.0
+    for _ in range(iterations):
+        if scenario.prepare:
+            scenario.prepare()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = scenario.request()
+            duration = time.perf_counter() - started
+        elapsed += duration
+        latencies.append(duration * 1000)
+        queries.append(len(captured))
+        if response.status_code >= 400:
+            errors += 1
+    latencies.sort()
+    return {
+        "requests": iterations,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / iterations, 3),
+        "max_ms": round(latencies[-1], 3),
+        "throughput_rps": round(iterations / elapsed, 1) if elapsed else 0.0,
+        "queries_mean": round(sum(queries) / iterations, 2),
+        "queries_max": max(queries),
+    }
+
+
+def run(iterations=200, warmup=20, seed=0, only=None):
+    """Run every scenario (or those named in `only`) and return the report dict."""
+    results = {}
+    for scenario in build_scenarios(seed):
+        if only and scenario.name not in only:
+            continue
+        results[scenario.name] = run_scenario(scenario, iterations, warmup)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "iterations": iterations,
+            "warmup": warmup,
+            "seed": seed,
+            "catalog_cache": catalog_cache.enabled,
+            "products": Product.objects.count(),
+            "orders": Order.objects.count(),
+        },
+        "scenarios": results,
+    }
+
+
+COMPARED_METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_mean"]
+
+
+def compare(baseline, current, threshold=0.1):
+    """Rows of (scenario, metric, before, after, relative change, regressed) for two reports.
+
+    Latency and query count regress when they grow by more than `threshold`,
+    throughput when it drops by more than `threshold`.
+    """
+    rows = []
+    for name, after in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else 0.0
+            worse = -change if metric == "throughput_rps" else change
+            rows.append((name, metric, old, new, change, worse > threshold))
+    return rows
+
+
+def dump(report, path):
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write("\n")
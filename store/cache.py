@@ -0,0 +1,218 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+VERSION_KEY = "catalog:version"
+_MISSING = object()
+
+
+class LocalCatalogStore:
+    """In-process LRU store, bounded by max_entries.
+
+    Its version lives in this process only: a write served by another worker
+    doesn't reach it, so entries also expire after `timeout` seconds to bound
+    how long such a worker can serve stale payloads. Use a shared Django cache
+    alias when running more than one worker.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._version = 1
+        self._modified = time.time()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def get_version(self):
+        return self._version
+
+    def get_modified(self):
+        """Time of the last bump_version(); it moves on every `timeout` seconds too, like the entries expire."""
+        modified = self._modified
+        if self.timeout:
+            now = time.time()
+            modified = max(modified, now - now % self.timeout)
+        return modified
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            self._modified = time.time()
+            #entries of older versions can never be read again
+            self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCatalogStore:
+    """Store on top of a configured Django cache alias, shared between workers.
+
+    The LRU bound is whatever the backend enforces (e.g. MAX_ENTRIES in OPTIONS).
+    """
+
+    def __init__(self, alias, timeout, version_key=VERSION_KEY):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.version_key = version_key
+        self.modified_key = f"{version_key}:modified"
+
+    def get(self, key):
+        return self.cache.get(key, _MISSING)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def delete(self, key):
+        return self.cache.delete(key)
+
+    def get_version(self):
+        return self.cache.get_or_set(self.version_key, 1, None)
+
+    def get_modified(self):
+        #an evicted timestamp restarts at now, which only makes clients fetch again
+        return self.cache.get_or_set(self.modified_key, time.time, None)
+
+    def bump_version(self):
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.add(self.version_key, 2, None)
+        self.cache.set(self.modified_key, time.time(), None)
+
+    def clear(self):
+        self.bump_version()
+
+
+class CatalogCache:
+    """Versioned read-through cache for serialized catalog payloads.
+
+    Keys embed a catalog version; any catalog write bumps the version so
+    every previously cached page is skipped without having to find it.
+    """
+
+    def __init__(self):
+        self._store = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def store(self):
+        if self._store is None:
+            config = getattr(settings, "CATALOG_CACHE", {})
+            alias = config.get("ALIAS")
+            if alias:
+                self._store = DjangoCatalogStore(alias, config.get("TIMEOUT", 300))
+            else:
+                self._store = LocalCatalogStore(config.get("MAX_ENTRIES", 1000), config.get("TIMEOUT", 300))
+        return self._store
+
+    @property
+    def enabled(self):
+        return getattr(settings, "CATALOG_CACHE", {}).get("ENABLED", True)
+
+    def make_key(self, kind, request, *parts, ignore=()):
+        params = sorted((name, values) for name, values in request.query_params.lists() if name not in ignore)
+        raw = repr((request.get_host(), request.is_secure(), parts, params))
+        digest = hashlib.sha1(raw.encode()).hexdigest()
+        return f"catalog:v{self.store.get_version()}:{kind}:{digest}"
+
+    def validators(self, kind, request, *parts):
+        """(ETag, Last-Modified timestamp) of a catalog response, from the version alone.
+
+        The ETag covers the same request details as make_key, plus the
+        negotiated media type. Last-Modified is None during the second of the
+        last write: HTTP dates have no finer resolution, so another write in
+        that second would go unnoticed by If-Modified-Since.
+        """
+        modified = self.store.get_modified()
+        raw = repr((self.make_key(kind, request, *parts), request.accepted_media_type, modified))
+        etag = f'"{hashlib.sha1(raw.encode()).hexdigest()}"'
+        return etag, (int(modified) if int(time.time()) > int(modified) else None)
+
+    def get(self, key):
+        """Return (hit, value) for `key`, counting the lookup."""
+        value = self.store.get(key)
+        hit = value is not _MISSING
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit, (value if hit else None)
+
+    def set(self, key, value):
+        self.store.set(key, value)
+
+    def invalidate(self):
+        self.store.bump_version()
+        with self._lock:
+            self.invalidations += 1
+
+    def clear(self):
+        self.store.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "version": self.store.get_version(),
+        }
+        if isinstance(self.store, LocalCatalogStore):
+            stats["entries"] = len(self.store)
+            stats["max_entries"] = self.store.max_entries
+        return stats
+
+
+catalog_cache = CatalogCache()
+
+
+@receiver(setting_changed)
+def reset_catalog_cache(setting, **kwargs):
+    if setting == "CATALOG_CACHE":
+        catalog_cache._store = None
+        catalog_cache.reset_stats()
@@ -0,0 +1,104 @@
+import time
+
+from django.conf import settings
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from store.models import Cart, CartItem
+
+ACTIVITY_TRIGGERS = {
+    "store_cartitem_activity_ai": "AFTER INSERT ON store_cartitem",
+    "store_cartitem_activity_au": "AFTER UPDATE OF quantity ON store_cartitem",
+}
+
+#same text format Django stores datetimes in on SQLite (UTC, no offset)
+_NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def get_config():
+    return {"TTL": None, "BACKEND": "sql", "ALIAS": None, "MAX_ENTRIES": 100000, **getattr(settings, "CARTS", {})}
+
+
+def has_activity_triggers(connection):
+    return connection.vendor == "sqlite"
+
+
+def install_activity_triggers(connection):
+    """Bump Cart.last_activity whenever an item is added or its quantity changes (SQLite).
+
+    A trigger keeps add-to-cart a single statement. Removing items doesn't
+    count as activity, so purging a cart's items can't make it look active.
+    """
+    if not has_activity_triggers(connection):
+        return False
+    with connection.cursor() as cursor:
+        #not migrated this far (yet)
+        columns = [column.name for column in connection.introspection.get_table_description(cursor, "store_cart")]
+        if "last_activity" not in columns:
+            return False
+        for name, event in ACTIVITY_TRIGGERS.items():
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN "
+                f"UPDATE store_cart SET last_activity = {_NOW_SQL} WHERE id = new.cart_id; END")
+    return True
+
+
+def uninstall_activity_triggers(connection):
+    if not has_activity_triggers(connection):
+        return
+    with connection.cursor() as cursor:
+        for name in ACTIVITY_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def cutoff(ttl=None):
+    """Carts with no activity since this moment have expired; `ttl` defaults to CARTS["TTL"]."""
+    return timezone.now() - (ttl or get_config()["TTL"])
+
+
+def expired(before):
+    #last_activity starts at creation, so a cart nobody added to expires TTL after it was created
+    return Cart.objects.filter(last_activity__lt=before)
+
+
+def count_expired(before):
+    """(carts, items) that a purge would delete."""
+    return expired(before).count(), CartItem.objects.filter(cart__in=expired(before)).count()
+
+
+def purge_chunk(ids, before):
+    """Delete the carts among `ids` still idle since `before`, with their items, in one transaction.
+
+    The items go first: that write takes the SQLite write lock before the
+    carts are read again, so a cart touched since `ids` were selected is kept.
+    """
+    with atomic():
+        still_expired = Cart.objects.filter(pk__in=ids, last_activity__lt=before)
+        items, _ = CartItem.objects.filter(cart__in=still_expired).delete()
+        _, deleted = still_expired.delete()
+    return deleted.get(Cart._meta.label, 0), items
+
+
+def purge(before, chunk_size=200, pause=0.0, progress=None):
+    """Delete every cart idle since `before`, chunk_size carts per transaction, sleeping `pause` seconds in between.
+
+    Returns (carts, items, seconds). `progress` is called with the running
+    totals after each chunk.
+    """
+    started = time.monotonic()
+    carts = items = 0
+    while True:
+        ids = list(expired(before).order_by("last_activity").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        chunk_carts, chunk_items = purge_chunk(ids, before)
+        carts += chunk_carts
+        items += chunk_items
+        if progress:
+            progress(carts, items, time.monotonic() - started)
+        if len(ids) < chunk_size:
+            break
+        if pause:
+            #lets waiting writers take the lock between chunks
+            time.sleep(pause)
+    return carts, items, time.monotonic() - started
@@ -0,0 +1,246 @@
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+from django.core.signals import setting_changed
+from django.db.transaction import atomic
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from store.cache import _MISSING, DjangoCatalogStore, LocalCatalogStore
+from store.carts import get_config
+from store.models import Cart, CartItem, Product
+
+BACKEND_SQL = "sql"
+BACKEND_LOCAL = "local"
+BACKEND_CACHE = "cache"
+
+#how long a writer may hold a cart's lock in a shared cache before it is considered gone;
+#the lock only covers reading and rewriting the entry, never SQL
+LOCK_TIMEOUT = 5
+#how long a request waits for another one's lock on the same cart before giving up with CartBusy
+LOCK_WAIT = 2
+
+
+class CartBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The cart is being changed by another request, please try again."
+    default_code = "cart_busy"
+
+
+class CartStore:
+    """Carts kept in a key-value store instead of the Cart and CartItem tables.
+
+    A cart is one entry, {"created_at", "next_id", "lines": {product id:
+    (item id, quantity)}}, rewritten whole on every change under a per-cart
+    lock. Entries expire CARTS["TTL"] after their last write, so abandoned
+    carts need no purge. Checkout materializes the lines into Cart and
+    CartItem rows inside the order transaction (see AddOrderSerializer).
+
+    The "local" backend lives in this process (one worker only); "cache" uses
+    the Django cache CARTS["ALIAS"], e.g. a FileBasedCache for a file-backed
+    store shared by the workers of one host, or memcached/redis across hosts.
+    """
+
+    def __init__(self):
+        self._store = None
+        self._guard = threading.Lock()
+        #cart id: (lock, number of requests holding or waiting for it)
+        self._locks = {}
+
+    @property
+    def enabled(self):
+        return get_config()["BACKEND"] != BACKEND_SQL
+
+    @property
+    def store(self):
+        if self._store is None:
+            config = get_config()
+            timeout = config["TTL"].total_seconds() if config["TTL"] else None
+            if config["BACKEND"] == BACKEND_CACHE:
+                self._store = DjangoCatalogStore(config["ALIAS"], timeout)
+            else:
+                self._store = LocalCatalogStore(config["MAX_ENTRIES"], timeout)
+        return self._store
+
+    def make_key(self, cart_id):
+        return f"cart:{cart_id}"
+
+    @contextmanager
+    def locked(self, cart_id):
+        """Hold the cart's own lock; raises CartBusy after waiting LOCK_WAIT seconds for it."""
+        if isinstance(self.store, LocalCatalogStore):
+            with self._local_lock(cart_id):
+                yield
+            return
+        #cache.add is atomic in every backend; a holder that died releases it after LOCK_TIMEOUT
+        key = f"{self.make_key(cart_id)}:lock"
+        deadline = time.monotonic() + LOCK_WAIT
+        while not self.store.cache.add(key, 1, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise CartBusy()
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            self.store.cache.delete(key)
+
+    @contextmanager
+    def _local_lock(self, cart_id):
+        with self._guard:
+            lock, users = self._locks.get(cart_id) or (threading.Lock(), 0)
+            self._locks[cart_id] = lock, users + 1
+        try:
+            if not lock.acquire(timeout=LOCK_WAIT):
+                raise CartBusy()
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            with self._guard:
+                lock, users = self._locks[cart_id]
+                if users == 1:
+                    del self._locks[cart_id]
+                else:
+                    self._locks[cart_id] = lock, users - 1
+
+    def load(self, cart_id):
+        entry = self.store.get(self.make_key(cart_id))
+        return None if entry is _MISSING else entry
+
+    def save(self, cart_id, entry):
+        self.store.set(self.make_key(cart_id), entry)
+
+    def create(self):
+        cart_id = uuid4()
+        entry = {"created_at": timezone.now(), "next_id": 1, "lines": {}}
+        self.save(cart_id, entry)
+        return self.build_cart(cart_id, entry)
+
+    def get(self, cart_id):
+        """The cart as an unsaved Cart, with `items` and `total_price` set, or None."""
+        entry = self.load(cart_id)
+        return None if entry is None else self.build_cart(cart_id, entry)
+
+    def lines(self, cart_id):
+        """{product id: quantity} of the cart, or None if there is no such cart."""
+        entry = self.load(cart_id)
+        return None if entry is None else self.entry_lines(entry)
+
+    def delete(self, cart_id):
+        """Remove the cart; True only for the caller that actually removed it."""
+        return self.store.delete(self.make_key(cart_id))
+
+    def claim(self, cart_id):
+        """Take the cart out of the store for checkout, returning its entry (None if it is gone).
+
+        Once claimed, no other request can add to the cart or check it out,
+        however long the SQL work takes; restore() puts it back if checkout fails.
+        """
+        with self.locked(cart_id):
+            entry = self.load(cart_id)
+            #delete() succeeds once, even for two claims whose locks overlapped
+            if entry is None or not self.delete(cart_id):
+                return None
+        return entry
+
+    def restore(self, cart_id, entry):
+        self.save(cart_id, entry)
+
+    def add_products(self, cart_id, quantities, require_all=False):
+        """Add quantities ({product id: quantity}) like CartItem.objects.add_products; None if the cart is gone.
+
+        Unknown products are skipped; with require_all, nothing is saved if
+        there are any, so the caller can reject the whole batch.
+        """
+        known = set(Product.objects.filter(pk__in=quantities).values_list("id", flat=True))
+        with self.locked(cart_id):
+            entry = self.load(cart_id)
+            if entry is None:
+                return None
+            lines, next_id = dict(entry["lines"]), entry["next_id"]
+            added = {}
+            for product_id, quantity in quantities.items():
+                if product_id not in known:
+                    continue
+                item_id, current = lines.get(product_id, (next_id, 0))
+                if item_id == next_id:
+                    next_id += 1
+                lines[product_id] = added[product_id] = (item_id, current + quantity)
+            if not require_all or len(known) == len(quantities):
+                self.save(cart_id, {**entry, "next_id": next_id, "lines": lines})
+        return [CartItem(id=item_id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+                for product_id, (item_id, quantity) in added.items()]
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        """Change one line's quantity; returns the item, or None if the cart or item is gone."""
+        with self.locked(cart_id):
+            entry = self.load(cart_id)
+            product_id = self._find(entry, item_id)
+            if product_id is None:
+                return None
+            self.save(cart_id, {**entry, "lines": {**entry["lines"], product_id: (item_id, quantity)}})
+        return CartItem(id=item_id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+
+    def remove(self, cart_id, item_id):
+        with self.locked(cart_id):
+            entry = self.load(cart_id)
+            product_id = self._find(entry, item_id)
+            if product_id is None:
+                return False
+            lines = dict(entry["lines"])
+            del lines[product_id]
+            self.save(cart_id, {**entry, "lines": lines})
+        return True
+
+    def _find(self, entry, item_id):
+        if entry is None:
+            return None
+        for product_id, (line_id, _) in entry["lines"].items():
+            if line_id == item_id:
+                return product_id
+        return None
+
+    def build_cart(self, cart_id, entry):
+        #one query for the products; lines of products deleted since are left out
+        products = Product.objects.only("id", "title", "unit_price", "collection_id").in_bulk(entry["lines"])
+        cart = Cart(id=cart_id, created_at=entry["created_at"])
+        cart.items = []
+        for product_id, (item_id, quantity) in sorted(entry["lines"].items(), key=lambda line: line[1][0]):
+            product = products.get(product_id)
+            if product is None:
+                continue
+            item = CartItem(id=item_id, cart_id=cart.id, product=product, quantity=quantity)
+            item.total_price = product.unit_price * quantity
+            cart.items.append(item)
+        cart.total_price = sum((item.total_price for item in cart.items), 0)
+        return cart
+
+    def materialize(self, cart_id, lines):
+        """Write the cart as Cart and CartItem rows, for checkout to run on; call it inside the order transaction."""
+        with atomic():
+            #the insert comes first so that, on SQLite, the write lock is taken before anything is read
+            cart = Cart.objects.create(id=cart_id)
+            known = Product.objects.filter(pk__in=lines).values_list("id", flat=True)
+            CartItem.objects.bulk_create([CartItem(cart=cart, product_id=product_id, quantity=lines[product_id])
+                                          for product_id in known])
+        return cart
+
+    def entry_lines(self, entry):
+        return {product_id: quantity for product_id, (_, quantity) in entry["lines"].items()}
+
+    def clear(self):
+        self._store = None
+
+
+cart_store = CartStore()
+
+
+@receiver(setting_changed)
+def reset_cart_store(setting, **kwargs):
+    if setting == "CARTS":
+        cart_store.clear()
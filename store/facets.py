@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+from rest_framework.exceptions import ValidationError
+
+FACETS = ("collection", "price")
+
+#lower bounds of the price buckets; the last one is open-ended
+PRICE_BUCKETS = [Decimal(bound) for bound in ("0", "10", "25", "50", "100", "250", "500")]
+
+#query parameters that change which page is shown but not which products match
+PAGE_PARAMS = ("cursor", "page", "ordering", "facets")
+
+
+def requested(request):
+    """Facet names asked for with ?facets=collection,price, in FACETS order."""
+    value = request.query_params.get("facets", "")
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = names - set(FACETS)
+    if unknown:
+        raise ValidationError({"facets": f"Unknown facet(s) {', '.join(sorted(unknown))}; choose from {', '.join(FACETS)}."})
+    return [name for name in FACETS if name in names]
+
+
+def price_bucket():
+    #index into PRICE_BUCKETS, tested from the highest bound down
+    whens = [When(unit_price__gte=bound, then=Value(index)) for index, bound in reversed(list(enumerate(PRICE_BUCKETS)))]
+    return Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def count(queryset, names):
+    """Counts of every requested facet over `queryset`, from one GROUP BY query.
+
+    The rows are grouped by all requested facets at once, and each facet's
+    counts are summed from those groups.
+    """
+    group_by = []
+    if "collection" in names:
+        group_by += ["collection_id", "collection__title"]
+    if "price" in names:
+        queryset = queryset.annotate(price_bucket=price_bucket())
+        group_by.append("price_bucket")
+    rows = queryset.prefetch_related(None).order_by().values(*group_by).annotate(products_count=Count("id"))
+
+    collections, prices = {}, [0] * len(PRICE_BUCKETS)
+    for row in rows:
+        if "collection" in names:
+            entry = collections.setdefault(
+                row["collection_id"], {"id": row["collection_id"], "title": row["collection__title"], "products_count": 0})
+            entry["products_count"] += row["products_count"]
+        if "price" in names:
+            prices[row["price_bucket"]] += row["products_count"]
+
+    result = {}
+    if "collection" in names:
+        result["collection"] = sorted(collections.values(), key=lambda entry: (-entry["products_count"], entry["title"]))
+    if "price" in names:
+        bounds = PRICE_BUCKETS + [None]
+        result["price"] = [{"min": bounds[index], "max": bounds[index + 1], "products_count": total}
+                           for index, total in enumerate(prices)]
+    return result
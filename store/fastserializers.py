@@ -0,0 +1,178 @@
+from decimal import Decimal, getcontext
+from operator import itemgetter
+
+from django.conf import settings
+from rest_framework import serializers
+
+from store import pricing
+from store.models import OrderItem, Product, ProductImage
+
+
+def get_config():
+    return {"ENABLED": True, **getattr(settings, "FAST_SERIALIZERS", {})}
+
+
+def enabled():
+    return get_config()["ENABLED"]
+
+
+#converters: called once per serializer with it, they return the function applied to the column's value
+
+def decimal(model, name):
+    """Quantize like the DecimalField a ModelSerializer builds for the model field (COERCE_DECIMAL_TO_STRING is off)."""
+    field = model._meta.get_field(name)
+    exponent = Decimal(".1") ** field.decimal_places
+
+    def bind(serializer):
+        context = getcontext().copy()
+        context.prec = field.max_digits
+        return lambda value: None if value is None else value.quantize(exponent, context=context)
+    return bind
+
+
+def file_url(model, name):
+    """The file's URL, absolute when there is a request, like DRF's FileField and ImageField."""
+    storage = model._meta.get_field(name).storage
+
+    def bind(serializer):
+        request = serializer.context.get("request")
+        if request is None:
+            return lambda value: storage.url(value) if value else None
+        return lambda value: request.build_absolute_uri(storage.url(value)) if value else None
+    return bind
+
+
+def nested(serializer_class, many=False):
+    """Another RowSerializer, given the column's value (many=True: a list of rows) or, without a column, the row itself."""
+    def bind(serializer):
+        child = serializer_class(context=serializer.context)
+        if many:
+            return lambda rows: [child.to_representation(row) for row in rows]
+        return child.to_representation
+    return bind
+
+
+class RowSerializer(serializers.BaseSerializer):
+    """Read-only serializer of .values() rows, for GET list and retrieve.
+
+    `fields` lists (output key, column, converter) in output order; the
+    column is a key of the row (None passes the whole row) and the converter
+    one of the factories above, or None to output the value as is. They are
+    compiled into one accessor per field the first time the serializer is
+    used, which skips DRF's per-field machinery (get_attribute, to_representation
+    and SkipField handling) on every row. `columns` is what the view passes
+    to .values(). Each subclass mirrors a ModelSerializer field for field,
+    which FastSerializerParityTests hold them to.
+    """
+    fields = ()
+    columns = ()
+
+    @property
+    def accessors(self):
+        if not hasattr(self, "_accessors"):
+            self._accessors = [(key, self.compile(column, convert)) for key, column, convert in self.fields]
+        return self._accessors
+
+    def compile(self, column, convert):
+        if convert is None:
+            return itemgetter(column)
+        convert = convert(self)
+        if column is None:
+            return convert
+        get = itemgetter(column)
+        return lambda row: convert(get(row))
+
+    def to_representation(self, row):
+        return {key: get(row) for key, get in self.accessors}
+
+
+class CollectionRowSerializer(RowSerializer):
+    #CollectionSerializer
+    columns = ("id", "title", "products_count")
+    fields = tuple((column, column, None) for column in columns)
+
+
+class ProductImageRowSerializer(RowSerializer):
+    #ProductImageSerializer
+    columns = ("id", *ProductImage.FILE_FIELDS)
+    fields = (("id", "id", None),
+              *((name, name, file_url(ProductImage, name)) for name in ProductImage.FILE_FIELDS))
+
+
+def attach_images(rows):
+    """Set "images" on product rows, from one query like prefetch_related("images")."""
+    images = {}
+    image_rows = ProductImage.objects.filter(product_id__in=[row["id"] for row in rows]).values(
+        "product_id", *ProductImageRowSerializer.columns)
+    for image in image_rows:
+        images.setdefault(image["product_id"], []).append(image)
+    for row in rows:
+        row["images"] = images.get(row["id"], [])
+    return rows
+
+
+class ProductRowListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        #a page's images and prices with one query each, as for ProductListSerializer
+        rows = list(data)
+        attach_images(rows)
+        pricing.attach_row_prices(rows)
+        return super().to_representation(rows)
+
+
+class ProductRowSerializer(RowSerializer):
+    #ProductSerializer; last_update is read for ?ordering=last_update cursors
+    columns = ("id", "title", "slug", "description", "unit_price", "inventory", "collection_id", "last_update")
+    fields = (
+        ("id", "id", None),
+        ("title", "title", None),
+        ("slug", "slug", None),
+        ("description", "description", None),
+        ("unit_price", "unit_price", decimal(Product, "unit_price")),
+        ("inventory", "inventory", None),
+        ("collection", "collection_id", None),
+        ("price_with_tax", "price_with_tax", None),
+        ("images", "images", nested(ProductImageRowSerializer, many=True)),
+    )
+
+    class Meta:
+        list_serializer_class = ProductRowListSerializer
+
+    def to_representation(self, row):
+        if "images" not in row:
+            attach_images([row])
+            pricing.attach_row_prices([row])
+        return super().to_representation(row)
+
+
+class CartProductRowSerializer(RowSerializer):
+    #CustomProductSerializer, read off a cart item row
+    fields = (
+        ("id", "product_id", None),
+        ("title", "product__title", None),
+        ("unit_price", "product__unit_price", decimal(Product, "unit_price")),
+        ("collection", "product__collection_id", None),
+    )
+
+
+class CartItemRowSerializer(RowSerializer):
+    #CartItemSerializer, over CartItem.objects.with_totals()
+    columns = ("id", "product_id", "product__title", "product__unit_price", "product__collection_id", "quantity", "total_price")
+    fields = (
+        ("id", "id", None),
+        ("product", None, nested(CartProductRowSerializer)),
+        ("quantity", "quantity", None),
+        ("total_price", "total_price", None),
+    )
+
+
+class OrderItemRowSerializer(RowSerializer):
+    #OrderItemSerializer
+    columns = ("id", "order_id", "unit_price", "product_id", "quantity")
+    fields = (
+        ("id", "id", None),
+        ("order_id", "order_id", None),
+        ("unit_price", "unit_price", decimal(OrderItem, "unit_price")),
+        ("product", "product_id", None),
+        ("quantity", "quantity", None),
+    )
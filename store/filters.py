@@ -1,10 +1,63 @@
-from django_filters.rest_framework import FilterSet
-from store.models import Product
+from django_filters.rest_framework import BaseInFilter, CharFilter, DateFilter, DateTimeFilter, FilterSet
+from rest_framework.filters import SearchFilter
+from store.models import DailyCollectionSales, DailyProductSales, Order, Product
+from store import search, tagsets
 
 class ProductFilter(FilterSet):
+    #?tags=a,b matches products carrying every tag, ?tags_any=a,b those carrying at least one
+    tags = CharFilter(method="filter_tags")
+    tags_any = CharFilter(method="filter_tags")
+
+    def filter_tags(self, queryset, name, value):
+        labels = [label for label in value.split(",") if label.strip()]
+        if not labels:
+            return queryset
+        return tagsets.filter_products(queryset, tagsets.tag_sets.matching(labels, match_all=name == "tags"))
+
     class Meta:
         model = Product
         fields = {
             'collection_id':['exact'],
             'unit_price':['gt','lt']
-        }
\ No newline at end of file
+        }
+
+class PaymentStatusInFilter(BaseInFilter, CharFilter):
+    pass
+
+class OrderExportFilter(FilterSet):
+    #?placed_after=2024-01-01&placed_before=2024-02-01T00:00:00Z&payment_status=C,P
+    placed_after = DateTimeFilter(field_name="placed_at",lookup_expr="gte")
+    placed_before = DateTimeFilter(field_name="placed_at",lookup_expr="lt")
+    payment_status = PaymentStatusInFilter(field_name="payment_status",lookup_expr="in")
+
+    class Meta:
+        model = Order
+        fields = ["placed_after","placed_before","payment_status"]
+
+class DailySalesFilter(FilterSet):
+    #?date_after=2024-01-01&date_before=2024-01-31 (both inclusive)
+    date_after = DateFilter(field_name="date",lookup_expr="gte")
+    date_before = DateFilter(field_name="date",lookup_expr="lte")
+
+class DailyProductSalesFilter(DailySalesFilter):
+    class Meta:
+        model = DailyProductSales
+        fields = ["product_id","collection_id"]
+
+class DailyCollectionSalesFilter(DailySalesFilter):
+    class Meta:
+        model = DailyCollectionSales
+        fields = ["collection_id"]
+
+class ProductSearchFilter(SearchFilter):
+    #serves ?search= from the FTS5 index, falling back to icontains lookups when it isn't installed
+    def filter_queryset(self, request, queryset, view):
+        if not search.is_available():
+            return super().filter_queryset(request, queryset, view)
+        terms = request.query_params.get(self.search_param, "")
+        if not terms.strip():
+            return queryset
+        queryset = search.search_products(queryset, terms)
+        if "search_rank" not in queryset.query.annotations:
+            return queryset
+        return queryset.order_by("search_rank", "id")
@@ -0,0 +1,77 @@
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from store.models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+#name -> (bounding box or None for full size, output format or None to keep the original's)
+DERIVATIVES = {
+    "thumbnail": ((200, 200), None),
+    "medium": ((800, 800), None),
+    "webp": (None, "WEBP"),
+}
+
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+
+
+def render_derivatives(data):
+    """Render every derivative of an encoded image; returns {name: (bytes, extension)}.
+
+    Works on bytes only, without Django, so it can run in a worker process.
+    """
+    results = {}
+    with Image.open(BytesIO(data)) as original:
+        source_format = original.format if original.format in EXTENSIONS else "JPEG"
+        original = ImageOps.exif_transpose(original)
+        for name, (size, output_format) in DERIVATIVES.items():
+            output_format = output_format or source_format
+            image = original.copy()
+            if size:
+                image.thumbnail(size)
+            if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            buffer = BytesIO()
+            image.save(buffer, output_format, quality=82, optimize=True)
+            results[name] = (buffer.getvalue(), EXTENSIONS[output_format])
+    return results
+
+
+def read_original(product_image):
+    with product_image.image.open("rb") as file:
+        return file.read()
+
+
+def save_derivatives(product_image, rendered):
+    #the storage names files by content hash; only the extension of this name is kept
+    for name, (data, extension) in rendered.items():
+        getattr(product_image, name).save(f"{name}.{extension}", ContentFile(data), save=False)
+    product_image.derivatives_status = ProductImage.DERIVATIVES_READY
+    product_image.save(update_fields=[*rendered, "derivatives_status"])
+
+
+def process_pending(executor, batch_size=20):
+    """Render the derivatives of one batch of pending images on `executor`; returns (ready, failed)."""
+    images = list(ProductImage.objects.filter(derivatives_status=ProductImage.DERIVATIVES_PENDING).order_by("id")[:batch_size])
+    futures = []
+    for product_image in images:
+        try:
+            futures.append((product_image, executor.submit(render_derivatives, read_original(product_image))))
+        except OSError as error:
+            futures.append((product_image, error))
+
+    ready = failed = 0
+    for product_image, future in futures:
+        try:
+            if isinstance(future, Exception):
+                raise future
+            save_derivatives(product_image, future.result())
+            ready += 1
+        except Exception:
+            logger.exception("Could not render derivatives of product image %s", product_image.pk)
+            ProductImage.objects.filter(pk=product_image.pk).update(derivatives_status=ProductImage.DERIVATIVES_FAILED)
+            failed += 1
+    return ready, failed
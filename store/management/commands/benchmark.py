@@ -0,0 +1,79 @@
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from store import benchmark
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway SQLite database and measure the store API routes in-process: "
+            "p50/p95/p99 latency, throughput and SQL queries per scenario, written as JSON for diffing.")
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_SCALE.items():
+            parser.add_argument(f"--{name}", type=int, default=default, help=f"Rows to seed (default {default}).")
+        parser.add_argument("--iterations", type=int, default=200, help="Timed requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=20, help="Untimed requests per scenario.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the dataset and of the request mix.")
+        parser.add_argument("--scenario", action="append", dest="scenarios", help="Only run this scenario (repeatable).")
+        parser.add_argument("--database", default=str(settings.BASE_DIR / "benchmark.sqlite3"),
+                            help="SQLite file to seed; never the configured database.")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the seeded database and reuse it on the next run.")
+        parser.add_argument("--no-cache", action="store_true", help="Disable the catalog cache.")
+        parser.add_argument("--output", help="Write the JSON report here.")
+        parser.add_argument("--compare", help="Report from an earlier run to diff against.")
+        parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression.")
+        parser.add_argument("--fail-on-regression", action="store_true", help="Exit non-zero when a metric regressed.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The benchmark runs against SQLite only.")
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = options["database"]
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        #seeded image files go to a scratch MEDIA_ROOT; no scenario reads them back
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, "ENABLED": not options["no_cache"]},
+                                   MEDIA_ROOT=media_root):
+                report = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        for name, result in report["scenarios"].items():
+            self.stdout.write(f"{name:24} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+                              f"p99 {result['p99_ms']:8.2f}ms  {result['throughput_rps']:8.1f} req/s  "
+                              f"{result['queries_mean']:5.1f} queries  {result['errors']} errors")
+        if options["output"]:
+            benchmark.dump(report, options["output"])
+            self.stdout.write(f"Wrote {options['output']}.")
+        if options["compare"]:
+            self.report_comparison(report, options)
+
+    def run_benchmark(self, options):
+        if not Product.objects.exists():
+            scale = {name: options[name] for name in benchmark.DEFAULT_SCALE}
+            self.stderr.write(f"Seeding {scale}...")
+            benchmark.seed(scale, options["seed"])
+        return benchmark.run(options["iterations"], options["warmup"], options["seed"], options["scenarios"])
+
+    def report_comparison(self, report, options):
+        with open(options["compare"]) as file:
+            baseline = json.load(file)
+        regressions = 0
+        for name, metric, before, after, change, regressed in benchmark.compare(baseline, report, options["threshold"]):
+            line = f"{name:24} {metric:15} {before:10} -> {after:10} ({change:+.1%})"
+            if regressed:
+                regressions += 1
+                line = self.style.ERROR(line + "  REGRESSION")
+            self.stdout.write(line)
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(f"{regressions} metric(s) regressed by more than {options['threshold']:.0%}.")
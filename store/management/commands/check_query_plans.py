@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from store import queryplans
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the hot store queries against this database and fail if any plan scans or stops using its expected index. "
+            "Run it after ANALYZE on production-sized data, where SQLite may pick different plans than in tests.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Print the plan of every query, not only failures.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The plan check reads SQLite's EXPLAIN QUERY PLAN output.")
+        if options["verbose_plans"]:
+            for query in queryplans.HOT_QUERIES:
+                self.stdout.write(f"{query.name}:\n  " + "\n  ".join(queryplans.explain(query.build())))
+        failures = queryplans.check()
+        for name, plan, problems in failures:
+            self.stderr.write(f"{name}: {'; '.join(problems)}\n  plan: {' | '.join(plan)}")
+        if failures:
+            raise CommandError(f"{len(failures)} of {len(queryplans.HOT_QUERIES)} hot queries are not served by their index.")
+        self.stdout.write(self.style.SUCCESS(f"All {len(queryplans.HOT_QUERIES)} hot queries use their index."))
@@ -0,0 +1,29 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import product_io
+
+
+class Command(BaseCommand):
+    help = "Write every product as CSV or JSON lines, in the format import_products reads back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to write, or - for stdout.")
+        parser.add_argument("--format", choices=product_io.FORMATS, help="Default: from the file extension (csv unless .jsonl/.ndjson).")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched from the database at a time.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or product_io.detect_format(path)
+        started = time.monotonic()
+        rows = product_io.export_rows(options["chunk_size"])
+        if path == "-":
+            written = product_io.write_rows(self.stdout, rows, file_format)
+        else:
+            with open(path, "w", newline="", encoding="utf-8") as file:
+                written = product_io.write_rows(file, rows, file_format)
+        elapsed = time.monotonic() - started
+        (self.stderr if path == "-" else self.stdout).write(self.style.SUCCESS(
+            f"Exported {written} rows in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f} rows/s)."))
@@ -0,0 +1,45 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import product_io
+
+
+class Command(BaseCommand):
+    help = ("Create or update products from a CSV or JSON lines file, matching existing products by slug. "
+            "Rows name their collection by collection_id or by title; unknown titles are created.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or - for stdin.")
+        parser.add_argument("--format", choices=product_io.FORMATS, help="Default: from the file extension (csv unless .jsonl/.ndjson).")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows written per transaction.")
+        parser.add_argument("--progress-every", type=int, default=100000, help="Report progress every N rows.")
+        parser.add_argument("--max-errors", type=int, default=20, help="Invalid rows listed in the summary.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or product_io.detect_format(path)
+        started = time.monotonic()
+        next_report = options["progress_every"]
+
+        def progress(importer):
+            nonlocal next_report
+            if importer.read >= next_report:
+                next_report += options["progress_every"]
+                elapsed = time.monotonic() - started
+                self.stderr.write(f"{importer.read} rows ({importer.read / elapsed:.0f} rows/s)")
+
+        importer = product_io.ProductImporter(options["batch_size"])
+        if path == "-":
+            importer.run(product_io.read_rows(sys.stdin, file_format), progress)
+        else:
+            with open(path, newline="", encoding="utf-8") as file:
+                importer.run(product_io.read_rows(file, file_format), progress)
+
+        elapsed = time.monotonic() - started
+        for line_number, message in importer.errors[:options["max_errors"]]:
+            self.stderr.write(f"Line {line_number}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.read} rows in {elapsed:.1f}s ({importer.read / max(elapsed, 1e-9):.0f} rows/s): "
+            f"{importer.created} created, {importer.updated} updated, {len(importer.errors)} skipped."))
@@ -0,0 +1,33 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from store import images
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Render thumbnail, medium and WebP derivatives of pending product images in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to sleep when nothing is pending.")
+        parser.add_argument("--once", action="store_true", help="Process what is pending and exit.")
+        parser.add_argument("--backfill", action="store_true",
+                            help="Queue every image again first, e.g. after changing the derivative sizes.")
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            queued = ProductImage.objects.update(derivatives_status=ProductImage.DERIVATIVES_PENDING)
+            self.stdout.write(f"Queued {queued} image(s).")
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            while True:
+                ready, failed = images.process_pending(executor, options["batch_size"])
+                if ready or failed:
+                    self.stdout.write(f"Rendered {ready} image(s), {failed} failed.")
+                    continue
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
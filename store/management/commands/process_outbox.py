@@ -0,0 +1,32 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver outbox events (e.g. order_created) to their signal receivers in batches, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--workers", type=int, default=4, help="Threads running receivers concurrently.")
+        parser.add_argument("--max-attempts", type=int, default=5)
+        parser.add_argument("--backoff", type=float, default=5.0, help="Seconds before the first retry; doubles per attempt.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument("--once", action="store_true", help="Drain the due events and exit.")
+
+    def handle(self, *args, **options):
+        backoff = timedelta(seconds=options["backoff"])
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            while True:
+                delivered, retried, failed = outbox.process_batch(
+                    executor, options["batch_size"], options["max_attempts"], backoff)
+                if delivered or retried or failed:
+                    self.stdout.write(f"Delivered {delivered}, retrying {retried}, failed {failed}.")
+                    continue
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
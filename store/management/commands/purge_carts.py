@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from store import carts
+
+
+class Command(BaseCommand):
+    help = ("Delete carts with no activity for CARTS['TTL'] (or --ttl-days), with their items, in small transactions "
+            "so add-to-cart and checkout writes keep getting the database between chunks.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl-days", type=float, help="Override CARTS['TTL'].")
+        parser.add_argument("--chunk-size", type=int, default=200, help="Carts deleted per transaction.")
+        parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between chunks.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the expired carts and items.")
+        parser.add_argument("--loop", action="store_true", help="Keep purging, every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=300.0)
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        ttl = timedelta(days=options["ttl_days"]) if options["ttl_days"] is not None else None
+        if options["dry_run"]:
+            expired_carts, expired_items = carts.count_expired(carts.cutoff(ttl))
+            self.stdout.write(f"{expired_carts} cart(s) with {expired_items} item(s) would be deleted.")
+            return
+        while True:
+            deleted_carts, deleted_items, seconds = carts.purge(
+                carts.cutoff(ttl), options["chunk_size"], options["pause"], self.report_progress)
+            rows = deleted_carts + deleted_items
+            rate = rows / seconds if seconds else 0.0
+            self.stdout.write(self.style.SUCCESS(
+                f"Deleted {deleted_carts} cart(s) and {deleted_items} item(s) in {seconds:.1f}s ({rate:.0f} rows/s)."))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
+
+    def report_progress(self, deleted_carts, deleted_items, seconds):
+        if self.verbosity > 1:
+            rate = (deleted_carts + deleted_items) / seconds if seconds else 0.0
+            self.stdout.write(f"  {deleted_carts} cart(s), {deleted_items} item(s), {rate:.0f} rows/s")
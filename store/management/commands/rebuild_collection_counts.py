@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = ("Recompute the denormalized Collection.products_count from the product table. "
+            "Needed after queryset.update(collection=...) or bulk_create(), which bypass the counter signals.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("collection_ids",nargs="*",type=int,help="Only rebuild these collections.")
+
+    def handle(self, *args, **options):
+        collection_ids = options["collection_ids"] or None
+        updated = Collection.rebuild_products_count(collection_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt products_count for {updated} collection(s)."))
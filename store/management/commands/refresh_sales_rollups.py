@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import sales
+
+
+class Command(BaseCommand):
+    help = ("Update the daily product and collection sales rollups from the orders changed since the last run. "
+            "Schedule it (e.g. every few minutes); --full rebuilds every day from scratch.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Rebuild all rollups; they read as empty until it finishes.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        days = sales.refresh(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {len(days)} day(s) in {time.monotonic() - started:.1f}s."))
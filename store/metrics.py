@@ -0,0 +1,274 @@
+import contextvars
+import heapq
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "easycart"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+#name -> (help, buckets); each is labelled by view and method
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("Request latency, from the first middleware to the response.", DURATION_BUCKETS),
+    "db_queries_per_request": ("SQL queries run by one request.", QUERY_COUNT_BUCKETS),
+    "db_query_duration_seconds": ("Total time one request spent in SQL queries.", DURATION_BUCKETS),
+    "serializer_duration_seconds": ("Total time one request spent building serializer data.", DURATION_BUCKETS),
+}
+
+RESPONSES = "http_responses_total"
+
+TOP_QUERIES = 5
+
+#anything else is reported as OTHER to keep the label set bounded
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+_current = contextvars.ContextVar("store_metrics_request", default=None)
+
+
+def get_config():
+    return {"ENABLED": True, "DIRECTORY": None, "FLUSH_INTERVAL": 5.0, "SLOW_REQUEST_SECONDS": 1.0, "TOKEN": None,
+            **getattr(settings, "METRICS", {})}
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms and counters of this process, keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, view, method, status, values):
+        labels = (view, method)
+        with self._lock:
+            for name, value in values.items():
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[name, labels] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+            key = (RESPONSES, (view, method, str(status)))
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "histograms": [[name, list(labels), list(h.counts), h.sum, h.count] for (name, labels), h in self.histograms.items()],
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+            }
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+registry = Registry()
+_last_flush = [0.0]
+
+
+def flush(directory):
+    """Write this process's totals to DIRECTORY/<pid>.json for the /metrics view of any worker to merge."""
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    with os.fdopen(fd, "w") as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(temp_path, os.path.join(directory, f"{os.getpid()}.json"))
+    _last_flush[0] = time.monotonic()
+
+
+def collect():
+    """Totals of every worker: the snapshots in DIRECTORY plus this process's live registry."""
+    directory = get_config()["DIRECTORY"]
+    snapshots = [registry.snapshot()]
+    if directory and os.path.isdir(directory):
+        own = f"{os.getpid()}.json"
+        for filename in os.listdir(directory):
+            if filename.endswith(".json") and filename != own:
+                try:
+                    with open(os.path.join(directory, filename)) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+    histograms, counters = {}, {}
+    for snapshot in snapshots:
+        for name, labels, counts, total, count in snapshot["histograms"]:
+            merged = histograms.setdefault((name, tuple(labels)), [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+        for name, labels, value in snapshot["counters"]:
+            counters[name, tuple(labels)] = counters.get((name, tuple(labels)), 0) + value
+    return histograms, counters
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus():
+    """The merged metrics in the Prometheus text exposition format (version 0.0.4)."""
+    histograms, counters = collect()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} histogram"]
+        for (series, (view, method)), (counts, total, count) in sorted(histograms.items()):
+            if series != name:
+                continue
+            labels = f'view="{_escape(view)}",method="{method}"'
+            cumulative = 0
+            for bound, bucket_count in zip([*map(str, buckets), "+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f'{PREFIX}_{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{PREFIX}_{name}_sum{{{labels}}} {total}")
+            lines.append(f"{PREFIX}_{name}_count{{{labels}}} {count}")
+    lines += [f"# HELP {PREFIX}_{RESPONSES} Responses by view, method and status code.", f"# TYPE {PREFIX}_{RESPONSES} counter"]
+    for (_, (view, method, status)), value in sorted(counters.items()):
+        lines.append(f'{PREFIX}_{RESPONSES}{{view="{_escape(view)}",method="{method}",status="{status}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """What one request spent in SQL and serializers; the slowest queries are kept for the slow log."""
+
+    __slots__ = ("queries", "query_time", "serializer_time", "serializer_depth", "top_queries")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.top_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.query_time += duration
+            #a bounded min-heap, so the SQL text is only kept for the slowest few
+            if len(self.top_queries) < TOP_QUERIES:
+                heapq.heappush(self.top_queries, (duration, self.queries, sql))
+            elif duration > self.top_queries[0][0]:
+                heapq.heapreplace(self.top_queries, (duration, self.queries, sql))
+
+
+def instrument_serializers():
+    """Time BaseSerializer.data, the point where DRF turns instances into primitives.
+
+    Nested serializers and ListSerializer call into it again, so only the
+    outermost call of a request is counted.
+    """
+    from rest_framework.serializers import BaseSerializer, ListSerializer
+
+    for cls in (BaseSerializer, ListSerializer):
+        original = cls.__dict__["data"].fget
+        if getattr(original, "instrumented", False):
+            continue
+
+        def data(self, original=original):
+            metrics = _current.get()
+            if metrics is None:
+                return original(self)
+            metrics.serializer_depth += 1
+            started = time.perf_counter()
+            try:
+                return original(self)
+            finally:
+                metrics.serializer_depth -= 1
+                if metrics.serializer_depth == 0:
+                    metrics.serializer_time += time.perf_counter() - started
+
+        data.instrumented = True
+        setattr(cls, "data", property(data))
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """Records latency, SQL count and time, and serializer time per (view, method).
+
+    Place it first in MIDDLEWARE so the other middleware are timed too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        if not config["ENABLED"]:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+
+        view = view_label(request)
+        method = request.method if request.method in METHODS else "OTHER"
+        registry.observe(view, method, response.status_code, {
+            "http_request_duration_seconds": duration,
+            "db_queries_per_request": metrics.queries,
+            "db_query_duration_seconds": metrics.query_time,
+            "serializer_duration_seconds": metrics.serializer_time,
+        })
+        if duration >= config["SLOW_REQUEST_SECONDS"]:
+            top = sorted(metrics.top_queries, reverse=True)
+            logger.warning(
+                "Slow request %s %s (%s) took %.3fs: %d queries in %.3fs, serializers %.3fs. Slowest queries:\n%s",
+                request.method, request.path, view, duration, metrics.queries, metrics.query_time, metrics.serializer_time,
+                "\n".join(f"  {query_duration * 1000:.1f}ms  {sql[:500]}" for query_duration, _, sql in top))
+        if config["DIRECTORY"] and time.monotonic() - _last_flush[0] >= config["FLUSH_INTERVAL"]:
+            flush(config["DIRECTORY"])
+        return response
+
+
+@receiver(setting_changed)
+def reset_metrics(setting, **kwargs):
+    if setting == "METRICS":
+        registry.clear()
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from store import search
+
+
+def create_search_index(apps, schema_editor):
+    if search.install(schema_editor.connection):
+        search.rebuild(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
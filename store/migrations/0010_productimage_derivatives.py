@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='derivatives_status',
+            field=models.CharField(choices=[('P', 'Pending'), ('R', 'Ready'), ('F', 'Failed')], db_index=True, default='P', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='medium',
+            field=models.ImageField(blank=True, editable=False, upload_to='store/images/derivatives'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='store/images/derivatives'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='store/images/derivatives'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:17
+
+import store.storage
+import store.validators
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_existing_references(apps, schema_editor):
+    ProductImage = apps.get_model('store', 'ProductImage')
+    StoredBlob = apps.get_model('store', 'StoredBlob')
+    fields = ('image', 'thumbnail', 'medium', 'webp')
+    references = Counter(name for row in ProductImage.objects.values_list(*fields).iterator() for name in row if name)
+    StoredBlob.objects.bulk_create(
+        [StoredBlob(name=name, references=count) for name, count in references.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_productimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('references', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=store.storage.ContentAddressedStorage(), upload_to='store/images', validators=[store.validators.validate_file_size]),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='medium',
+            field=models.ImageField(blank=True, editable=False, storage=store.storage.ContentAddressedStorage(), upload_to='store/images/derivatives'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, storage=store.storage.ContentAddressedStorage(), upload_to='store/images/derivatives'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='webp',
+            field=models.ImageField(blank=True, editable=False, storage=store.storage.ContentAddressedStorage(), upload_to='store/images/derivatives'),
+        ),
+        migrations.RunPython(count_existing_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+from store import carts
+
+
+def copy_created_at(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(last_activity=models.F('created_at'))
+
+
+def install_activity_triggers(apps, schema_editor):
+    carts.install_activity_triggers(schema_editor.connection)
+
+
+def uninstall_activity_triggers(apps, schema_editor):
+    carts.uninstall_activity_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.RunPython(install_activity_triggers, uninstall_activity_triggers),
+    ]
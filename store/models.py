@@ -1,17 +1,35 @@
-from django.db import models
+from django.db import connections, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.transaction import atomic
 from uuid import uuid4
 from django.conf import settings
 from django.contrib import admin
+from django.utils import timezone
 
+from store.storage import content_addressed_storage
 from store.validators import validate_file_size
 # Create your models here.
 #Product
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(to="Product",null=True,related_name="+",on_delete=models.SET_NULL)
+    products_count = models.PositiveIntegerField(default=0,editable=False)
 
     def __str__(self) -> str:
         return self.title
+
+    @classmethod
+    def rebuild_products_count(cls,collection_ids=None):
+        #recompute the denormalized counter from the product table in a single UPDATE.
+        #Product signals keep it current for save()/delete(); queryset.update(collection=...)
+        #and bulk_create() bypass them, so run this for the affected collections afterwards.
+        counts = (Product.objects.filter(collection=OuterRef("pk"))
+                  .order_by().values("collection").annotate(count=Count("id")).values("count"))
+        collections = cls.objects.all()
+        if collection_ids is not None:
+            collections = collections.filter(pk__in=collection_ids)
+        return collections.update(products_count=Coalesce(Subquery(counts),0))
     
     class Meta:
         ordering = ["title"]
@@ -32,13 +50,78 @@ class Product(models.Model):
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #remember the stored collection so a move can be detected on save;
+        #when it was deferred the pre_save handler looks it up instead
+        if "collection_id" in field_names:
+            instance._loaded_collection_id = instance.collection_id
+        return instance
+
+    def save(self, *args, **kwargs):
+        #keep the row and the collection counters (post_save handler) in one transaction
+        with atomic():
+            super().save(*args, **kwargs)
     
     class Meta:
         ordering = ["title"]
+        indexes = [
+            #keyset pagination seeks on (ordering field, id)
+            models.Index(fields=["unit_price","id"]),
+            models.Index(fields=["last_update","id"]),
+            #ProductFilter: ?collection_id= with a unit_price range, paged in price order
+            models.Index(fields=["collection","unit_price","id"]),
+            #the default ordering, used by the admin changelist
+            models.Index(fields=["title","id"]),
+        ]
 
 class ProductImage(models.Model):
+    DERIVATIVES_PENDING = 'P'
+    DERIVATIVES_READY = 'R'
+    DERIVATIVES_FAILED = 'F'
+
+    DERIVATIVES_STATUS_OPTIONS = [
+        (DERIVATIVES_PENDING,"Pending"),
+        (DERIVATIVES_READY,"Ready"),
+        (DERIVATIVES_FAILED,"Failed")
+    ]
+
+    FILE_FIELDS = ("image","thumbnail","medium","webp")
+
     product = models.ForeignKey(to=Product,on_delete=models.CASCADE,related_name="images")
-    image = models.ImageField(upload_to="store/images",validators=[validate_file_size])
+    #files are named by content hash, so identical uploads share one file (see StoredBlob)
+    image = models.ImageField(upload_to="store/images",storage=content_addressed_storage,validators=[validate_file_size])
+    #filled in by the process_image_derivatives worker (see store/images.py)
+    thumbnail = models.ImageField(upload_to="store/images/derivatives",storage=content_addressed_storage,blank=True,editable=False)
+    medium = models.ImageField(upload_to="store/images/derivatives",storage=content_addressed_storage,blank=True,editable=False)
+    webp = models.ImageField(upload_to="store/images/derivatives",storage=content_addressed_storage,blank=True,editable=False)
+    derivatives_status = models.CharField(max_length=1,choices=DERIVATIVES_STATUS_OPTIONS,default=DERIVATIVES_PENDING,db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #remember the stored file names so replaced files can be released on save
+        instance._loaded_files = {name: instance.__dict__[name] for name in cls.FILE_FIELDS if name in field_names}
+        return instance
+
+    def save(self, *args, **kwargs):
+        #keep the row and the blob reference counts (post_save handler) in one transaction
+        with atomic():
+            super().save(*args, **kwargs)
+
+class StoredBlob(models.Model):
+    """Number of ProductImage file fields pointing at a content-addressed file.
+
+    Maintained by the ProductImage signal handlers; the file is deleted once
+    the count drops to zero. Queryset update() and bulk operations bypass it.
+    """
+    name = models.CharField(max_length=255,unique=True)
+    references = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
     
 class Customer(models.Model):
     GOLD_MEMBERSHIP = 'G'
@@ -80,9 +163,17 @@ class Order(models.Model):
         (PAYMENT_COMPLETE,"Complete")
     ]
 
-    placed_at = models.DateTimeField(auto_now_add=True)
+    placed_at = models.DateTimeField(auto_now_add=True,db_index=True)
     customer = models.ForeignKey(to=Customer,on_delete=models.PROTECT)
     payment_status = models.CharField(max_length=1,choices=PAYMENT_STATUS_OPTIONS,default=PAYMENT_PENDING)
+    #also bumped when an item changes; the sales rollup job reads orders changed since its watermark
+    updated_at = models.DateTimeField(auto_now=True,db_index=True)
+
+    class Meta:
+        indexes = [
+            #a customer's order history by date
+            models.Index(fields=["customer","placed_at"]),
+        ]
 
 class OrderItem(models.Model):
     order = models.ForeignKey(to=Order,on_delete=models.PROTECT)
@@ -90,15 +181,91 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=8,decimal_places=2)
 
+def _line_total(prefix=""):
+    return ExpressionWrapper(F(f"{prefix}quantity") * F(f"{prefix}product__unit_price"),
+                             output_field=DecimalField(max_digits=12,decimal_places=2))
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        #product summary joined in and quantity * unit_price computed by the database
+        return self.select_related("product").annotate(total_price=_line_total())
+
+    def add_products(self,cart_id,quantities):
+        """Add quantities ({product_id: quantity}) to a cart, inserting or incrementing one row per product.
+
+        Unknown product ids are skipped, so callers compare the returned items
+        against what they asked for.
+        """
+        self._for_write = True
+        connection = connections[self.db]
+        if connection.vendor in ("sqlite","postgresql") and connection.features.can_return_rows_from_bulk_insert:
+            items = self._upsert(connection,cart_id,quantities)
+        else:
+            items = self._add_products_in_steps(cart_id,quantities)
+        Cart.objects.using(self.db).touch(cart_id)
+        return items
+
+    def _upsert(self,connection,cart_id,quantities):
+        #a single INSERT ... ON CONFLICT DO UPDATE: one round trip, and concurrent adds
+        #of the same product increment the row instead of racing on unique_together
+        table = self.model._meta.db_table
+        rows = ", ".join(["(CAST(%s AS bigint), CAST(%s AS integer))"] * len(quantities))
+        sql = (
+            f"WITH incoming(product_id, quantity) AS (VALUES {rows}) "
+            f"INSERT INTO {table} (cart_id, product_id, quantity) "
+            f"SELECT %s, incoming.product_id, incoming.quantity FROM incoming "
+            f"JOIN {Product._meta.db_table} AS product ON product.id = incoming.product_id "
+            f"ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity "
+            f"RETURNING id, product_id, quantity"
+        )
+        params = [value for item in quantities.items() for value in item]
+        params.append(self.model._meta.get_field("cart").get_db_prep_value(cart_id,connection))
+        with connection.cursor() as cursor:
+            cursor.execute(sql,params)
+            returned = cursor.fetchall()
+        return [self.model(id=id,cart_id=cart_id,product_id=product_id,quantity=quantity) for id,product_id,quantity in returned]
+
+    def _add_products_in_steps(self,cart_id,quantities):
+        with atomic(using=self.db):
+            existing = set(Product.objects.using(self.db).filter(pk__in=quantities).values_list("id",flat=True))
+            wanted = {product_id:quantity for product_id,quantity in quantities.items() if product_id in existing}
+            items = list(self.select_for_update().filter(cart_id=cart_id,product_id__in=wanted))
+            for item in items:
+                item.quantity = F("quantity") + wanted[item.product_id]
+            self.bulk_update(items,["quantity"])
+            updated = {item.product_id for item in items}
+            self.bulk_create([self.model(cart_id=cart_id,product_id=product_id,quantity=quantity)
+                              for product_id,quantity in wanted.items() if product_id not in updated])
+            return list(self.filter(cart_id=cart_id,product_id__in=wanted))
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        #cart total as a SQL aggregate, items with their line totals in one prefetch query
+        items = Prefetch("cartitem_set",queryset=CartItem.objects.with_totals().order_by("id"))
+        return self.annotate(
+            total_price=Coalesce(Sum(_line_total("cartitem__")),0,output_field=DecimalField(max_digits=12,decimal_places=2))
+        ).prefetch_related(items)
+
+    def touch(self,cart_id):
+        #on SQLite, triggers on store_cartitem do this as part of the item write (see store/carts.py)
+        if connections[self.db].vendor != "sqlite":
+            self.filter(pk=cart_id).update(last_activity=timezone.now())
+
 class Cart(models.Model):
     id = models.UUIDField(default=uuid4,primary_key=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    #bumped when an item is added or changed (see store/carts.py); carts idle for CARTS["TTL"] are purged
+    last_activity = models.DateTimeField(default=timezone.now,db_index=True)
+
+    objects = CartQuerySet.as_manager()
 
 class CartItem(models.Model):
     cart = models.ForeignKey(to=Cart,on_delete=models.CASCADE)
     product = models.ForeignKey(to=Product,on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'product')
 
@@ -110,4 +277,69 @@ class Address(models.Model):
     zipcode = models.CharField(max_length=30)
 
 
+class OutboxEvent(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+
+    STATUS_OPTIONS = [
+        (STATUS_PENDING,"Pending"),
+        (STATUS_DONE,"Done"),
+        (STATUS_FAILED,"Failed")
+    ]
+
+    event = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=1,choices=STATUS_OPTIONS,default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True,blank=True)
+
+    def __str__(self):
+        return f"{self.event} #{self.pk}"
+
+    class Meta:
+        indexes = [
+            #the worker polls for due pending events in id order
+            models.Index(fields=["status","available_at","id"]),
+        ]
+
+
+
+class DailyProductSales(models.Model):
+    """Revenue and units of completed orders per product and day (see store/sales.py)."""
+    date = models.DateField()
+    product = models.ForeignKey(to=Product,on_delete=models.CASCADE,related_name="+")
+    #the product's collection when the day was last rolled up
+    collection = models.ForeignKey(to=Collection,on_delete=models.CASCADE,related_name="+")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14,decimal_places=2,default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date","product"],name="unique_daily_product_sales"),
+        ]
+        indexes = [
+            models.Index(fields=["product","date"]),
+        ]
+
+class DailyCollectionSales(models.Model):
+    """Revenue and units of completed orders per collection and day (see store/sales.py)."""
+    date = models.DateField()
+    collection = models.ForeignKey(to=Collection,on_delete=models.CASCADE,related_name="+")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14,decimal_places=2,default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date","collection"],name="unique_daily_collection_sales"),
+        ]
+        indexes = [
+            models.Index(fields=["collection","date"]),
+        ]
 
+class SalesRollupState(models.Model):
+    #single row: orders changed after the watermark haven't been rolled up yet
+    watermark = models.DateTimeField(null=True)
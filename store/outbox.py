@@ -0,0 +1,87 @@
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from store.models import Order, OutboxEvent
+from store.signals import order_created
+
+ORDER_CREATED = "order_created"
+
+
+def publish(event, payload):
+    """Record an event in the caller's transaction; the process_outbox worker delivers it once committed."""
+    return OutboxEvent.objects.create(event=event, payload=payload)
+
+
+def claim_batch(batch_size, lease):
+    """Lease up to batch_size due events so a second worker skips them until the lease runs out."""
+    now = timezone.now()
+    lease_until = now + lease
+    with atomic():
+        due = OutboxEvent.objects.filter(status=OutboxEvent.STATUS_PENDING, available_at__lte=now)
+        ids = list(due.order_by("id").values_list("id", flat=True)[:batch_size])
+        due.filter(pk__in=ids).update(available_at=lease_until)
+    return list(OutboxEvent.objects.filter(pk__in=ids, available_at=lease_until).order_by("id"))
+
+
+def load_signal_kwargs(events):
+    """Build the signal arguments of each event, loading the referenced rows in bulk."""
+    orders = Order.objects.in_bulk([event.payload["order_id"] for event in events if event.event == ORDER_CREATED])
+    kwargs = {}
+    for event in events:
+        if event.event == ORDER_CREATED:
+            kwargs[event.pk] = (order_created, Order, {"order": orders.get(event.payload["order_id"])})
+    return kwargs
+
+
+def deliver(event, signal_kwargs):
+    """Run every receiver of the event; returns an error description, or None when all succeeded."""
+    if signal_kwargs is None:
+        return f"Unknown event {event.event!r}"
+    signal, sender, kwargs = signal_kwargs
+    try:
+        responses = signal.send_robust(sender=sender, **kwargs)
+    finally:
+        close_old_connections()
+    errors = [
+        f"{getattr(receiver, '__qualname__', receiver)}: {''.join(traceback.format_exception(type(error), error, error.__traceback__)).strip()}"
+        for receiver, error in responses if isinstance(error, Exception)
+    ]
+    return "\n\n".join(errors) or None
+
+
+def process_batch(executor, batch_size=100, max_attempts=5, backoff=timedelta(seconds=5), lease=timedelta(minutes=5)):
+    """Deliver one batch of due events through `executor`, rescheduling failures with exponential backoff.
+
+    Delivery is at least once: a retried event runs all of its receivers again.
+    Returns (delivered, retried, failed) counts.
+    """
+    events = claim_batch(batch_size, lease)
+    if not events:
+        return 0, 0, 0
+    signal_kwargs = load_signal_kwargs(events)
+    errors = list(executor.map(lambda event: deliver(event, signal_kwargs.get(event.pk)), events))
+
+    now = timezone.now()
+    delivered = retried = failed = 0
+    for event, error in zip(events, errors):
+        event.attempts += 1
+        if error is None:
+            event.status = OutboxEvent.STATUS_DONE
+            event.processed_at = now
+            event.last_error = ""
+            delivered += 1
+        elif event.attempts >= max_attempts:
+            event.status = OutboxEvent.STATUS_FAILED
+            event.processed_at = now
+            event.last_error = error
+            failed += 1
+        else:
+            event.available_at = now + backoff * 2 ** (event.attempts - 1)
+            event.last_error = error
+            retried += 1
+    OutboxEvent.objects.bulk_update(events, ["status", "attempts", "available_at", "processed_at", "last_error"])
+    return delivered, retried, failed
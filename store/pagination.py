@@ -1,4 +1,134 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class CustomPagePagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination keyed on (ordering field, id).
+
+    Each page seeks past the last row of the previous one instead of counting
+    and skipping rows, so deep pages cost the same as the first. Passing
+    ?page= opts back into numbered pages (with a count) for the admin UI, and
+    orderings that aren't a plain model field (e.g. search relevance) fall back
+    to them as well.
+    """
+    page_size = 10
+    cursor_query_param = "cursor"
+    page_query_param = "page"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_pagination = None
+        ordering = self.get_ordering(queryset)
+        if self.page_query_param in request.query_params or ordering is None:
+            self.page_pagination = CustomPagePagination()
+            self.page_pagination.page_size = self.page_size
+            return self.page_pagination.paginate_queryset(queryset, request, view)
+
+        self.field, self.descending = ordering
+        cursor = self.decode_cursor(request)
+        backwards = bool(cursor and cursor["backwards"])
+        if cursor:
+            queryset = queryset.filter(self.seek_filter(cursor["value"], cursor["id"], self.descending != backwards))
+        sign = "-" if self.descending != backwards else ""
+        rows = list(queryset.order_by(f"{sign}{self.field.name}", f"{sign}id")[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if backwards:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.page_pagination is not None:
+            return self.page_pagination.get_paginated_response(data)
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_ordering(self, queryset):
+        #the OrderingFilter has already applied ?ordering=, so read the key back off the queryset
+        order_by = queryset.query.order_by or queryset.model._meta.ordering or ["id"]
+        first = order_by[0]
+        if not isinstance(first, str):
+            return None
+        name = first.lstrip("-")
+        if name == "pk":
+            name = "id"
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.null or field.is_relation:
+            return None
+        return field, first.startswith("-")
+
+    def seek_filter(self, value, pk, descending):
+        #written as a range on the ordering field first so the (field, id) index can seek to it
+        name = self.field.name
+        if name == "id":
+            return Q(id__lt=pk) if descending else Q(id__gt=pk)
+        if descending:
+            return Q(**{f"{name}__lte": value}) & (Q(**{f"{name}__lt": value}) | Q(id__lt=pk))
+        return Q(**{f"{name}__gte": value}) & (Q(**{f"{name}__gt": value}) | Q(id__gt=pk))
+
+    def encode_cursor(self, instance, backwards):
+        if isinstance(instance, dict):
+            #a row of a .values() page (see store.fastserializers)
+            instance = SimpleNamespace(pk=instance["id"], **{self.field.attname: instance[self.field.attname]})
+        position = {"v": self.field.value_to_string(instance), "id": instance.pk, "b": backwards}
+        token = base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(token.encode()))
+            return {
+                "value": self.field.to_python(position["v"]),
+                "id": int(position["id"]),
+                "backwards": bool(position["b"]),
+            }
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], backwards=True)
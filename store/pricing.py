@@ -0,0 +1,115 @@
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import Max
+from django.dispatch import receiver
+
+from store.cache import catalog_cache
+from store.models import Product
+
+CENT = Decimal("0.01")
+HUNDRED = Decimal(100)
+
+
+def get_config():
+    return {"TAX_RATE": "0", "MAX_ENTRIES": 100000, **getattr(settings, "PRICING", {})}
+
+
+def discounts_query(product_ids):
+    return (Product.promotions.through.objects
+            .filter(product_id__in=product_ids)
+            .values("product_id")
+            .annotate(discount=Max("promotion__discount"))
+            .values_list("product_id", "discount"))
+
+
+def best_discounts(product_ids):
+    """{product id: largest Promotion.discount} of the promoted products among `product_ids`, in one query."""
+    return dict(discounts_query(product_ids))
+
+
+def compute(products):
+    """{product id: price with tax} for `products`, with one promotions query for all of them.
+
+    Promotion.discount is a percentage taken off the unit price. Promotions
+    don't stack: the largest one applies. Tax (PRICING["TAX_RATE"], a
+    fraction) is added to the discounted price and the result rounded to the cent.
+    """
+    return compute_unit_prices({product.pk: product.unit_price for product in products})
+
+
+def compute_unit_prices(unit_prices):
+    """compute() for {product id: unit price}, e.g. read off .values() rows."""
+    discounts = {product_id: min(max(Decimal(str(discount)), 0), HUNDRED) / HUNDRED
+                 for product_id, discount in best_discounts(list(unit_prices)).items()}
+    tax = 1 + Decimal(str(get_config()["TAX_RATE"]))
+    return {product_id: (unit_price * (1 - discounts.get(product_id, 0)) * tax).quantize(CENT, ROUND_HALF_UP)
+            for product_id, unit_price in unit_prices.items()}
+
+
+class PriceTable:
+    """Prices of the products served recently, for the current catalog version.
+
+    Product, Promotion and product-promotion writes bump the catalog version
+    (see store.signals.handlers), which empties the table, so a change shows
+    up on the next request. It is only used while the catalog cache is enabled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prices = {}
+        self._version = None
+
+    def get_prices(self, unit_prices):
+        """{product id: price with tax} for {product id: unit price}."""
+        if not catalog_cache.enabled:
+            return compute_unit_prices(unit_prices)
+        version = catalog_cache.store.get_version()
+        with self._lock:
+            if version != self._version:
+                self._prices = {}
+                self._version = version
+            prices = {product_id: self._prices[product_id] for product_id in unit_prices if product_id in self._prices}
+        missing = {product_id: unit_price for product_id, unit_price in unit_prices.items() if product_id not in prices}
+        if missing:
+            computed = compute_unit_prices(missing)
+            prices.update(computed)
+            with self._lock:
+                if version == self._version:
+                    #cheaper to start over than to track recency on every read
+                    if len(self._prices) + len(computed) > get_config()["MAX_ENTRIES"]:
+                        self._prices = {}
+                    self._prices.update(computed)
+        return prices
+
+    def clear(self):
+        with self._lock:
+            self._prices = {}
+            self._version = None
+
+
+price_table = PriceTable()
+
+
+def attach_prices(products):
+    """Set `price_with_tax` on each product, for the serializer to read."""
+    prices = price_table.get_prices({product.pk: product.unit_price for product in products})
+    for product in products:
+        product.price_with_tax = prices[product.pk]
+    return products
+
+
+def attach_row_prices(rows):
+    """attach_prices() for .values() rows of products, which get a "price_with_tax" key."""
+    prices = price_table.get_prices({row["id"]: row["unit_price"] for row in rows})
+    for row in rows:
+        row["price_with_tax"] = prices[row["id"]]
+    return rows
+
+
+@receiver(setting_changed)
+def reset_price_table(setting, **kwargs):
+    if setting in ("PRICING", "CATALOG_CACHE"):
+        price_table.clear()
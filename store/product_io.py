@@ -0,0 +1,205 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from store.cache import catalog_cache
+from store.models import Collection, Product
+
+FORMATS = ("csv", "jsonl")
+
+#columns of an export, accepted by an import; rows name their collection by id or by title
+FIELDS = ["slug", "title", "description", "unit_price", "inventory", "collection_id", "collection"]
+
+UPDATE_FIELDS = ["title", "description", "unit_price", "inventory", "collection", "last_update"]
+
+MAX_UNIT_PRICE = Decimal("999999.99")
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path):
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_rows(file, file_format):
+    """Yield (line number, row) pairs from an open text file without reading it whole.
+
+    Undecodable JSON lines come through as (line number, None) so the caller can report them.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def clean_row(row):
+    """Validate one input row; returns the product values or raises RowError."""
+    if not isinstance(row, dict):
+        raise RowError("Not a JSON object.")
+    slug = str(row.get("slug") or "").strip()
+    title = str(row.get("title") or "").strip()
+    if not slug or not title:
+        raise RowError("slug and title are required.")
+    if len(slug) > 50 or len(title) > 255:
+        raise RowError("slug or title is too long.")
+    try:
+        unit_price = Decimal(str(row.get("unit_price"))).quantize(Decimal("0.01"))
+        inventory = int(row.get("inventory"))
+    except (InvalidOperation, TypeError, ValueError):
+        raise RowError("unit_price and inventory must be numbers.")
+    if not 0 <= unit_price <= MAX_UNIT_PRICE or inventory < 0:
+        raise RowError("unit_price or inventory is out of range.")
+    collection_id = row.get("collection_id")
+    collection_title = str(row.get("collection") or "").strip()
+    if collection_id not in (None, ""):
+        try:
+            collection_id = int(collection_id)
+        except (TypeError, ValueError):
+            raise RowError("collection_id must be an integer.")
+    elif collection_title:
+        collection_id = None
+    else:
+        raise RowError("collection_id or collection is required.")
+    return {
+        "slug": slug,
+        "title": title,
+        "description": row.get("description") or None,
+        "unit_price": unit_price,
+        "inventory": inventory,
+        "collection_id": collection_id,
+        "collection": collection_title,
+    }
+
+
+class ProductImporter:
+    """Upsert products keyed on slug in batches of bulk_create/bulk_update.
+
+    Collections are resolved once per batch for all of its rows; titles that
+    don't exist yet are created. Bulk writes bypass the Product signals, so
+    finish() rebuilds the counters of the touched collections and invalidates
+    the catalog cache. When several products share a slug the oldest one is updated.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.collection_ids = set()
+        self.collections_by_title = {}
+        self.touched_collection_ids = set()
+        self.read = self.created = self.updated = 0
+        self.errors = []
+
+    def run(self, rows, progress=None):
+        batch = []
+        for line_number, row in rows:
+            self.read += 1
+            try:
+                batch.append((line_number, clean_row(row)))
+            except RowError as error:
+                self.errors.append((line_number, str(error)))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+                if progress:
+                    progress(self)
+        if batch:
+            self.write_batch(batch)
+        self.finish()
+        return self
+
+    def resolve_collections(self, batch):
+        ids = {values["collection_id"] for _, values in batch if values["collection_id"] is not None}
+        unknown_ids = ids - self.collection_ids
+        if unknown_ids:
+            self.collection_ids.update(Collection.objects.filter(pk__in=unknown_ids).values_list("pk", flat=True))
+        titles = {values["collection"] for _, values in batch if values["collection_id"] is None}
+        unknown_titles = titles - self.collections_by_title.keys()
+        if unknown_titles:
+            #oldest collection wins when titles repeat
+            for pk, title in Collection.objects.filter(title__in=unknown_titles).order_by("-id").values_list("pk", "title"):
+                self.collections_by_title[title] = pk
+            missing = sorted(unknown_titles - self.collections_by_title.keys())
+            for collection in Collection.objects.bulk_create([Collection(title=title) for title in missing]):
+                self.collections_by_title[collection.title] = collection.pk
+            self.collection_ids.update(self.collections_by_title.values())
+
+    def write_batch(self, batch):
+        with atomic():
+            self.resolve_collections(batch)
+            products = {}
+            for line_number, values in batch:
+                collection_id = values["collection_id"]
+                if collection_id is None:
+                    collection_id = self.collections_by_title[values["collection"]]
+                if collection_id not in self.collection_ids:
+                    self.errors.append((line_number, f"Collection {collection_id} does not exist."))
+                    continue
+                #a later row for the same slug wins
+                products[values["slug"]] = Product(
+                    slug=values["slug"], title=values["title"], description=values["description"],
+                    unit_price=values["unit_price"], inventory=values["inventory"], collection_id=collection_id)
+            existing = {}
+            for pk, slug, collection_id in (Product.objects.filter(slug__in=products).order_by("-id")
+                                            .values_list("pk", "slug", "collection_id")):
+                existing[slug] = (pk, collection_id)
+            now = timezone.now()
+            to_update = []
+            for slug, product in products.items():
+                self.touched_collection_ids.add(product.collection_id)
+                if slug in existing:
+                    product.pk, previous_collection_id = existing[slug]
+                    product.last_update = now
+                    self.touched_collection_ids.add(previous_collection_id)
+                    to_update.append(product)
+            to_create = [product for product in products.values() if product.pk is None]
+            if connection.features.supports_update_conflicts_with_target:
+                #one INSERT .. ON CONFLICT(id) DO UPDATE per batch; bulk_update's CASE per column grows quadratically
+                Product.objects.bulk_create(to_update, update_conflicts=True, unique_fields=["id"], update_fields=UPDATE_FIELDS)
+            else:
+                Product.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=100)
+            Product.objects.bulk_create(to_create)
+        self.updated += len(to_update)
+        self.created += len(to_create)
+
+    def finish(self):
+        if self.touched_collection_ids:
+            Collection.rebuild_products_count(self.touched_collection_ids)
+            catalog_cache.invalidate()
+
+
+def export_rows(chunk_size=2000):
+    """Yield every product as a FIELDS dict in id order, streaming from the database."""
+    rows = (Product.objects.order_by("id")
+            .values_list("slug", "title", "description", "unit_price", "inventory", "collection_id", "collection__title"))
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(FIELDS, row))
+
+
+def write_rows(file, rows, file_format):
+    """Write FIELDS dicts as CSV or JSON lines; returns the number written."""
+    written = 0
+    if file_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+        return written
+    for row in rows:
+        file.write(json.dumps({**row, "unit_price": str(row["unit_price"])}) + "\n")
+        written += 1
+    return written
@@ -0,0 +1,147 @@
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"IN \((?:\s*(?:%s|\?)\s*,?)+\)")
+#execute wrappers of this package, which sit between every query and its caller
+_WRAPPER_FILES = {os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics.py")}
+
+
+def get_config():
+    return {"ENABLED": False, "THRESHOLD": 3, "RAISE": False, **getattr(settings, "QUERY_CHECK", {})}
+
+
+def fingerprint(sql):
+    """The shape of a query: literals and IN lists of any length collapse to placeholders."""
+    return _IN_LISTS.sub("IN (...)", _LITERALS.sub("%s", sql))
+
+
+def _is_project_file(filename):
+    filename = os.path.abspath(filename)
+    return (filename.startswith(str(settings.BASE_DIR)) and filename not in _WRAPPER_FILES
+            and "site-packages" not in filename and os.sep + "." not in filename)
+
+
+def describe_origin(frame):
+    """Name what issued the query at `frame`: a serializer field, an admin column, or the project line.
+
+    Serializer.to_representation keeps the field being rendered in its `field`
+    local and the admin changelist the column in `field_name`; the innermost
+    one found wins, so nested serializers point at the field doing the query.
+    """
+    site = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "to_representation" and "field" in frame.f_locals and "self" in frame.f_locals:
+            field = frame.f_locals["field"]
+            return f"{type(frame.f_locals['self']).__name__}.{getattr(field, 'field_name', field)}"
+        if code.co_name == "items_for_result" and "field_name" in frame.f_locals and "cl" in frame.f_locals:
+            return f"{type(frame.f_locals['cl'].model_admin).__name__}.{frame.f_locals['field_name']}"
+        if site is None and _is_project_file(code.co_filename):
+            site = f"{os.path.relpath(code.co_filename, settings.BASE_DIR)}:{frame.f_lineno} in {code.co_name}"
+        frame = frame.f_back
+    return site or "<unknown>"
+
+
+class QueryLog:
+    """execute_wrapper collecting (fingerprint, origin, sql) of every query run while it is installed."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((fingerprint(sql), describe_origin(sys._getframe(1)), sql))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=None):
+        """(origin, fingerprint, count) of query shapes issued `threshold` or more times from one origin."""
+        threshold = threshold or get_config()["THRESHOLD"]
+        counts = Counter((origin, shape) for shape, origin, _ in self.queries)
+        return [(origin, shape, count) for (origin, shape), count in counts.most_common() if count >= threshold]
+
+
+class capture_queries(ContextDecorator):
+    """Install a QueryLog on every database connection for the duration of the block."""
+
+    def __enter__(self):
+        self.log = QueryLog()
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self.log))
+        return self.log
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        return False
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def format_report(repeated):
+    lines = [f"{count} x {origin}: {shape[:300]}" for origin, shape, count in repeated]
+    return "Repeated queries (likely N+1):\n  " + "\n  ".join(lines) if lines else ""
+
+
+class query_budget(capture_queries):
+    """Fail when the block runs more than `max_queries` queries, or any N+1 pattern.
+
+        with query_budget(3):
+            self.client.get("/store/products/")
+
+    Also usable as a test method decorator. Pass threshold=None to only check the count.
+    """
+
+    def __init__(self, max_queries=None, threshold=3):
+        self.max_queries = max_queries
+        self.threshold = threshold
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        problems = []
+        if self.max_queries is not None and len(self.log) > self.max_queries:
+            problems.append(f"{len(self.log)} queries ran, over the budget of {self.max_queries}:\n  "
+                            + "\n  ".join(f"{origin}: {sql[:300]}" for _, origin, sql in self.log.queries))
+        if self.threshold is not None:
+            report = format_report(self.log.repeated(self.threshold))
+            if report:
+                problems.append(report)
+        if problems:
+            raise NPlusOneError("\n".join(problems))
+        return False
+
+
+class NPlusOneMiddleware:
+    """Development mode: logs (or raises, with QUERY_CHECK["RAISE"]) repeated query shapes per request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        if not config["ENABLED"]:
+            return self.get_response(request)
+        with capture_queries() as log:
+            response = self.get_response(request)
+        report = format_report(log.repeated(config["THRESHOLD"]))
+        if report:
+            message = f"{request.method} {request.path} ran {len(log)} queries. {report}"
+            if config["RAISE"]:
+                raise NPlusOneError(message)
+            logger.warning(message)
+        return response
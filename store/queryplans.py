@@ -0,0 +1,133 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.utils import timezone
+
+from store.carts import expired
+from store.models import CartItem, Order, OrderItem, Product, ProductImage
+from store.pagination import KeysetPagination
+from store.pricing import discounts_query
+from store.tagsets import filter_products
+from tags.models import TaggedItem
+
+#plan lines that mean the query reads a whole table, or sorts rows an index should have returned in order
+_FULL_SCAN = "SCAN"
+_SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+
+def explain(queryset):
+    """The EXPLAIN QUERY PLAN detail lines of a queryset (SQLite only)."""
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan, ordered_walk=False):
+    """Lines of `plan` showing a scan, or a sort the index should have made unnecessary.
+
+    Every SCAN counts, "SCAN t USING INDEX i" included: it walks the whole
+    index, e.g. in order while filtering on a column the index doesn't
+    cover. Only a query declared an `ordered_walk` (an ORDER BY ... LIMIT
+    read off an index in order, stopping at the limit) may scan an index.
+    Virtual tables (json_each of a parameter, the FTS index) are read
+    through their own access path.
+    """
+    problems = []
+    for line in plan:
+        words = line.split()
+        if words[:1] == [_FULL_SCAN] and "VIRTUAL" not in words and not (ordered_walk and "USING" in words):
+            problems.append(line)
+        elif line.startswith(_SORT):
+            problems.append(line)
+    return problems
+
+
+def _keyset_page(queryset, ordering, value=1):
+    #the query KeysetPagination runs for a page after the first one, seeking past (value, id 1)
+    pagination = KeysetPagination()
+    pagination.field = queryset.model._meta.get_field(ordering.lstrip("-"))
+    descending = ordering.startswith("-")
+    sign = "-" if descending else ""
+    return (queryset.filter(pagination.seek_filter(value, 1, descending))
+            .order_by(f"{sign}{pagination.field.name}", f"{sign}id")[:pagination.page_size + 1])
+
+
+class HotQuery:
+    """A query on a hot path whose plan must stay on an index; build() returns the queryset to explain.
+
+    `uses` is the start of the plan line it must contain, naming the index
+    it is expected to read ("SEARCH t USING INDEX i"), and `ordered_walk`
+    allows a "SCAN t USING INDEX i" for an ORDER BY ... LIMIT.
+    """
+
+    def __init__(self, name, build, uses, ordered_walk=False):
+        self.name = name
+        self.build = build
+        self.uses = uses
+        self.ordered_walk = ordered_walk
+
+    def problems(self, plan):
+        problems = plan_problems(plan, self.ordered_walk)
+        if not any(line.startswith(self.uses) for line in plan):
+            problems.append(f"expected {self.uses}")
+        return problems
+
+
+HOT_QUERIES = [
+    HotQuery("product page", lambda: _keyset_page(Product.objects.all(), "id"),
+             "SEARCH store_product USING INTEGER PRIMARY KEY"),
+    HotQuery("product page by price", lambda: _keyset_page(Product.objects.all(), "unit_price", Decimal("5")),
+             "SEARCH store_product USING INDEX store_produ_unit_pr_2ca2a1_idx"),
+    HotQuery("product page by last update", lambda: _keyset_page(Product.objects.all(), "-last_update", timezone.now()),
+             "SEARCH store_product USING INDEX store_produ_last_up_34dd1f_idx"),
+    HotQuery("product page of a collection", lambda: _keyset_page(Product.objects.filter(collection_id=1), "id"),
+             "SEARCH store_product USING INDEX store_product_collection_id_2914d2ba"),
+    HotQuery("product page of a collection in a price range", lambda: _keyset_page(
+        Product.objects.filter(collection_id=1, unit_price__gt=Decimal("5"), unit_price__lt=Decimal("50")),
+        "unit_price", Decimal("10")),
+             "SEARCH store_product USING INDEX store_produ_collect_5fde5f_idx"),
+    HotQuery("tagged product page", lambda: _keyset_page(filter_products(Product.objects.all(), {1, 2, 3}), "id"),
+             "SEARCH store_product USING INTEGER PRIMARY KEY"),
+    HotQuery("products by title", lambda: Product.objects.order_by("title", "id")[:10],
+             "SCAN store_product USING INDEX store_produ_title_829862_idx", ordered_walk=True),
+    HotQuery("product images", lambda: ProductImage.objects.filter(product_id__in=[1, 2, 3]),
+             "SEARCH store_productimage USING INDEX store_productimage_product_id_e50e4046"),
+    HotQuery("promotions of a page", lambda: discounts_query([1, 2, 3]),
+             "SEARCH store_product_promotions USING COVERING INDEX store_product_promotions_product_id_promotion_id_d02f5543_uniq"),
+    HotQuery("cart items", lambda: CartItem.objects.with_totals().filter(cart_id="00000000-0000-0000-0000-000000000000"),
+             "SEARCH store_cartitem USING INDEX store_cartitem_cart_id_product_id_bd38e607_uniq"),
+    HotQuery("expired carts", lambda: expired(timezone.now() - timedelta(days=14)).order_by("last_activity").values_list("id")[:500],
+             "SEARCH store_cart USING INDEX store_cart_last_activity_3c38d716"),
+    HotQuery("orders of a customer", lambda: Order.objects.filter(customer_id=1).order_by("id"),
+             "SEARCH store_order USING INDEX store_order_customer_id_13d6d43e"),
+    HotQuery("order history of a customer", lambda: Order.objects.filter(
+        customer_id=1, placed_at__gte=timezone.now() - timedelta(days=30)).order_by("-placed_at"),
+             "SEARCH store_order USING INDEX store_order_custome_700a25_idx"),
+    HotQuery("order items", lambda: OrderItem.objects.filter(order_id__in=[1, 2, 3]),
+             "SEARCH store_orderitem USING INDEX store_orderitem_order_id_acf8722d"),
+    HotQuery("orders placed in a range", lambda: Order.objects.filter(
+        placed_at__gte=timezone.now() - timedelta(days=1), placed_at__lt=timezone.now()).order_by("placed_at"),
+             "SEARCH store_order USING INDEX store_order_placed_at_2532f990"),
+    HotQuery("orders changed since the rollup watermark", lambda: Order.objects.filter(
+        updated_at__gt=timezone.now() - timedelta(minutes=5)).values_list("placed_at", flat=True),
+             "SEARCH store_order USING INDEX store_order_updated_at_33da32de"),
+    HotQuery("tags of a product", lambda: TaggedItem.objects.select_related("tag").filter(
+        content_type=ContentType.objects.get_for_model(Product), object_id=1),
+             "SEARCH tags_taggeditem USING INDEX tags_tagged_content_eaa81e_idx"),
+]
+
+
+def check(queries=HOT_QUERIES):
+    """(name, plan, problem lines) of every hot query whose plan is not served by its index."""
+    failures = []
+    for query in queries:
+        queryset = query.build()
+        plan = explain(queryset)
+        problems = query.problems(plan)
+        if problems:
+            failures.append((query.name, plan, problems))
+    return failures
@@ -0,0 +1,51 @@
+from decimal import Decimal
+from uuid import UUID
+
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+#types DRF's encoder converts, looked up by exact type before its isinstance chain
+FAST_TYPES = {
+    Decimal: float,
+    UUID: str,
+}
+
+
+class FastJSONEncoder(JSONEncoder):
+    """DRF's JSONEncoder, with the values every catalog payload is full of (prices) converted first.
+
+    Subclasses and every other type go through DRF's default(), so the
+    output is the same.
+    """
+
+    def default(self, obj):
+        convert = FAST_TYPES.get(type(obj))
+        if convert is not None:
+            return convert(obj)
+        return super().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that produces the same bytes with less work per value.
+
+    It encodes with FastJSONEncoder without the circular reference check,
+    which costs a dict insert per list and object and only turns a cycle
+    (a bug either way) into a ValueError instead of a RecursionError.
+    Indented output (?format=json; indent=4 or the browsable API) is left
+    to JSONRenderer.
+    """
+    encoder_class = FastJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        separators = SHORT_SEPARATORS if self.compact else LONG_SEPARATORS
+        ret = self.encoder_class(ensure_ascii=self.ensure_ascii, allow_nan=not self.strict,
+                                 separators=separators, check_circular=False).encode(data)
+        #escaped like JSONRenderer, so the output stays a strict JavaScript subset
+        if "\u2028" in ret or "\u2029" in ret:
+            ret = ret.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+        return ret.encode()
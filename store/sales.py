@@ -0,0 +1,82 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from store.models import DailyCollectionSales, DailyProductSales, Order, OrderItem, SalesRollupState
+
+#changes are re-read this far behind the watermark, so a transaction that
+#committed late with an older updated_at isn't skipped; refreshing a day twice is harmless
+OVERLAP = timedelta(minutes=5)
+
+#days recomputed per transaction
+DAYS_PER_BATCH = 31
+
+
+def _day_range(day):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min), tz)
+    return Q(order__placed_at__gte=start, order__placed_at__lt=end)
+
+
+def refresh_days(days):
+    """Recompute the rollup rows of `days` from the completed orders placed on them.
+
+    A day is always rebuilt whole, so an order that moves into or out of
+    PAYMENT_COMPLETE, gains or loses items, or is deleted is reflected exactly.
+    """
+    days = sorted(set(days))
+    for start in range(0, len(days), DAYS_PER_BATCH):
+        batch = days[start:start + DAYS_PER_BATCH]
+        day_ranges = Q()
+        for day in batch:
+            day_ranges |= _day_range(day)
+        revenue = ExpressionWrapper(F("quantity") * F("unit_price"), output_field=DecimalField(max_digits=14, decimal_places=2))
+        rows = (OrderItem.objects
+                .filter(day_ranges, order__payment_status=Order.PAYMENT_COMPLETE)
+                .annotate(date=TruncDate("order__placed_at"))
+                .values("date", "product_id", "product__collection_id")
+                .annotate(units=Sum("quantity"), revenue=Sum(revenue))
+                .order_by())
+        product_sales = []
+        collection_totals = defaultdict(lambda: [0, 0])
+        for row in rows:
+            product_sales.append(DailyProductSales(
+                date=row["date"], product_id=row["product_id"], collection_id=row["product__collection_id"],
+                units=row["units"], revenue=row["revenue"]))
+            totals = collection_totals[row["date"], row["product__collection_id"]]
+            totals[0] += row["units"]
+            totals[1] += row["revenue"]
+        with atomic():
+            DailyProductSales.objects.filter(date__in=batch).delete()
+            DailyCollectionSales.objects.filter(date__in=batch).delete()
+            DailyProductSales.objects.bulk_create(product_sales, batch_size=500)
+            DailyCollectionSales.objects.bulk_create([
+                DailyCollectionSales(date=date, collection_id=collection_id, units=units, revenue=revenue)
+                for (date, collection_id), (units, revenue) in collection_totals.items()
+            ], batch_size=500)
+    return days
+
+
+def refresh(full=False):
+    """Roll up the orders changed since the watermark (every order when `full` or on the first run).
+
+    Returns the refreshed days.
+    """
+    now = timezone.now()
+    state, _ = SalesRollupState.objects.get_or_create(pk=1)
+    orders = Order.objects.filter(updated_at__lte=now)
+    if full or state.watermark is None:
+        DailyProductSales.objects.all().delete()
+        DailyCollectionSales.objects.all().delete()
+    else:
+        orders = orders.filter(updated_at__gt=state.watermark - OVERLAP)
+    days = orders.annotate(day=TruncDate("placed_at")).values_list("day", flat=True).distinct().order_by()
+    refreshed = refresh_days(days)
+    state.watermark = now
+    state.save(update_fields=["watermark"])
+    return refreshed
@@ -0,0 +1,121 @@
+import re
+
+from django.db import connection as default_connection
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "store_product_fts"
+
+_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+#ids of the matching rows; SQLite runs this once as a list subquery
+MATCH_IDS_SQL = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+
+#rank of the outer product row. The match set is materialized once and probed
+#through an automatic index; a plain correlated MATCH would re-run the full
+#text query for every candidate row.
+RANK_SQL = (
+    f"WITH fts_match AS MATERIALIZED (SELECT rowid AS id, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s) "
+    "SELECT fts_match.rank FROM fts_match WHERE fts_match.id = store_product.id"
+)
+
+_available = set()
+
+
+def is_supported(connection=default_connection):
+    #MATERIALIZED CTEs need SQLite 3.35
+    return connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 35, 0)
+
+
+def install(connection=default_connection):
+    """Create the FTS5 index over store_product and the triggers keeping it in sync."""
+    if not is_supported(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, description, content='store_product', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        #title matches weigh more than description matches in the relevance rank
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    install_triggers(connection)
+    return True
+
+
+def install_triggers(connection=default_connection):
+    """(Re)create the sync triggers if the index exists.
+
+    SQLite migrations that rebuild store_product drop its triggers, so this
+    runs after every migrate (see store.signals.handlers).
+    """
+    if not is_supported(connection) or FTS_TABLE not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        for trigger in _TRIGGERS:
+            cursor.execute(trigger)
+    return True
+
+
+def uninstall(connection=default_connection):
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for suffix in ("ai", "ad", "au"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _available.discard(connection.alias)
+
+
+def rebuild(connection=default_connection):
+    """Re-read every product into the index (backfill) and merge its segments."""
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def is_available(connection=default_connection):
+    #only a positive answer is remembered, so a process started before migrate picks the index up later
+    if connection.alias in _available:
+        return True
+    if is_supported(connection) and FTS_TABLE in connection.introspection.table_names():
+        _available.add(connection.alias)
+        return True
+    return False
+
+
+def build_match_query(search):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    terms = re.findall(r"\w+", search)
+    if not terms:
+        return None
+    quoted = ['"%s"' % term for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_products(queryset, search):
+    """Restrict a Product queryset to the FTS matches of `search`, annotated with `search_rank`.
+
+    Lower ranks are better (bm25), so ordering by search_rank lists the best matches first.
+    Text without a single word (e.g. "!!!") matches nothing and isn't annotated.
+    """
+    match = build_match_query(search)
+    if match is None:
+        return queryset.none()
+    return (queryset
+            .filter(id__in=RawSQL(MATCH_IDS_SQL, [match]))
+            .annotate(search_rank=RawSQL(RANK_SQL, [match])))
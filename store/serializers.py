@@ -1,9 +1,12 @@
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Manager, OuterRef, Subquery
 from django.db.transaction import atomic
-from store.models import Cart, CartItem, Collection, Order, OrderItem,Product,Customer, ProductImage
-from decimal import Decimal
-from store.signals import order_created
+from store.models import Cart, CartItem, Collection, DailyCollectionSales, DailyProductSales, Order, OrderItem,Product,Customer, ProductImage
+from store import outbox, pricing
+from store.cache import catalog_cache
+from store.cartstore import cart_store
 
 #collection serializer
 class CollectionSerializer(serializers.ModelSerializer):
@@ -11,49 +14,53 @@ class CollectionSerializer(serializers.ModelSerializer):
         model = Collection
         fields = ["id","title","products_count"]
 
-    products_count = serializers.SerializerMethodField(method_name="get_products_count")
-
-    def get_products_count(self,collection):
-        return collection.product_set.count()
+    products_count = serializers.IntegerField(read_only=True)
     
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ["id","image"]
+        fields = ["id","image","thumbnail","medium","webp"]
+        read_only_fields = ["thumbnail","medium","webp"]
 
     def create(self, validated_data):
+        #derivatives_status defaults to pending, which queues the image for process_image_derivatives
         product_id = self.context["product_id"]
         return ProductImage.objects.create(product_id=product_id,**validated_data)
+
+    def update(self, instance, validated_data):
+        if "image" in validated_data:
+            instance.thumbnail = instance.medium = instance.webp = ""
+            instance.derivatives_status = ProductImage.DERIVATIVES_PENDING
+        return super().update(instance, validated_data)
     
 
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        #price the whole page at once: one promotions query rather than one per product
+        products = list(data.all() if isinstance(data, Manager) else data)
+        pricing.attach_prices(products)
+        return super().to_representation(products)
+
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True,read_only=True)
     class Meta:
         model = Product 
         fields = ["id","title","slug","description","unit_price","inventory","collection","price_with_tax","images"]
+        list_serializer_class = ProductListSerializer
 
     price_with_tax = serializers.SerializerMethodField(method_name="get_price_with_tax")
 
     def get_price_with_tax(self,product):
-        return product.unit_price * Decimal(1*1)
+        #set by ProductListSerializer for a page, priced here for a single product
+        if not hasattr(product,"price_with_tax"):
+            pricing.attach_prices([product])
+        return product.price_with_tax
     
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer 
         fields = ["id","user","phone","birth_date","membership"]
 
-class CartSerializer(serializers.ModelSerializer):
-    id = serializers.UUIDField(read_only=True)
-    class Meta:
-        model = Cart 
-        fields = ["id","created_at","total_price"]
-
-    total_price = serializers.SerializerMethodField(method_name="get_total_price")
-
-    def get_total_price(self,cart):
-        total_price = sum([(i.product.unit_price * i.quantity) for i in cart.cartitem_set.all()])
-        return total_price
-
 class CustomProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product 
@@ -68,8 +75,30 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
 
     def get_total_price(self,cartitem):
+        #annotated by CartItem.objects.with_totals()
+        if hasattr(cartitem,"total_price"):
+            return cartitem.total_price
         return cartitem.product.unit_price * cartitem.quantity
 
+class CartSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(read_only=True)
+    items = CartItemSerializer(source="cartitem_set",many=True,read_only=True)
+    class Meta:
+        model = Cart 
+        fields = ["id","created_at","items","total_price"]
+
+    total_price = serializers.SerializerMethodField(method_name="get_total_price")
+
+    def get_total_price(self,cart):
+        #annotated by Cart.objects.with_totals(); a freshly created cart isn't
+        if hasattr(cart,"total_price"):
+            return cart.total_price
+        return Cart.objects.with_totals().values_list("total_price",flat=True).get(pk=cart.pk)
+
+class StoredCartSerializer(CartSerializer):
+    #a cart built by cart_store, with its items and total already attached
+    items = CartItemSerializer(many=True,read_only=True)
+
 
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
@@ -77,67 +106,126 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ["id","product_id","quantity"]
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found.')
-        return value
-    
     def save(self, **kwargs):
+        #product existence is checked by the upsert itself, which only inserts known products
         cart_id = self.context.get("cart_id")
-        product_id = self.validated_data.get("product_id")
-        cart_item = CartItem.objects.filter(cart_id=cart_id,product_id=product_id)
-        quantity = self.validated_data["quantity"]
+        product_id = self.validated_data["product_id"]
+        items = CartItem.objects.add_products(cart_id,{product_id:self.validated_data["quantity"]})
+        if not items:
+            raise ValidationError({"product_id":["No product with the given ID was found."]})
+        self.instance = items[0]
+        return self.instance
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+class BatchCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class BatchAddCartItemSerializer(serializers.Serializer):
+    items = BatchCartItemSerializer(many=True,allow_empty=False,max_length=500)
+
+    def merged_quantities(self):
+        quantities = {}
+        for item in self.validated_data["items"]:
+            quantities[item["product_id"]] = quantities.get(item["product_id"],0) + item["quantity"]
+        return quantities
+
+    def check_all_found(self,quantities,items):
+        missing = sorted(set(quantities) - {item.product_id for item in items})
+        if missing:
+            raise ValidationError({"items":[f"No product with the given ID was found: {', '.join(map(str,missing))}."]})
+
+    def save(self, **kwargs):
+        cart_id = self.context.get("cart_id")
+        quantities = self.merged_quantities()
+        with atomic():
+            items = CartItem.objects.add_products(cart_id,quantities)
+            #rolls back the rows that were added
+            self.check_all_found(quantities,items)
+        self.instance = items
+        return items
 
-        return self.instance
-    
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['quantity']
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        Cart.objects.touch(instance.cart_id)
+        return instance
+
 
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ["id","customer","placed_at","payment_status"]
 
+class StockShortage(Exception):
+    pass
+
 class AddOrderSerializer(serializers.Serializer):
     id = serializers.UUIDField()
 
-    def validate_id(self,id):
-        cart = Cart.objects.filter(id=id)
-        if not cart.exists():
-            raise ValidationError({"error":"The given cart id does not exists, please check again"})
-        if cart.first().cartitem_set.count() == 0:
-            raise ValidationError({"error":"A cart can't be empty, try adding products to it."})
-        return id
-
-
     def save(self, **kwargs):
+        cart_id = self.validated_data["id"]
+        if cart_store.enabled:
+            return self.checkout_stored(cart_id,self.context["customer_id"])
+        try:
+            return self.checkout(cart_id,self.context["customer_id"])
+        except StockShortage:
+            #the transaction has rolled back, so the stored inventory shows which lines are short
+            short = (Product.objects.filter(cartitem__cart_id=cart_id,inventory__lt=F("cartitem__quantity"))
+                     .order_by("title").values_list("title",flat=True))
+            raise ValidationError({"error":f"Not enough stock for: {', '.join(short)}."})
+
+    def checkout(self,cart_id,customer_id):
         with atomic():
-            cart_id = self.validated_data["id"]
-            user_id = self.context["user_id"]
-            cart = Cart.objects.get(id=cart_id)
-            customer = Customer.objects.get(user__id=user_id)
-            order = Order.objects.create(customer=customer)
-            orderitems_list = [OrderItem(order=order,product=item.product,quantity=item.quantity,unit_price=item.product.unit_price) for item in cart.cartitem_set.all()]
-            OrderItem.objects.bulk_create(orderitems_list)
-            cart.delete()
+            #write first: on SQLite this takes the write lock before anything is read,
+            #so concurrent checkouts queue on the busy timeout instead of failing to upgrade a read lock
+            lines = CartItem.objects.filter(cart_id=cart_id,product_id=OuterRef("pk")).values("quantity")
+            decremented = (Product.objects
+                           .filter(pk__in=CartItem.objects.filter(cart_id=cart_id).values("product_id"),inventory__gte=Subquery(lines))
+                           .update(inventory=F("inventory") - Subquery(lines)))
+            items = list(CartItem.objects.filter(cart_id=cart_id).select_related("product"))
+            if not items:
+                if not Cart.objects.filter(id=cart_id).exists():
+                    raise ValidationError({"error":"The given cart id does not exists, please check again"})
+                raise ValidationError({"error":"A cart can't be empty, try adding products to it."})
+            if decremented != len(items):
+                #raising rolls back the decrements that did succeed
+                raise StockShortage()
 
-            order_created.send_robust(sender=self.__class__,order=order)
+            order = Order.objects.create(customer_id=customer_id)
+            orderitems_list = [OrderItem(order=order,product=item.product,quantity=item.quantity,unit_price=item.product.unit_price) for item in items]
+            OrderItem.objects.bulk_create(orderitems_list)
+            Cart.objects.filter(id=cart_id).delete()
+            #inventory is part of the cached catalog payloads
+            transaction.on_commit(catalog_cache.invalidate)
+            #receivers run later in the process_outbox worker, off the request path
+            outbox.publish(outbox.ORDER_CREATED,{"order_id":order.id})
 
             return order
+
+    def checkout_stored(self,cart_id,customer_id):
+        #claimed before any SQL: a second checkout of the cart finds it gone, however long this one takes
+        entry = cart_store.claim(cart_id)
+        if entry is None:
+            raise ValidationError({"error":"The given cart id does not exists, please check again"})
+        lines = cart_store.entry_lines(entry)
+        try:
+            with atomic():
+                cart_store.materialize(cart_id,lines)
+                return self.checkout(cart_id,customer_id)
+        except StockShortage:
+            cart_store.restore(cart_id,entry)
+            inventory = dict(Product.objects.filter(pk__in=lines).values_list("id","inventory"))
+            short = sorted(Product.objects.filter(pk__in=[pk for pk,stock in inventory.items() if stock < lines[pk]])
+                           .values_list("title",flat=True))
+            raise ValidationError({"error":f"Not enough stock for: {', '.join(short)}."})
+        except BaseException:
+            #e.g. an empty cart: the customer can still fix it
+            cart_store.restore(cart_id,entry)
+            raise
     
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
@@ -165,3 +253,13 @@ class UpdateOrderItemSerializer(serializers.ModelSerializer):
         fields = ["quantity"]
     
 
+
+class DailyProductSalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyProductSales
+        fields = ["date","product_id","collection_id","units","revenue"]
+
+class DailyCollectionSalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyCollectionSales
+        fields = ["date","collection_id","units","revenue"]
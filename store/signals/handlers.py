@@ -1,9 +1,167 @@
-from store.models import Customer
+from store.models import Collection, Customer, Order, OrderItem, Product, ProductImage, Promotion, StoredBlob
+from store.authentication import identity_cache
+from store.cache import catalog_cache
+from store.tagsets import tag_sets
+from store import carts, sales, search
+from tags.models import Tag, TaggedItem
+from django.contrib.contenttypes.models import ContentType
+from collections import Counter
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_save
 from django.conf import settings
+from django.utils import timezone
 
 @receiver(signal=post_save,sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender,**kwargs):
     if kwargs["created"]:
-        Customer.objects.create(user=kwargs["instance"])
\ No newline at end of file
+        Customer.objects.create(user=kwargs["instance"])
+
+@receiver(signal=[post_save,post_delete],sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_identity_of_user(sender,instance,**kwargs):
+    #after commit, so a concurrent request can't re-cache the old row in between
+    transaction.on_commit(lambda: identity_cache.invalidate(instance.pk))
+
+@receiver(signal=[post_save,post_delete],sender=Customer)
+def invalidate_cached_identity_of_customer(sender,instance,**kwargs):
+    transaction.on_commit(lambda: identity_cache.invalidate(instance.user_id))
+
+
+def _adjust_products_count(collection_id,delta):
+    Collection.objects.filter(pk=collection_id).update(products_count=F("products_count") + delta)
+
+@receiver(signal=pre_save,sender=Product)
+def remember_product_collection(sender,instance,raw,**kwargs):
+    #instances that weren't loaded through from_db don't know their stored collection yet
+    if raw or instance.pk is None or hasattr(instance,"_loaded_collection_id"):
+        return
+    instance._loaded_collection_id = Product.objects.filter(pk=instance.pk).values_list("collection_id",flat=True).first()
+
+@receiver(signal=post_save,sender=Product)
+def update_products_count_on_save(sender,instance,created,raw,**kwargs):
+    if raw:
+        return
+    previous_collection_id = getattr(instance,"_loaded_collection_id",None)
+    if created:
+        _adjust_products_count(instance.collection_id,1)
+    elif previous_collection_id != instance.collection_id:
+        if previous_collection_id is not None:
+            _adjust_products_count(previous_collection_id,-1)
+        _adjust_products_count(instance.collection_id,1)
+    instance._loaded_collection_id = instance.collection_id
+
+@receiver(signal=post_delete,sender=Product)
+def update_products_count_on_delete(sender,instance,**kwargs):
+    _adjust_products_count(instance.collection_id,-1)
+
+
+def _retain_blobs(names):
+    counts = Counter(names)
+    #create missing rows at zero first, so concurrent first uploads of a file both count
+    StoredBlob.objects.bulk_create([StoredBlob(name=name) for name in counts],ignore_conflicts=True)
+    for count in set(counts.values()):
+        StoredBlob.objects.filter(name__in=[name for name in counts if counts[name] == count]).update(references=F("references") + count)
+
+def _release_blobs(names,storage):
+    #files without a row were never counted (e.g. bulk writes) and are left alone
+    counts = Counter(names)
+    for count in set(counts.values()):
+        StoredBlob.objects.filter(name__in=[name for name in counts if counts[name] == count]).update(references=F("references") - count)
+    transaction.on_commit(lambda: _delete_unreferenced_blobs(list(counts),storage))
+
+def _delete_unreferenced_blobs(names,storage):
+    #re-checked after commit: another row may have picked the same content up meanwhile
+    with transaction.atomic():
+        unreferenced = StoredBlob.objects.filter(name__in=names,references__lte=0)
+        doomed = list(unreferenced.values_list("name",flat=True))
+        unreferenced.filter(name__in=doomed).delete()
+    for name in doomed:
+        storage.delete(name)
+
+@receiver(signal=pre_save,sender=ProductImage)
+def remember_product_image_files(sender,instance,raw,**kwargs):
+    loaded = getattr(instance,"_loaded_files",{})
+    missing = [name for name in ProductImage.FILE_FIELDS if name not in loaded]
+    if raw or instance.pk is None or not missing:
+        return
+    stored = ProductImage.objects.filter(pk=instance.pk).values(*missing).first() or {}
+    instance._loaded_files = {**loaded,**stored}
+
+@receiver(signal=post_save,sender=ProductImage)
+def update_blob_references_on_save(sender,instance,created,raw,**kwargs):
+    if raw:
+        return
+    loaded = {} if created else getattr(instance,"_loaded_files",{})
+    retained,released = [],[]
+    for name in ProductImage.FILE_FIELDS:
+        previous,current = loaded.get(name) or "",getattr(instance,name).name or ""
+        if previous == current:
+            continue
+        if current:
+            retained.append(current)
+        if previous:
+            released.append(previous)
+    if retained:
+        _retain_blobs(retained)
+    if released:
+        _release_blobs(released,instance.image.storage)
+    instance._loaded_files = {name: getattr(instance,name).name for name in ProductImage.FILE_FIELDS}
+
+@receiver(signal=post_delete,sender=ProductImage)
+def update_blob_references_on_delete(sender,instance,**kwargs):
+    #also runs for the images of a deleted product (on_delete=CASCADE)
+    names = [getattr(instance,name).name for name in ProductImage.FILE_FIELDS if getattr(instance,name).name]
+    if names:
+        _release_blobs(names,instance.image.storage)
+
+
+@receiver(signal=[post_save,post_delete],sender=Product)
+@receiver(signal=[post_save,post_delete],sender=ProductImage)
+@receiver(signal=[post_save,post_delete],sender=Promotion)
+@receiver(signal=[post_save,post_delete],sender=Collection)
+@receiver(signal=[post_save,post_delete],sender=Tag)
+@receiver(signal=[post_save,post_delete],sender=TaggedItem)
+@receiver(signal=m2m_changed,sender=Product.promotions.through)
+def invalidate_catalog_cache(sender,**kwargs):
+    if kwargs.get("action","post").startswith("pre"):
+        return
+    #bump after commit so readers can't re-cache rows of a transaction that is still open
+    transaction.on_commit(catalog_cache.invalidate)
+
+
+@receiver(signal=[post_save,post_delete],sender=Tag)
+@receiver(signal=[post_save,post_delete],sender=TaggedItem)
+def invalidate_tag_sets(sender,**kwargs):
+    transaction.on_commit(tag_sets.invalidate)
+
+@receiver(signal=post_delete,sender=Product)
+def delete_tags_of_deleted_product(sender,instance,**kwargs):
+    #the generic key has no cascade, and the tag sets would keep counting the product
+    TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Product),object_id=instance.pk).delete()
+
+
+@receiver(signal=[post_save,post_delete],sender=OrderItem)
+def touch_order_of_changed_item(sender,instance,raw=False,**kwargs):
+    #lets the sales rollup job see the change; checkout's bulk_create of items happens with the order's own insert
+    if not raw:
+        Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
+
+@receiver(signal=post_delete,sender=Order)
+def refresh_sales_of_deleted_order(sender,instance,**kwargs):
+    #a deleted order can't be found through the watermark, so its day is rolled up again right away
+    day = timezone.localdate(instance.placed_at)
+    transaction.on_commit(lambda: sales.refresh_days([day]))
+
+
+@receiver(signal=post_migrate)
+def reinstall_search_triggers(sender,using,**kwargs):
+    #migrations that rebuild store_product on SQLite drop the full-text sync triggers
+    if sender.name == "store":
+        search.install_triggers(connections[using])
+
+@receiver(signal=post_migrate)
+def reinstall_cart_activity_triggers(sender,using,**kwargs):
+    #likewise for store_cartitem and the triggers bumping Cart.last_activity
+    if sender.name == "store":
+        carts.install_activity_triggers(connections[using])
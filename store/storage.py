@@ -0,0 +1,60 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_ADDRESSED_NAME = re.compile(r"(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$")
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED_NAME.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Stores each upload under the SHA-256 of its content, e.g. store/images/ab/ab12...ef.jpg.
+
+    The upload is hashed chunk by chunk while it is streamed to a temporary
+    file, so it is never held in memory whole. Identical content maps to the
+    same name and is written once; rows sharing a file are reference counted
+    through StoredBlob (see store.signals.handlers) before a file is removed.
+    """
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        #the final name is derived from the content in _save, so equal names never collide
+        return name
+
+    def _save(self, name, content):
+        directory, basename = posixpath.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        os.makedirs(self.path(directory or "."), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path(directory or "."), prefix=".upload-")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    temp.write(chunk)
+            hexdigest = digest.hexdigest()
+            final_name = posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+            final_path = self.path(final_name)
+            if os.path.exists(final_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(temp_path, final_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(final_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return final_name
+
+
+content_addressed_storage = ContentAddressedStorage()
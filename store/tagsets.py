@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+
+from store.cache import DjangoCatalogStore, LocalCatalogStore
+from store.models import Product
+from tags.models import TaggedItem
+
+VERSION_KEY = "tagsets:version"
+
+#one JSON parameter instead of one bound parameter per id, which SQLite caps
+JSON_IDS_SQL = "SELECT value FROM json_each(%s)"
+
+_EMPTY = frozenset()
+
+
+def normalize(label):
+    return label.strip().casefold()
+
+
+def load():
+    """Read every product tagging in one query: ({label: frozenset of product ids}, {label: display label})."""
+    sets, labels = {}, {}
+    rows = (TaggedItem.objects
+            .filter(content_type=ContentType.objects.get_for_model(Product))
+            .order_by("tag_id")
+            .values_list("tag__label", "object_id")
+            .iterator(chunk_size=10000))
+    for label, product_id in rows:
+        key = normalize(label)
+        ids = sets.get(key)
+        if ids is None:
+            ids = sets[key] = set()
+            labels[key] = label.strip()
+        ids.add(product_id)
+    return {key: frozenset(ids) for key, ids in sets.items()}, labels
+
+
+class TagSets:
+    """Product ids per tag label, held in memory so ?tags= filters never join TaggedItem.
+
+    The sets are loaded in one query on first use and kept until a Tag or
+    TaggedItem write bumps the version (see store.signals.handlers). With an
+    ALIAS the version lives in that shared cache, so every worker reloads;
+    without one, other workers notice after TIMEOUT seconds. Writes that skip
+    save(), such as bulk_create of TaggedItems, need an explicit invalidate().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._sets = None
+        self._labels = None
+        self._loaded_version = None
+        self._loaded_at = 0.0
+
+    @property
+    def config(self):
+        return {"ALIAS": None, "TIMEOUT": 300, **getattr(settings, "TAG_SETS", {})}
+
+    @property
+    def versions(self):
+        if self._versions is None:
+            alias = self.config["ALIAS"]
+            self._versions = DjangoCatalogStore(alias, None, VERSION_KEY) if alias else LocalCatalogStore(0, None)
+        return self._versions
+
+    def _is_fresh(self, version):
+        return (self._sets is not None and self._loaded_version == version
+                and time.monotonic() - self._loaded_at < self.config["TIMEOUT"])
+
+    def current(self):
+        """({label: product ids}, {label: display label}), reloaded if a write happened since the last load."""
+        version = self.versions.get_version()
+        if not self._is_fresh(version):
+            with self._lock:
+                if not self._is_fresh(version):
+                    #the version was read before loading, so a write during the load triggers another one
+                    self._sets, self._labels = load()
+                    self._loaded_version = version
+                    self._loaded_at = time.monotonic()
+        return self._sets, self._labels
+
+    def matching(self, labels, match_all=True):
+        """Ids of the products tagged with every one of `labels` (or any of them, with match_all=False)."""
+        sets, _ = self.current()
+        found = [sets.get(normalize(label), _EMPTY) for label in labels]
+        if not found:
+            return _EMPTY
+        if not match_all:
+            return _EMPTY.union(*found)
+        #set intersection only walks the smallest set
+        found.sort(key=len)
+        return found[0].intersection(*found[1:])
+
+    def counts(self):
+        """(label, number of products) of every tag, the most used first."""
+        sets, labels = self.current()
+        return sorted(((labels[key], len(ids)) for key, ids in sets.items()), key=lambda item: (-item[1], item[0]))
+
+    def invalidate(self):
+        self.versions.bump_version()
+
+    def clear(self):
+        with self._lock:
+            self._sets = self._labels = self._loaded_version = None
+
+
+tag_sets = TagSets()
+
+
+def filter_products(queryset, ids):
+    """Restrict a Product queryset to `ids`, passed to SQLite as a single JSON array."""
+    if not ids:
+        return queryset.none()
+    if connections[queryset.db].vendor == "sqlite":
+        return queryset.filter(id__in=RawSQL(JSON_IDS_SQL, [json.dumps(sorted(ids))]))
+    return queryset.filter(id__in=sorted(ids))
+
+
+@receiver(setting_changed)
+def reset_tag_sets(setting, **kwargs):
+    if setting == "TAG_SETS":
+        tag_sets._versions = None
+        tag_sets.clear()
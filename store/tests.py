@@ -1,3 +1,1600 @@
-from django.test import TestCase
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+from uuid import UUID, uuid4
 
-# Create your tests here.
+from PIL import Image
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from store import benchmark, carts, exports, images, metrics, outbox, pricing, product_io, querycheck, queryplans, sales, search
+from store.authentication import identity_cache
+from store.cache import LocalCatalogStore, catalog_cache
+from store.cartstore import cart_store
+from store.renderers import FastJSONRenderer
+from store.models import Cart, CartItem, Collection, Customer, DailyCollectionSales, DailyProductSales, Order, OrderItem, OutboxEvent, Product, ProductImage, Promotion, StoredBlob
+from store.storage import content_addressed_storage
+from store.tagsets import tag_sets
+from store.views import serve_media
+from store.signals import order_created
+from store.signals.handlers import reinstall_search_triggers
+from tags.models import Tag, TaggedItem
+
+
+def create_product(collection, title, description=None, unit_price=10, **kwargs):
+    return Product.objects.create(title=title, slug=title.lower().replace(" ", "-"), description=description,
+                                  unit_price=unit_price, inventory=10, collection=collection, **kwargs)
+
+
+class CollectionProductsCountTests(TestCase):
+    def setUp(self):
+        self.fruit = Collection.objects.create(title="Fruit")
+        self.bakery = Collection.objects.create(title="Bakery")
+        self.apple = create_product(self.fruit, "Apple")
+        create_product(self.fruit, "Pear")
+
+    def assertCounts(self, fruit, bakery):
+        self.assertEqual(Collection.objects.get(pk=self.fruit.pk).products_count, fruit)
+        self.assertEqual(Collection.objects.get(pk=self.bakery.pk).products_count, bakery)
+
+    def test_create_increments(self):
+        self.assertCounts(2, 0)
+
+    def test_move_between_collections(self):
+        product = Product.objects.get(pk=self.apple.pk)
+        product.collection = self.bakery
+        product.save()
+        self.assertCounts(1, 1)
+
+    def test_save_without_move_keeps_count(self):
+        product = Product.objects.get(pk=self.apple.pk)
+        product.title = "Green apple"
+        product.save()
+        self.assertCounts(2, 0)
+
+    def test_save_with_deferred_collection_keeps_count(self):
+        product = Product.objects.only("title").get(pk=self.apple.pk)
+        product.title = "Green apple"
+        product.save()
+        self.assertCounts(2, 0)
+
+    def test_move_with_deferred_collection(self):
+        product = Product.objects.only("title").get(pk=self.apple.pk)
+        product.collection = self.bakery
+        product.save()
+        self.assertCounts(1, 1)
+
+    def test_delete_decrements(self):
+        self.apple.delete()
+        self.assertCounts(1, 0)
+        Product.objects.all().delete()
+        self.assertCounts(0, 0)
+
+    def test_rebuild_command_repairs_bypassed_writes(self):
+        Product.objects.filter(pk=self.apple.pk).update(collection=self.bakery)
+        self.assertCounts(2, 0)
+        call_command("rebuild_collection_counts", stdout=StringIO())
+        self.assertCounts(1, 1)
+
+    def test_collection_list_is_one_query(self):
+        for i in range(5):
+            create_product(Collection.objects.create(title=f"Collection {i}"), f"Product {i}")
+        with self.assertNumQueries(1):
+            response = APIClient().get("/store/collections/")
+        self.assertEqual(len(response.data), 7)
+        self.assertEqual({c["title"]: c["products_count"] for c in response.data}["Fruit"], 2)
+
+    def test_destroy_refuses_non_empty_collection(self):
+        staff = get_user_model().objects.create_user(username="staff", email="staff@example.com", password="x", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        self.assertEqual(client.delete(f"/store/collections/{self.fruit.pk}/").status_code, 400)
+        self.assertEqual(client.delete(f"/store/collections/{self.bakery.pk}/").status_code, 204)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.clear()
+        self.client = APIClient()
+        self.collection = Collection.objects.create(title="Fruit")
+        self.product = create_product(self.collection, "Apple", unit_price=3)
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response["X-Cache"]
+
+    def test_repeated_reads_hit(self):
+        self.assertEqual(self.get("/store/products/"), "MISS")
+        self.assertEqual(self.get("/store/products/"), "HIT")
+        self.assertEqual(self.get(f"/store/products/{self.product.pk}/"), "MISS")
+        self.assertEqual(self.get(f"/store/products/{self.product.pk}/"), "HIT")
+        self.assertEqual(catalog_cache.stats()["hits"], 2)
+        self.assertEqual(catalog_cache.stats()["misses"], 2)
+
+    def test_keys_separate_query_parameters(self):
+        variants = [{}, {"collection_id": self.collection.pk}, {"unit_price__lt": 5}, {"search": "apple"},
+                    {"ordering": "unit_price"}, {"ordering": "-unit_price"}, {"page": 1}]
+        for params in variants:
+            self.assertEqual(self.get("/store/products/", params), "MISS", params)
+        for params in variants:
+            self.assertEqual(self.get("/store/products/", params), "HIT", params)
+
+    def test_errors_are_not_cached(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get("/store/products/999999/").status_code, 404)
+        self.assertEqual(catalog_cache.stats()["hits"], 0)
+
+    def assertWriteInvalidates(self, write):
+        self.get("/store/products/")
+        self.assertEqual(self.get("/store/products/"), "HIT")
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertEqual(self.get("/store/products/"), "MISS")
+
+    def test_catalog_writes_bump_the_version(self):
+        promotion = Promotion.objects.create(description="Sale", discount=10)
+        writes = [
+            lambda: self.product.save(),
+            lambda: ProductImage.objects.create(product=self.product, image="store/images/apple.jpg"),
+            lambda: promotion.save(),
+            lambda: self.collection.save(),
+            lambda: self.product.promotions.add(promotion),
+            lambda: create_product(self.collection, "Pear").delete(),
+        ]
+        for write in writes:
+            self.assertWriteInvalidates(write)
+
+    def test_response_reflects_write_after_invalidation(self):
+        self.get("/store/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.inventory = 0
+            self.product.save()
+        self.assertEqual(self.client.get("/store/products/").data["results"][0]["inventory"], 0)
+
+
+@override_settings(CATALOG_CACHE={"ALIAS": "default", "TIMEOUT": 300})
+class SharedCatalogCacheTests(CatalogCacheTests):
+    pass
+
+
+class LocalCatalogStoreTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        store = LocalCatalogStore(max_entries=2, timeout=None)
+        store.set("a", 1)
+        store.set("b", 2)
+        store.get("a")
+        store.set("c", 3)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get("a"), 1)
+        self.assertIsNot(store.get("b"), 2)
+
+    def test_entries_expire_after_timeout(self):
+        store = LocalCatalogStore(max_entries=10, timeout=60)
+        with mock.patch("store.cache.time.monotonic", return_value=1000):
+            store.set("a", 1)
+        with mock.patch("store.cache.time.monotonic", return_value=1059):
+            self.assertEqual(store.get("a"), 1)
+        with mock.patch("store.cache.time.monotonic", return_value=1061):
+            self.assertIsNot(store.get("a"), 1)
+            self.assertEqual(len(store), 0)
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False})
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        collection = Collection.objects.create(title="Fruit")
+        #duplicate prices so pages have to break ties on id
+        self.products = [create_product(collection, f"Product {i}", unit_price=i % 7) for i in range(35)]
+
+    def walk(self, url, params=None, link="next"):
+        response = self.client.get(url, params or {})
+        pages = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            if not response.data[link]:
+                return pages
+            response = self.client.get(response.data[link])
+
+    def test_walks_every_row_once_in_order(self):
+        for ordering, key in [("unit_price", lambda p: (p.unit_price, p.id)),
+                              ("-unit_price", lambda p: (-p.unit_price, -p.id)),
+                              ("last_update", lambda p: (p.last_update, p.id)),
+                              (None, lambda p: p.id)]:
+            params = {"ordering": ordering} if ordering else {}
+            pages = self.walk("/store/products/", params)
+            ids = [row["id"] for page in pages for row in page["results"]]
+            self.assertEqual(ids, [p.id for p in sorted(self.products, key=key)], ordering)
+            self.assertEqual(len(pages), 4)
+            self.assertNotIn("count", pages[0])
+
+    def test_previous_links_walk_back(self):
+        forward = self.walk("/store/products/", {"ordering": "unit_price"})
+        response = self.client.get(forward[-1]["previous"])
+        self.assertEqual(response.data["results"], forward[-2]["results"])
+        backward = self.walk(forward[-1]["previous"], link="previous")
+        self.assertEqual([page["results"] for page in backward], [page["results"] for page in reversed(forward[:-1])])
+        self.assertIsNone(backward[-1]["previous"])
+
+    def test_page_numbers_are_opt_in(self):
+        response = self.client.get("/store/products/", {"page": 2, "ordering": "unit_price"})
+        self.assertEqual(response.data["count"], 35)
+        self.assertEqual(len(response.data["results"]), 10)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get("/store/products/", {"cursor": "garbage"}).status_code, 404)
+
+    def test_deep_page_query_count(self):
+        last_page_url = self.walk("/store/products/", {"ordering": "unit_price"})[-2]["next"]
+        #the page, its images and its promotions
+        with self.assertNumQueries(3):
+            self.client.get(last_page_url)
+
+    def test_orders_and_customers_are_paginated(self):
+        staff = get_user_model().objects.create_user(username="staff", email="staff@example.com", password="x", is_staff=True)
+        self.client.force_authenticate(staff)
+        for url in ["/store/orders/", "/store/customers/"]:
+            response = self.client.get(url)
+            self.assertEqual(set(response.data), {"next", "previous", "results"})
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.collection = Collection.objects.create(title="Fruit")
+        self.cart = Cart.objects.create()
+
+    def fill(self, count):
+        for i in range(count):
+            product = create_product(self.collection, f"Product {i}", unit_price=Decimal("1.25") + i)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=i + 1)
+
+    def test_retrieve_is_two_queries_regardless_of_size(self):
+        for count in (1, 25):
+            CartItem.objects.all().delete()
+            self.fill(count)
+            with self.assertNumQueries(2):
+                response = self.client.get(f"/store/carts/{self.cart.pk}/")
+            self.assertEqual(len(response.data["items"]), count)
+
+    def test_totals_are_computed_by_the_database(self):
+        self.fill(3)
+        data = self.client.get(f"/store/carts/{self.cart.pk}/").data
+        self.assertEqual([item["total_price"] for item in data["items"]], [Decimal("1.25"), Decimal("4.50"), Decimal("9.75")])
+        self.assertEqual(data["total_price"], Decimal("15.50"))
+        self.assertEqual(data["items"][1]["product"]["title"], "Product 1")
+
+    def test_empty_and_new_carts_total_zero(self):
+        self.assertEqual(self.client.get(f"/store/carts/{self.cart.pk}/").data["total_price"], 0)
+        response = self.client.post("/store/carts/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["total_price"], 0)
+        self.assertEqual(response.data["items"], [])
+
+    def test_cart_items_list_uses_line_totals(self):
+        self.fill(5)
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/store/carts/{self.cart.pk}/cartitems/")
+        self.assertEqual(response.data[4]["total_price"], Decimal("26.25"))
+
+
+class AddToCartTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        collection = Collection.objects.create(title="Fruit")
+        self.apple = create_product(collection, "Apple")
+        self.pear = create_product(collection, "Pear")
+        self.cart = Cart.objects.create()
+        self.url = f"/store/carts/{self.cart.pk}/cartitems/"
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity"))
+
+    def test_add_inserts_then_increments_in_one_statement(self):
+        #the cart lookup, then the upsert
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {"product_id": self.apple.pk, "quantity": 2})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(self.url, {"product_id": self.apple.pk, "quantity": 3})
+        self.assertEqual(response.data["quantity"], 5)
+        self.assertEqual(self.quantities(), {self.apple.pk: 5})
+
+    def test_add_unknown_product_is_rejected(self):
+        response = self.client.post(self.url, {"product_id": 999999, "quantity": 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("product_id", response.data)
+        self.assertEqual(self.quantities(), {})
+
+    def test_batch_adds_and_updates_many_products(self):
+        CartItem.objects.create(cart=self.cart, product=self.apple, quantity=1)
+        items = [{"product_id": self.apple.pk, "quantity": 2}, {"product_id": self.pear.pk, "quantity": 4},
+                 {"product_id": self.pear.pk, "quantity": 1}]
+        with self.assertNumQueries(4):
+            response = self.client.post(self.url + "batch/", {"items": items}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(self.quantities(), {self.apple.pk: 3, self.pear.pk: 5})
+
+    def test_batch_with_unknown_product_writes_nothing(self):
+        items = [{"product_id": self.apple.pk, "quantity": 2}, {"product_id": 999999, "quantity": 1}]
+        response = self.client.post(self.url + "batch/", {"items": items}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("999999", str(response.data["items"]))
+        self.assertEqual(self.quantities(), {})
+
+    def test_unknown_or_malformed_cart_is_not_found(self):
+        for cart_id in [uuid4(), "not-a-uuid"]:
+            url = f"/store/carts/{cart_id}/cartitems/"
+            with self.subTest(cart_id=cart_id):
+                self.assertEqual(self.client.post(url, {"product_id": self.apple.pk, "quantity": 1}).status_code, 404)
+                response = self.client.post(url + "batch/", {"items": [{"product_id": self.apple.pk, "quantity": 1}]}, format="json")
+                self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_batch_rejects_empty_and_non_positive_quantities(self):
+        self.assertEqual(self.client.post(self.url + "batch/", {"items": []}, format="json").status_code, 400)
+        items = [{"product_id": self.apple.pk, "quantity": 0}]
+        self.assertEqual(self.client.post(self.url + "batch/", {"items": items}, format="json").status_code, 400)
+
+    def test_step_by_step_fallback_matches_upsert(self):
+        CartItem.objects.create(cart=self.cart, product=self.apple, quantity=1)
+        items = CartItem.objects.all()._add_products_in_steps(self.cart.pk, {self.apple.pk: 2, self.pear.pk: 3, 999999: 1})
+        self.assertEqual({item.product_id: item.quantity for item in items}, {self.apple.pk: 3, self.pear.pk: 3})
+
+
+class CartPurgeTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="Fruit")
+        self.apple = create_product(collection, "Apple")
+        self.pear = create_product(collection, "Pear")
+        self.long_ago = timezone.now() - timedelta(days=30)
+
+    def create_cart(self, idle_since=None, products=()):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=1) for product in products])
+        Cart.objects.filter(pk=cart.pk).update(last_activity=idle_since or self.long_ago)
+        return cart
+
+    def test_adding_or_changing_items_is_activity(self):
+        client = APIClient()
+        cart = self.create_cart()
+        url = f"/store/carts/{cart.pk}/cartitems/"
+        item = client.post(url, {"product_id": self.apple.pk, "quantity": 1}).data
+        cart.refresh_from_db()
+        self.assertGreater(cart.last_activity, timezone.now() - timedelta(minutes=1))
+        Cart.objects.filter(pk=cart.pk).update(last_activity=self.long_ago)
+        client.patch(f"{url}{item['id']}/", {"quantity": 3})
+        cart.refresh_from_db()
+        self.assertGreater(cart.last_activity, timezone.now() - timedelta(minutes=1))
+
+    def test_purge_deletes_expired_carts_in_chunks(self):
+        expired = [self.create_cart(products=[self.apple, self.pear]) for _ in range(5)]
+        active = self.create_cart(idle_since=timezone.now(), products=[self.apple])
+        progress = []
+        with CaptureQueriesContext(connection) as captured:
+            carts_deleted, items_deleted, _ = carts.purge(carts.cutoff(timedelta(days=14)), chunk_size=2,
+                                                          progress=lambda *totals: progress.append(totals[:2]))
+        self.assertEqual((carts_deleted, items_deleted), (5, 10))
+        self.assertEqual(progress, [(2, 4), (4, 8), (5, 10)])
+        self.assertEqual(len([query for query in captured if query["sql"].startswith("SAVEPOINT")]), 3)
+        self.assertEqual(list(Cart.objects.all()), [active])
+        self.assertFalse(CartItem.objects.filter(cart__in=expired).exists())
+
+    def test_cart_touched_after_selection_is_kept(self):
+        cart = self.create_cart(products=[self.apple])
+        before = carts.cutoff(timedelta(days=14))
+        ids = list(carts.expired(before).values_list("id", flat=True))
+        CartItem.objects.add_products(cart.pk, {self.pear.pk: 1})
+        self.assertEqual(carts.purge_chunk(ids, before), (0, 0))
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 2)
+
+    def test_command_reports_dry_run_counts_and_rate(self):
+        self.create_cart(products=[self.apple])
+        out = StringIO()
+        call_command("purge_carts", "--dry-run", stdout=out)
+        self.assertIn("1 cart(s) with 1 item(s) would be deleted.", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 1)
+        out = StringIO()
+        call_command("purge_carts", "--ttl-days", "60", stdout=out)
+        self.assertIn("Deleted 0 cart(s)", out.getvalue())
+        call_command("purge_carts", stdout=out)
+        self.assertRegex(out.getvalue(), r"Deleted 1 cart\(s\) and 1 item\(s\) in [\d.]+s \(\d+ rows/s\)")
+        self.assertEqual(Cart.objects.count(), 0)
+
+
+def create_customer_client(username="customer"):
+    user = get_user_model().objects.create_user(username=username, email=f"{username}@example.com", password="x")
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.client = create_customer_client()
+        collection = Collection.objects.create(title="Fruit")
+        self.apple = create_product(collection, "Apple", unit_price=Decimal("2.50"))
+        self.pear = create_product(collection, "Pear", unit_price=4)
+        self.cart = Cart.objects.create()
+
+    def checkout(self):
+        return self.client.post("/store/orders/", {"id": str(self.cart.pk)})
+
+    def test_checkout_decrements_stock_and_snapshots_prices(self):
+        CartItem.objects.create(cart=self.cart, product=self.apple, quantity=3)
+        CartItem.objects.create(cart=self.cart, product=self.pear, quantity=10)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).inventory, 7)
+        self.assertEqual(Product.objects.get(pk=self.pear.pk).inventory, 0)
+        lines = dict(OrderItem.objects.filter(order_id=response.data["id"]).values_list("product_id", "unit_price"))
+        self.assertEqual(lines, {self.apple.pk: Decimal("2.50"), self.pear.pk: Decimal("4")})
+        self.assertFalse(Cart.objects.filter(pk=self.cart.pk).exists())
+
+    def test_shortage_fails_cleanly(self):
+        CartItem.objects.create(cart=self.cart, product=self.apple, quantity=3)
+        CartItem.objects.create(cart=self.cart, product=self.pear, quantity=11)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(str(response.data["error"]), "Not enough stock for: Pear.")
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).inventory, 10)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_empty_and_unknown_carts_are_rejected(self):
+        self.assertIn("empty", str(self.checkout().data["error"]))
+        Cart.objects.filter(pk=self.cart.pk).delete()
+        self.assertIn("does not exists", str(self.checkout().data["error"]))
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        def checkout_queries(lines):
+            self.cart = Cart.objects.create()
+            for i in range(lines):
+                CartItem.objects.create(cart=self.cart, product=create_product(self.apple.collection, f"P{lines}-{i}"), quantity=1)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.checkout().status_code, 201)
+            return len(queries)
+        self.assertEqual(checkout_queries(1), checkout_queries(20))
+
+
+@override_settings(CARTS={"TTL": timedelta(days=14), "BACKEND": "local", "MAX_ENTRIES": 100})
+class StoredCartTests(TestCase):
+    def setUp(self):
+        cart_store.clear()
+        self.client = create_customer_client()
+        collection = Collection.objects.create(title="Fruit")
+        self.apple = create_product(collection, "Apple", unit_price=Decimal("2.50"))
+        self.pear = create_product(collection, "Pear", unit_price=4)
+
+    def create_cart(self):
+        response = self.client.post("/store/carts/")
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def test_cart_api_writes_nothing_to_sql(self):
+        with CaptureQueriesContext(connection) as captured:
+            cart_id = self.create_cart()
+            url = f"/store/carts/{cart_id}/cartitems/"
+            item = self.client.post(url, {"product_id": self.apple.pk, "quantity": 2}).data
+            self.assertEqual(item, {"id": 1, "product_id": self.apple.pk, "quantity": 2})
+            batch = self.client.post(f"{url}batch/", {"items": [{"product_id": self.apple.pk, "quantity": 1},
+                                                                 {"product_id": self.pear.pk, "quantity": 1}]}, format="json")
+            self.assertEqual(batch.status_code, 201)
+            self.assertEqual(self.client.patch(f"{url}2/", {"quantity": 3}).data, {"quantity": 3})
+            cart = self.client.get(f"/store/carts/{cart_id}/").data
+        self.assertFalse(Cart.objects.exists())
+        self.assertTrue(all(query["sql"].startswith("SELECT") for query in captured))
+        self.assertEqual([(item["id"], item["product"]["title"], item["quantity"]) for item in cart["items"]],
+                         [(1, "Apple", 3), (2, "Pear", 3)])
+        self.assertEqual(cart["total_price"], Decimal("19.50"))
+        self.assertEqual(self.client.get(f"/store/carts/{cart_id}/cartitems/1/").data["total_price"], Decimal("7.50"))
+
+    def test_missing_products_carts_and_items(self):
+        cart_id = self.create_cart()
+        url = f"/store/carts/{cart_id}/cartitems/"
+        self.assertEqual(self.client.post(url, {"product_id": 0, "quantity": 1}).status_code, 400)
+        response = self.client.post(f"{url}batch/", {"items": [{"product_id": self.apple.pk, "quantity": 1},
+                                                                {"product_id": 0, "quantity": 1}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).data, [])
+        self.assertEqual(self.client.patch(f"{url}1/", {"quantity": 3}).status_code, 404)
+        self.assertEqual(self.client.get("/store/carts/not-a-uuid/").status_code, 404)
+        self.assertEqual(self.client.post("/store/carts/00000000-0000-0000-0000-000000000000/cartitems/",
+                                          {"product_id": self.apple.pk, "quantity": 1}).status_code, 404)
+
+    def test_delete_only_empty_carts(self):
+        cart_id = self.create_cart()
+        url = f"/store/carts/{cart_id}/cartitems/"
+        self.client.post(url, {"product_id": self.apple.pk, "quantity": 1})
+        self.assertEqual(self.client.delete(f"/store/carts/{cart_id}/").status_code, 400)
+        self.assertEqual(self.client.delete(f"{url}1/").status_code, 204)
+        self.assertEqual(self.client.delete(f"/store/carts/{cart_id}/").status_code, 204)
+        self.assertEqual(self.client.get(f"/store/carts/{cart_id}/").status_code, 404)
+
+    def test_checkout_writes_the_cart_back(self):
+        cart_id = self.create_cart()
+        url = f"/store/carts/{cart_id}/cartitems/"
+        self.client.post(url, {"product_id": self.apple.pk, "quantity": 3})
+        self.client.post(url, {"product_id": self.pear.pk, "quantity": 10})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/store/orders/", {"id": cart_id})
+        self.assertEqual(response.status_code, 201)
+        lines = dict(OrderItem.objects.filter(order_id=response.data["id"]).values_list("product_id", "quantity"))
+        self.assertEqual(lines, {self.apple.pk: 3, self.pear.pk: 10})
+        self.assertEqual(Product.objects.get(pk=self.pear.pk).inventory, 0)
+        self.assertFalse(Cart.objects.exists())
+        self.assertIsNone(cart_store.get(cart_id))
+
+    def test_checkout_shortage_keeps_the_stored_cart(self):
+        cart_id = self.create_cart()
+        url = f"/store/carts/{cart_id}/cartitems/"
+        self.client.post(url, {"product_id": self.pear.pk, "quantity": 11})
+        response = self.client.post("/store/orders/", {"id": cart_id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(str(response.data["error"]), "Not enough stock for: Pear.")
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(len(cart_store.get(cart_id).items), 1)
+        self.client.delete(f"{url}1/")
+        self.assertIn("empty", str(self.client.post("/store/orders/", {"id": cart_id}).data["error"]))
+        cart_store.delete(cart_id)
+        self.assertIn("does not exists", str(self.client.post("/store/orders/", {"id": cart_id}).data["error"]))
+
+    def test_busy_cart_gets_409(self):
+        cart_id = self.create_cart()
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with cart_store.locked(UUID(cart_id)):
+                held.set()
+                release.wait(5)
+
+        other = threading.Thread(target=hold)
+        other.start()
+        held.wait(5)
+        try:
+            with mock.patch("store.cartstore.LOCK_WAIT", 0.05):
+                response = self.client.post(f"/store/carts/{cart_id}/cartitems/", {"product_id": self.apple.pk, "quantity": 1})
+        finally:
+            release.set()
+            other.join()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(cart_store._locks, {})
+
+    @override_settings(CARTS={"TTL": timedelta(days=14), "BACKEND": "cache", "ALIAS": "default"})
+    def test_cache_backend(self):
+        self.addCleanup(cart_store.clear)
+        cart_id = self.create_cart()
+        self.client.post(f"/store/carts/{cart_id}/cartitems/", {"product_id": self.apple.pk, "quantity": 2})
+        self.assertEqual(self.client.get(f"/store/carts/{cart_id}/").data["total_price"], Decimal("5.00"))
+        self.assertFalse(Cart.objects.exists())
+
+
+@override_settings(CARTS={"TTL": timedelta(days=14), "BACKEND": "local", "MAX_ENTRIES": 100})
+class ConcurrentStoredCartCheckoutTests(TransactionTestCase):
+    workers = 8
+
+    def test_a_stored_cart_is_ordered_once(self):
+        cart_store.clear()
+        product = create_product(Collection.objects.create(title="Fruit"), "Apple")
+        clients = [create_customer_client(f"customer{i}") for i in range(self.workers)]
+        cart_id = clients[0].post("/store/carts/").data["id"]
+        clients[0].post(f"/store/carts/{cart_id}/cartitems/", {"product_id": product.pk, "quantity": 1})
+
+        statuses = []
+        start = threading.Barrier(self.workers)
+
+        def checkout(client):
+            try:
+                start.wait()
+                statuses.append(client.post("/store/orders/", {"id": cart_id}).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] + [400] * (self.workers - 1))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=product.pk).inventory, 9)
+        self.assertIsNone(cart_store.get(cart_id))
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    workers = 16
+    stock = 10
+
+    def test_concurrent_checkouts_never_oversell(self):
+        product = create_product(Collection.objects.create(title="Fruit"), "Last apples")
+        Product.objects.filter(pk=product.pk).update(inventory=self.stock)
+        carts = []
+        for i in range(self.workers):
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            carts.append((create_customer_client(f"customer{i}"), cart))
+
+        statuses = []
+        start = threading.Barrier(self.workers)
+
+        def checkout(client, cart):
+            try:
+                start.wait()
+                statuses.append(client.post("/store/orders/", {"id": str(cart.pk)}).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=pair) for pair in carts]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        self.assertEqual(sorted(statuses), [201] * self.stock + [400] * (self.workers - self.stock))
+        self.assertEqual(Product.objects.get(pk=product.pk).inventory, 0)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), self.stock)
+        print(f"\n{self.workers} concurrent checkouts on one SKU: {len(statuses) / elapsed:.0f} orders/s")
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.received = []
+        order_created.connect(self.receiver)
+        self.addCleanup(order_created.disconnect, self.receiver)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        collection = Collection.objects.create(title="Fruit")
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=create_product(collection, "Apple"), quantity=1)
+
+    def receiver(self, sender, order, **kwargs):
+        self.received.append(order)
+
+    def checkout(self):
+        return create_customer_client().post("/store/orders/", {"id": str(self.cart.pk)})
+
+    def test_checkout_records_event_without_running_receivers(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.received, [])
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event, event.payload), ("order_created", {"order_id": response.data["id"]}))
+
+    def test_worker_delivers_pending_events(self):
+        order_id = self.checkout().data["id"]
+        call_command("process_outbox", "--once", stdout=StringIO())
+        self.assertEqual([order.id for order in self.received], [order_id])
+        self.assertEqual(OutboxEvent.objects.get().status, OutboxEvent.STATUS_DONE)
+        self.assertEqual(outbox.process_batch(self.executor), (0, 0, 0))
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        def failing_receiver(sender, **kwargs):
+            raise RuntimeError("mail server down")
+        order_created.connect(failing_receiver)
+        self.addCleanup(order_created.disconnect, failing_receiver)
+        self.checkout()
+
+        self.assertEqual(outbox.process_batch(self.executor, max_attempts=2, backoff=timedelta(seconds=30)), (0, 1, 0))
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("mail server down", event.last_error)
+        self.assertGreater(event.available_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(outbox.process_batch(self.executor), (0, 0, 0))
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(outbox.process_batch(self.executor, max_attempts=2), (0, 0, 1))
+        self.assertEqual(OutboxEvent.objects.get().status, OutboxEvent.STATUS_FAILED)
+
+    def test_claimed_events_are_leased(self):
+        self.checkout()
+        self.assertEqual(len(outbox.claim_batch(10, timedelta(minutes=5))), 1)
+        self.assertEqual(outbox.claim_batch(10, timedelta(minutes=5)), [])
+
+
+def make_image(name="photo.jpg", size=(1600, 1200), image_format="JPEG", color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f"image/{image_format.lower()}")
+
+
+class MediaRootTestMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ImageDerivativeTests(MediaRootTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(Collection.objects.create(title="Bakery"), "Bread")
+        staff = get_user_model().objects.create_user(username="staff", email="staff@example.com", password="x", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+        self.url = f"/store/products/{self.product.pk}/images/"
+
+    def test_render_derivatives(self):
+        rendered = images.render_derivatives(make_image().read())
+        self.assertEqual({name: extension for name, (data, extension) in rendered.items()},
+                         {"thumbnail": "jpg", "medium": "jpg", "webp": "webp"})
+        self.assertEqual(Image.open(BytesIO(rendered["thumbnail"][0])).size, (200, 150))
+        self.assertEqual(Image.open(BytesIO(rendered["medium"][0])).size, (800, 600))
+        self.assertEqual(Image.open(BytesIO(rendered["webp"][0])).size, (1600, 1200))
+
+    def test_upload_is_queued_then_processed_off_the_request(self):
+        response = self.client.post(self.url, {"image": make_image()}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data["thumbnail"])
+        self.assertEqual(ProductImage.objects.get().derivatives_status, ProductImage.DERIVATIVES_PENDING)
+
+        call_command("process_image_derivatives", "--once", "--workers", "1", stdout=StringIO())
+
+        product_image = ProductImage.objects.get()
+        self.assertEqual(product_image.derivatives_status, ProductImage.DERIVATIVES_READY)
+        data = self.client.get(self.url).data[0]
+        self.assertRegex(data["thumbnail"], r"/store/images/derivatives/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertTrue(data["webp"].endswith(".webp"))
+        self.assertEqual(Image.open(product_image.medium.path).size, (800, 600))
+
+    def test_unreadable_image_is_marked_failed(self):
+        ProductImage.objects.create(product=self.product, image="store/images/missing.jpg")
+        with self.assertLogs("store.images", "ERROR"):
+            self.assertEqual(images.process_pending(ThreadPoolExecutor(max_workers=1)), (0, 1))
+        self.assertEqual(ProductImage.objects.get().derivatives_status, ProductImage.DERIVATIVES_FAILED)
+
+    def test_replacing_the_image_queues_it_again(self):
+        image_id = self.client.post(self.url, {"image": make_image()}, format="multipart").data["id"]
+        images.process_pending(ThreadPoolExecutor(max_workers=1))
+        response = self.client.patch(f"{self.url}{image_id}/", {"image": make_image("new.png", image_format="PNG")}, format="multipart")
+        self.assertIsNone(response.data["thumbnail"])
+        images.process_pending(ThreadPoolExecutor(max_workers=1))
+        self.assertTrue(ProductImage.objects.get().thumbnail.name.endswith(".png"))
+
+
+class ContentAddressedStorageTests(MediaRootTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        collection = Collection.objects.create(title="Bakery")
+        self.bread = create_product(collection, "Bread")
+        self.cake = create_product(collection, "Cake")
+
+    def upload(self, product, image):
+        return ProductImage.objects.create(product=product, image=image)
+
+    def references(self, name):
+        return StoredBlob.objects.filter(name=name).values_list("references", flat=True).first()
+
+    def test_file_is_named_by_content_hash(self):
+        name = content_addressed_storage.save("store/images/a.txt", ContentFile(b"x" * 200_000))
+        self.assertEqual(name, "store/images/91/91e3faafd322bcdf160f3f0ce886acb092b9b9e2a1e8526b40f21a8898a8700b.txt")
+        self.assertEqual(content_addressed_storage.size(name), 200_000)
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.upload(self.bread, make_image("a.jpg"))
+        second = self.upload(self.cake, make_image("b.jpg"))
+        third = self.upload(self.cake, make_image("c.jpg", color="blue"))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertEqual(self.references(first.image.name), 2)
+        self.assertEqual(len(content_addressed_storage.listdir(first.image.name.rsplit("/", 1)[0])[1]), 1)
+
+    def test_shared_file_survives_cascade_until_last_reference_goes(self):
+        name = self.upload(self.bread, make_image()).image.name
+        self.upload(self.cake, make_image())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bread.delete()
+        self.assertTrue(content_addressed_storage.exists(name))
+        self.assertEqual(self.references(name), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cake.delete()
+        self.assertFalse(content_addressed_storage.exists(name))
+        self.assertIsNone(self.references(name))
+
+    def test_replaced_file_is_released(self):
+        product_image = self.upload(self.bread, make_image())
+        old_name = product_image.image.name
+        product_image = ProductImage.objects.only("id", "product").get()
+        product_image.image = make_image(color="blue")
+        with self.captureOnCommitCallbacks(execute=True):
+            product_image.save()
+        self.assertFalse(content_addressed_storage.exists(old_name))
+        self.assertEqual(self.references(product_image.image.name), 1)
+
+    def test_hashed_media_is_served_with_immutable_cache_headers(self):
+        name = self.upload(self.bread, make_image()).image.name
+        request = RequestFactory().get(f"/media/{name}")
+        response = serve_media(request, name, document_root=content_addressed_storage.location)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+        with open(content_addressed_storage.path("store/images/legacy.jpg"), "wb") as file:
+            file.write(b"legacy")
+        response = serve_media(request, "store/images/legacy.jpg", document_root=content_addressed_storage.location)
+        self.assertNotIn("Cache-Control", response)
+
+
+class ProductImportExportTests(TestCase):
+    def setUp(self):
+        self.fruit = Collection.objects.create(title="Fruit")
+        self.apple = create_product(self.fruit, "Apple", unit_price=3)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = lambda name: f"{directory}/{name}"
+
+    def write(self, name, content):
+        with open(self.path(name), "w") as file:
+            file.write(content)
+        return self.path(name)
+
+    def test_import_upserts_on_slug_and_resolves_collections(self):
+        path = self.write("products.csv", (
+            "slug,title,description,unit_price,inventory,collection_id,collection\n"
+            f"apple,Green apple,,4.5,7,{self.fruit.pk},\n"
+            "bread,Bread,Sourdough,5,3,,Bakery\n"
+            "cake,Cake,,12,1,,Bakery\n"
+            "pie,Pie,,abc,1,,Bakery\n"
+            "tart,Tart,,2,1,999,\n"
+        ))
+        stdout, stderr = StringIO(), StringIO()
+        with self.assertNumQueries(9):
+            call_command("import_products", path, "--batch-size", "10", stdout=stdout, stderr=stderr)
+        self.assertIn("Imported 5 rows", stdout.getvalue())
+        self.assertIn("2 created, 1 updated, 2 skipped", stdout.getvalue())
+        self.assertIn("Line 5: unit_price and inventory must be numbers.", stderr.getvalue())
+        self.assertIn("Line 6: Collection 999 does not exist.", stderr.getvalue())
+
+        self.apple.refresh_from_db()
+        self.assertEqual((self.apple.title, self.apple.unit_price, self.apple.inventory), ("Green apple", Decimal("4.50"), 7))
+        bakery = Collection.objects.get(title="Bakery")
+        self.assertEqual(sorted(bakery.product_set.values_list("slug", flat=True)), ["bread", "cake"])
+        self.assertEqual(bakery.products_count, 2)
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_import_moves_products_and_keeps_counters_and_search_current(self):
+        path = self.write("products.jsonl", (
+            '{"slug": "apple", "title": "Baked apple", "unit_price": "3", "inventory": 1, "collection": "Bakery"}\n'
+            "not json\n"
+        ))
+        call_command("import_products", path, stdout=StringIO(), stderr=StringIO())
+        self.fruit.refresh_from_db()
+        self.assertEqual(self.fruit.products_count, 0)
+        self.assertEqual(Collection.objects.get(title="Bakery").products_count, 1)
+        if search.is_available():
+            self.assertEqual(list(search.search_products(Product.objects.all(), "baked").values_list("slug", flat=True)), ["apple"])
+
+    def test_export_round_trips_through_import(self):
+        create_product(Collection.objects.create(title="Bakery"), "Bread", "Sourdough, \"fresh\"", unit_price="5.25")
+        for file_format in product_io.FORMATS:
+            path = self.path(f"products.{file_format}")
+            call_command("export_products", path, stdout=StringIO())
+            before = list(Product.objects.order_by("id").values_list("slug", "title", "description", "unit_price", "inventory", "collection_id"))
+            stdout = StringIO()
+            call_command("import_products", path, stdout=stdout, stderr=StringIO())
+            self.assertIn("0 created, 2 updated, 0 skipped", stdout.getvalue())
+            after = list(Product.objects.order_by("id").values_list("slug", "title", "description", "unit_price", "inventory", "collection_id"))
+            self.assertEqual(after, before)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="Bakery")
+        self.bread = create_product(collection, "Bread", unit_price="2.50")
+        self.cake = create_product(collection, "Cake", unit_price=12)
+        user = get_user_model().objects.create_user(username="ann", email="ann@example.com", password="x",
+                                                    first_name="Ann", last_name="Lee")
+        customer = user.customer
+        self.orders = []
+        for day, payment_status in [(1, Order.PAYMENT_COMPLETE), (2, Order.PAYMENT_PENDING), (3, Order.PAYMENT_COMPLETE)]:
+            order = Order.objects.create(customer=customer, payment_status=payment_status)
+            Order.objects.filter(pk=order.pk).update(placed_at=timezone.make_aware(timezone.datetime(2024, 1, day, 12)))
+            OrderItem.objects.create(order=order, product=self.bread, quantity=2, unit_price="2.50")
+            OrderItem.objects.create(order=order, product=self.cake, quantity=1, unit_price=12)
+            self.orders.append(order)
+        staff = get_user_model().objects.create_user(username="staff", email="staff@example.com", password="x", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+
+    def export(self, **params):
+        response = self.client.get("/store/orders/export/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_has_one_line_per_item(self):
+        lines = self.export().splitlines()
+        self.assertEqual(lines[0], ",".join(exports.CSV_HEADER))
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[1], f"{self.orders[0].pk},2024-01-01T12:00:00+00:00,C,{self.orders[0].customer_id},Ann Lee,"
+                                   f"ann@example.com,{OrderItem.objects.order_by('id')[0].pk},{self.bread.pk},Bread,2,2.50,5.00")
+
+    def test_ndjson_filtered_by_date_range_and_payment_status(self):
+        lines = self.export(file_format="ndjson", placed_after="2024-01-01T13:00:00Z", placed_before="2024-01-04",
+                            payment_status="C").splitlines()
+        orders = [json.loads(line) for line in lines]
+        self.assertEqual([order["id"] for order in orders], [self.orders[2].pk])
+        self.assertEqual([(item["product_title"], item["total_price"]) for item in orders[0]["items"]],
+                         [("Bread", "5.00"), ("Cake", "12.00")])
+        self.assertEqual(orders[0]["customer"]["name"], "Ann Lee")
+
+    def test_items_are_loaded_once_per_chunk(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(len(list(exports.iter_orders(Order.objects.all(), chunk_size=2))), 3)
+
+    def test_invalid_parameters_and_non_staff_are_rejected(self):
+        self.assertEqual(self.client.get("/store/orders/export/", {"file_format": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get("/store/orders/export/", {"placed_after": "yesterday"}).status_code, 400)
+        self.assertEqual(create_customer_client().get("/store/orders/export/").status_code, 403)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.fruit = Collection.objects.create(title="Fruit")
+        self.bakery = Collection.objects.create(title="Bakery")
+        self.apple = create_product(self.fruit, "Apple", unit_price=2)
+        self.bread = create_product(self.bakery, "Bread", unit_price=5)
+        customer = get_user_model().objects.create_user(username="ann", email="ann@example.com", password="x").customer
+        self.orders = {}
+        for name, day, payment_status, lines in [
+            ("first", 1, Order.PAYMENT_COMPLETE, [(self.apple, 3, "2.00"), (self.bread, 1, "5.00")]),
+            ("second", 1, Order.PAYMENT_COMPLETE, [(self.apple, 1, "1.50")]),
+            ("pending", 2, Order.PAYMENT_PENDING, [(self.bread, 2, "5.00")]),
+        ]:
+            order = Order.objects.create(customer=customer, payment_status=payment_status)
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, unit_price=price)
+                                           for product, quantity, price in lines])
+            Order.objects.filter(pk=order.pk).update(placed_at=timezone.make_aware(timezone.datetime(2024, 1, day, 23, 30)),
+                                                     updated_at=timezone.now() - timedelta(days=1))
+            self.orders[name] = Order.objects.get(pk=order.pk)
+        self.jan1, self.jan2 = timezone.datetime(2024, 1, 1).date(), timezone.datetime(2024, 1, 2).date()
+
+    def product_sales(self):
+        return sorted(DailyProductSales.objects.values_list("date", "product__title", "units", "revenue"))
+
+    def collection_sales(self):
+        return sorted(DailyCollectionSales.objects.values_list("date", "collection__title", "units", "revenue"))
+
+    def test_first_run_rolls_up_completed_orders(self):
+        self.assertEqual(sales.refresh(), [self.jan1, self.jan2])
+        self.assertEqual(self.product_sales(), [(self.jan1, "Apple", 4, Decimal("7.50")), (self.jan1, "Bread", 1, Decimal("5.00"))])
+        self.assertEqual(self.collection_sales(), [(self.jan1, "Bakery", 1, Decimal("5.00")), (self.jan1, "Fruit", 4, Decimal("7.50"))])
+
+    def test_only_changed_orders_are_rolled_up_again(self):
+        sales.refresh()
+        self.assertEqual(sales.refresh(), [])
+
+        pending = self.orders["pending"]
+        pending.payment_status = Order.PAYMENT_COMPLETE
+        pending.save()
+        first = self.orders["first"]
+        first.payment_status = Order.PAYMENT_FAILED
+        first.save()
+        self.assertEqual(sales.refresh(), [self.jan1, self.jan2])
+        self.assertEqual(self.product_sales(), [(self.jan1, "Apple", 1, Decimal("1.50")), (self.jan2, "Bread", 2, Decimal("10.00"))])
+
+    def test_item_changes_and_deleted_orders_are_rolled_up(self):
+        sales.refresh()
+        item = OrderItem.objects.get(order=self.orders["second"])
+        item.quantity = 2
+        item.save()
+        self.assertEqual(sales.refresh(), [self.jan1])
+        self.assertIn((self.jan1, "Apple", 5, Decimal("9.00")), self.product_sales())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.filter(order=self.orders["first"]).delete()
+            self.orders["first"].delete()
+        self.assertEqual(self.product_sales(), [(self.jan1, "Apple", 2, Decimal("3.00"))])
+
+    def test_staff_api(self):
+        sales.refresh()
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(username="staff", password="x", is_staff=True))
+        response = client.get("/store/sales/products/", {"date_after": "2024-01-01", "date_before": "2024-01-01", "collection_id": self.fruit.pk})
+        self.assertEqual([(row["product_id"], row["units"], row["revenue"]) for row in response.data["results"]],
+                         [(self.apple.pk, 4, Decimal("7.50"))])
+        response = client.get("/store/sales/collections/summary/")
+        self.assertEqual(response.data, [{"collection_id": self.fruit.pk, "units": 4, "revenue": Decimal("7.50")},
+                                         {"collection_id": self.bakery.pk, "units": 1, "revenue": Decimal("5.00")}])
+        self.assertEqual(create_customer_client().get("/store/sales/products/").status_code, 403)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        identity_cache.store.clear()
+        self.addCleanup(identity_cache.store.clear)
+        self.user = get_user_model().objects.create_user(username="ann", email="ann@example.com", password="x")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {RefreshToken.for_user(self.user).access_token}")
+
+    def test_identity_is_resolved_once_per_ttl(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get("/store/customers/me/").data["user"], self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/store/customers/me/").data["id"], self.user.customer.pk)
+        Order.objects.create(customer=self.user.customer)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get("/store/orders/").data["results"]), 1)
+
+    def test_password_hash_is_not_cached(self):
+        self.client.get("/store/customers/me/")
+        (fields, values), _ = identity_cache.store.get(identity_cache.make_key(self.user.pk))
+        self.assertNotIn("password", fields)
+        self.assertNotIn(self.user.password, values)
+
+    def test_saves_invalidate_the_entry(self):
+        self.client.get("/store/customers/me/")
+        customer = self.user.customer
+        customer.membership = "G"
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.save()
+        self.assertEqual(self.client.get("/store/customers/me/").data["membership"], "G")
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get("/store/customers/me/").status_code, 401)
+
+    def test_entries_expire(self):
+        with override_settings(IDENTITY_CACHE={"TIMEOUT": 0}):
+            self.client.get("/store/customers/me/")
+            with self.assertNumQueries(2):
+                self.client.get("/store/customers/me/")
+
+
+class BenchmarkTests(MediaRootTestMixin, TestCase):
+    def test_seed_and_run_every_scenario(self):
+        identity_cache.store.clear()
+        self.addCleanup(identity_cache.store.clear)
+        benchmark.seed({"collections": 2, "products": 30, "images": 5, "customers": 3, "orders": 6, "carts": 2})
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(sum(Collection.objects.values_list("products_count", flat=True)), 30)
+
+        report = benchmark.run(iterations=3, warmup=1)
+        self.assertEqual(set(report["scenarios"]), {"product_list", "product_list_filtered", "product_search",
+                                                    "product_detail", "cart_add", "checkout", "order_list"})
+        for name, result in report["scenarios"].items():
+            self.assertEqual(result["errors"], 0, name)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+
+    def test_compare_flags_regressions(self):
+        metrics = {"p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "throughput_rps": 100, "queries_mean": 2}
+        baseline = {"scenarios": {"product_list": metrics}}
+        current = {"scenarios": {"product_list": {**metrics, "p95_ms": 25, "throughput_rps": 95}}}
+        regressed = {(name, metric) for name, metric, *_, flag in benchmark.compare(baseline, current) if flag}
+        self.assertEqual(regressed, {("product_list", "p95_ms")})
+        self.assertEqual(benchmark.percentile([1, 2, 3, 4], 50), 2)
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False}, METRICS={"ENABLED": True})
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+        create_product(Collection.objects.create(title="Bakery"), "Bread")
+        self.client = APIClient()
+
+    def histogram(self, name, view, method="GET"):
+        return metrics.registry.histograms[name, (view, method)]
+
+    def test_requests_are_recorded_per_view_and_method(self):
+        self.client.get("/store/products/")
+        self.client.get("/store/products/")
+        self.client.get("/store/collections/")
+        self.assertEqual(self.histogram("http_request_duration_seconds", "product-list").count, 2)
+        self.assertEqual(self.histogram("db_queries_per_request", "product-list").sum, 6)
+        self.assertGreater(self.histogram("serializer_duration_seconds", "product-list").sum, 0)
+        self.assertEqual(metrics.registry.counters["http_responses_total", ("collection-list", "GET", "200")], 1)
+
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        self.client.get("/store/products/")
+        self.client.force_login(get_user_model().objects.create_user(username="staff", password="x", is_staff=True))
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = response.content.decode()
+        self.assertIn("# TYPE easycart_http_request_duration_seconds histogram", body)
+        self.assertIn('easycart_db_queries_per_request_bucket{view="product-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('easycart_http_request_duration_seconds_count{view="product-list",method="GET"} 1', body)
+        self.assertIn('easycart_http_responses_total{view="product-list",method="GET",status="200"} 1', body)
+
+    def test_metrics_endpoint_requires_the_configured_token(self):
+        with override_settings(METRICS={"TOKEN": "secret"}):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+        with override_settings(METRICS={"ENABLED": False}):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_metrics_endpoint_without_a_token_is_for_staff_only(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.client.force_login(get_user_model().objects.create_user(username="customer", password="x"))
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_slow_requests_are_logged_with_their_top_queries(self):
+        with override_settings(METRICS={"SLOW_REQUEST_SECONDS": 0}), self.assertLogs("store.metrics", "WARNING") as logs:
+            self.client.get("/store/products/")
+        self.assertIn("Slow request GET /store/products/ (product-list)", logs.output[0])
+        self.assertIn('FROM "store_product"', logs.output[0])
+
+    def test_snapshots_of_other_workers_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(METRICS={"DIRECTORY": directory, "FLUSH_INTERVAL": 0}):
+            self.client.get("/store/products/")
+            self.assertTrue(os.path.exists(os.path.join(directory, f"{os.getpid()}.json")))
+            shutil.copy(os.path.join(directory, f"{os.getpid()}.json"), os.path.join(directory, "other-worker.json"))
+            self.client.get("/store/products/")
+            histograms, counters = metrics.collect()
+        self.assertEqual(histograms["http_request_duration_seconds", ("product-list", "GET")][2], 3)
+        self.assertEqual(counters["http_responses_total", ("product-list", "GET", "200")], 3)
+
+
+class ProductCollectionTitleSerializer(serializers.ModelSerializer):
+    collection_title = serializers.CharField(source="collection.title")
+
+    class Meta:
+        model = Product
+        fields = ["id", "collection_title"]
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False})
+class QueryCheckTests(TestCase):
+    def setUp(self):
+        self.collections = [Collection.objects.create(title=f"Collection {number}") for number in range(4)]
+        self.products = [create_product(collection, f"Product {number}") for number, collection in enumerate(self.collections)]
+        customer = get_user_model().objects.create_user(username="ann", email="ann@example.com", password="x").customer
+        for product in self.products:
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.unit_price)
+        self.cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=self.cart, product=product, quantity=1) for product in self.products])
+        self.staff = get_user_model().objects.create_superuser(username="staff", email="staff@example.com", password="x")
+
+    def test_fingerprint_ignores_literals_and_in_list_lengths(self):
+        self.assertEqual(querycheck.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a''b' LIMIT 21"),
+                         querycheck.fingerprint("SELECT * FROM t WHERE id IN (%s) AND name = 'c' LIMIT 1"))
+
+    def test_repeated_queries_are_traced_to_the_serializer_field(self):
+        with self.assertRaisesMessage(querycheck.NPlusOneError, "4 x ProductCollectionTitleSerializer.collection_title"):
+            with querycheck.query_budget():
+                ProductCollectionTitleSerializer(Product.objects.all(), many=True).data
+        with querycheck.query_budget(1):
+            ProductCollectionTitleSerializer(Product.objects.select_related("collection"), many=True).data
+
+    def test_repeated_queries_are_traced_to_the_admin_column(self):
+        self.client.force_login(self.staff)
+        with querycheck.query_budget(threshold=3):
+            self.assertEqual(self.client.get("/admin/store/order/").status_code, 200)
+        with mock.patch("store.admin.OrderAdmin.list_select_related", False), override_settings(QUERY_CHECK={"ENABLED": False}):
+            with self.assertRaisesMessage(querycheck.NPlusOneError, "x OrderAdmin.customer_name"):
+                with querycheck.query_budget(threshold=3):
+                    self.client.get("/admin/store/order/")
+
+    def test_budget_counts_queries(self):
+        with self.assertRaisesMessage(querycheck.NPlusOneError, "2 queries ran, over the budget of 1"):
+            with querycheck.query_budget(1):
+                list(Product.objects.all())
+                list(Collection.objects.all())
+
+    def test_store_endpoints_stay_within_their_budgets(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        for url, budget in [("/store/collections/", 1), ("/store/products/", 3), (f"/store/carts/{self.cart.pk}/", 2),
+                            (f"/store/carts/{self.cart.pk}/cartitems/", 1), ("/store/orders/", 1),
+                            ("/store/customers/", 1), ("/store/orders/export/", 2)]:
+            with self.subTest(url=url), querycheck.query_budget(budget):
+                response = client.get(url)
+                b"".join(response.streaming_content) if response.streaming else response.content
+
+    #the patched-in ModelSerializer only serves GETs with the row serializers off
+    @override_settings(QUERY_CHECK={"ENABLED": True, "THRESHOLD": 3}, FAST_SERIALIZERS={"ENABLED": False})
+    def test_middleware_logs_repeated_queries(self):
+        with self.assertNoLogs("store.querycheck", "WARNING"):
+            self.client.get("/store/products/")
+        with mock.patch("store.views.ProductViewSet.serializer_class", ProductCollectionTitleSerializer), \
+                self.assertLogs("store.querycheck", "WARNING") as logs:
+            self.client.get("/store/products/")
+        self.assertIn("GET /store/products/ ran", logs.output[0])
+        self.assertIn("ProductCollectionTitleSerializer.collection_title", logs.output[0])
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite's")
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        failures = queryplans.check()
+        self.assertEqual(failures, [], "\n".join(
+            f"{name}: {'; '.join(problems)}\n  plan: {' | '.join(plan)}" for name, plan, problems in failures))
+
+    def test_collection_price_filter_seeks_the_composite_index(self):
+        query = Product.objects.filter(collection_id=1, unit_price__gt=5).order_by("unit_price", "id")[:11]
+        self.assertIn("(collection_id=? AND unit_price>?)", " ".join(queryplans.explain(query)))
+
+    def test_dropped_index_is_reported(self):
+        #DDL is transactional in SQLite, so the test's rollback restores the index
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX "{Order._meta.indexes[0].name}"')
+        failures = queryplans.check([query for query in queryplans.HOT_QUERIES if query.name == "order history of a customer"])
+        self.assertEqual([name for name, _, _ in failures], ["order history of a customer"])
+        self.assertIn("expected SEARCH store_order USING INDEX store_order_custome_700a25_idx", failures[0][2])
+
+    def test_index_scans_fail_unless_declared_ordered_walks(self):
+        plan = ["SCAN store_product", "SCAN store_product USING INDEX i", "SCAN store_product USING COVERING INDEX i"]
+        self.assertEqual(queryplans.plan_problems(plan), plan)
+        self.assertEqual(queryplans.plan_problems(plan, ordered_walk=True), ["SCAN store_product"])
+
+    def test_each_hot_query_reads_its_index(self):
+        for query in queryplans.HOT_QUERIES:
+            with self.subTest(query=query.name):
+                plan = queryplans.explain(query.build())
+                self.assertTrue(any(line.startswith(query.uses) for line in plan), plan)
+                self.assertEqual(queryplans.plan_problems(plan, query.ordered_walk), [])
+
+
+@override_settings(PRICING={"TAX_RATE": "0.1"})
+class PricingTests(TestCase):
+    def setUp(self):
+        catalog_cache.clear()
+        self.addCleanup(catalog_cache.clear)
+        collection = Collection.objects.create(title="Fruit")
+        self.products = [create_product(collection, f"Product {number}", unit_price=Decimal("19.99")) for number in range(12)]
+        self.sale = Promotion.objects.create(description="Sale", discount=25)
+        self.clearance = Promotion.objects.create(description="Clearance", discount=50)
+        for product in self.products[:6]:
+            product.promotions.add(self.sale)
+        self.products[0].promotions.add(self.clearance)
+        self.client = APIClient()
+
+    def prices(self, response):
+        return {product["id"]: product["price_with_tax"] for product in response.data["results"]}
+
+    def test_largest_discount_then_tax_applies(self):
+        prices = pricing.compute(self.products)
+        self.assertEqual(prices[self.products[0].pk], Decimal("10.99"))
+        self.assertEqual(prices[self.products[1].pk], Decimal("16.49"))
+        self.assertEqual(prices[self.products[11].pk], Decimal("21.99"))
+        detail = self.client.get(f"/store/products/{self.products[1].pk}/")
+        self.assertEqual(detail.data["price_with_tax"], Decimal("16.49"))
+
+    def test_a_page_is_priced_with_one_query(self):
+        #count, page, images and promotions
+        with querycheck.query_budget(4):
+            response = self.client.get("/store/products/", {"page": 1})
+        self.assertEqual(len(self.prices(response)), 10)
+        #a second page with other filters reads the price table
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get("/store/products/", {"unit_price__gt": 1})
+        self.assertFalse([query for query in captured if "store_product_promotions" in query["sql"]])
+
+    def test_promotion_writes_reprice(self):
+        url = "/store/products/?page=1"
+        self.assertEqual(self.prices(self.client.get(url))[self.products[1].pk], Decimal("16.49"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sale.discount = 10
+            self.sale.save()
+        self.assertEqual(self.prices(self.client.get(url))[self.products[1].pk], Decimal("19.79"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].promotions.remove(self.sale)
+        self.assertEqual(self.prices(self.client.get(url))[self.products[1].pk], Decimal("21.99"))
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        catalog_cache.clear()
+        self.addCleanup(catalog_cache.clear)
+        self.fruit = Collection.objects.create(title="Fruit")
+        self.bakery = Collection.objects.create(title="Bakery")
+        for title, collection, price in [("Apple", self.fruit, 2), ("Pear", self.fruit, 12), ("Melon", self.fruit, 30),
+                                         ("Bread", self.bakery, 4), ("Cake", self.bakery, 600)]:
+            create_product(collection, title, unit_price=price)
+        self.client = APIClient()
+
+    def facets(self, **params):
+        response = self.client.get("/store/products/", params)
+        self.assertEqual(response.status_code, 200)
+        facets = response.data["facets"]
+        if "price" in facets:
+            facets["price"] = {str(bucket["min"]): bucket["products_count"] for bucket in facets["price"] if bucket["products_count"]}
+        return facets
+
+    def test_counts_cover_the_filtered_list_from_one_query(self):
+        with CaptureQueriesContext(connection) as captured:
+            facets = self.facets(facets="collection,price")
+        self.assertEqual(facets["collection"], [{"id": self.fruit.pk, "title": "Fruit", "products_count": 3},
+                                                {"id": self.bakery.pk, "title": "Bakery", "products_count": 2}])
+        self.assertEqual(facets["price"], {"0": 2, "10": 1, "25": 1, "500": 1})
+        self.assertEqual(len([query for query in captured if '"collection__title"' in query["sql"]]), 1)
+        self.assertEqual(self.facets(facets="price", collection_id=self.bakery.pk), {"price": {"0": 1, "500": 1}})
+        self.assertNotIn("facets", self.client.get("/store/products/").data)
+
+    def test_counts_are_cached_for_every_page_of_the_filters(self):
+        for number in range(10):
+            create_product(self.fruit, f"Plum {number}", unit_price=1)
+        first = self.client.get("/store/products/", {"facets": "collection", "unit_price__lt": 100})
+        self.assertEqual(first.data["facets"]["collection"][0]["products_count"], 13)
+        with CaptureQueriesContext(connection) as captured:
+            second = self.client.get(first.data["next"])
+            by_price = self.client.get("/store/products/", {"facets": "collection", "unit_price__lt": 100, "ordering": "unit_price"})
+        self.assertFalse([query for query in captured if '"collection__title"' in query["sql"]])
+        self.assertEqual(second.data["facets"], first.data["facets"])
+        self.assertEqual(by_price.data["facets"], first.data["facets"])
+        self.assertEqual(self.client.get("/store/products/", {"facets": "collection,price"}).data["facets"].keys(),
+                         {"collection", "price"})
+
+    def test_unknown_facet_is_rejected(self):
+        response = self.client.get("/store/products/", {"facets": "collection,colour"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("colour", response.data["facets"])
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False})
+class ProductTagFilterTests(TestCase):
+    def setUp(self):
+        tag_sets.clear()
+        self.addCleanup(tag_sets.clear)
+        fruit = Collection.objects.create(title="Fruit")
+        self.apple, self.pear, self.plum = (create_product(fruit, title) for title in ["Apple", "Pear", "Plum"])
+        self.organic, self.local, self.sale = (Tag.objects.create(label=label) for label in ["Organic", "Local", "Sale"])
+        self.tag(self.apple, self.organic, self.local)
+        self.tag(self.pear, self.organic)
+        self.tag(self.plum, self.local)
+        self.client = APIClient()
+
+    def tag(self, product, *tags):
+        TaggedItem.objects.bulk_create([TaggedItem(tag=tag, content_object=product) for tag in tags])
+
+    def titles(self, **params):
+        response = self.client.get("/store/products/", params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(product["title"] for product in response.data["results"])
+
+    def test_tags_match_all_and_tags_any_match_one(self):
+        self.assertEqual(self.titles(tags="organic,local"), ["Apple"])
+        self.assertEqual(self.titles(tags="Organic"), ["Apple", "Pear"])
+        self.assertEqual(self.titles(tags_any="organic,local"), ["Apple", "Pear", "Plum"])
+        self.assertEqual(self.titles(tags="organic,sale"), [])
+        self.assertEqual(self.titles(tags_any="sale,unknown"), [])
+        self.assertEqual(self.titles(tags="organic", unit_price__gt=5, ordering="-unit_price"), ["Apple", "Pear"])
+
+    def test_tag_sets_are_loaded_once(self):
+        self.titles(tags="organic")
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(tag_sets.matching(["organic", "local"]), {self.apple.pk})
+            response = self.client.get("/store/products/tags/")
+        self.assertEqual(len(captured), 0)
+        #an unused tag has no set, so it isn't listed
+        self.assertEqual(response.data, [{"label": "Local", "products_count": 2}, {"label": "Organic", "products_count": 2}])
+
+    def test_tag_writes_reload_the_sets(self):
+        self.assertEqual(self.titles(tags="sale"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.create(tag=self.sale, content_object=self.plum)
+        self.assertEqual(self.titles(tags="sale"), ["Plum"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sale.label = "Clearance"
+            self.sale.save()
+        self.assertEqual(self.titles(tags="clearance"), ["Plum"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.delete()
+        self.assertFalse(TaggedItem.objects.filter(object_id=self.apple.pk).exists())
+        self.assertEqual(self.titles(tags_any="organic,local"), ["Pear", "Plum"])
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False})
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.fruit = Collection.objects.create(title="Fruit")
+        self.bakery = Collection.objects.create(title="Bakery")
+        self.apple = create_product(self.fruit, "Red apple", "Crisp and sweet", unit_price=3)
+        self.pie = create_product(self.bakery, "Pie", "Baked with apple and cinnamon", unit_price=8)
+        self.bread = create_product(self.bakery, "Bread", "Sourdough loaf", unit_price=5)
+
+    def search(self, query):
+        response = self.client.get("/store/products/", {"search": query})
+        self.assertEqual(response.status_code, 200)
+        return [product["title"] for product in response.data["results"]]
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search("apple"), ["Red apple", "Pie"])
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search("sour"), ["Bread"])
+        self.assertEqual(self.search("baked cinn"), ["Pie"])
+
+    def test_text_without_words_matches_nothing(self):
+        for query in ["!!!", "  *-\" ", " \t& ("]:
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), [])
+
+    def test_index_follows_product_writes(self):
+        self.bread.title = "Brioche"
+        self.bread.save()
+        self.assertEqual(self.search("brioche"), ["Brioche"])
+        self.bread.delete()
+        self.assertEqual(self.search("brioche"), [])
+
+    def test_composes_with_filters_ordering_and_pagination(self):
+        for i in range(12):
+            create_product(self.fruit, f"Green apple {i}", unit_price=20 + i)
+        response = self.client.get("/store/products/", {"search": "apple", "collection_id": self.fruit.id,
+                                                        "unit_price__gt": 25, "ordering": "-unit_price", "page": 1})
+        titles = [product["title"] for product in response.data["results"]]
+        self.assertEqual(response.data["count"], 6)
+        self.assertEqual(titles[0], "Green apple 11")
+        second_page = self.client.get("/store/products/", {"search": "apple", "page": 2})
+        self.assertEqual(second_page.data["count"], 14)
+        self.assertEqual(len(second_page.data["results"]), 4)
+
+    def test_falls_back_to_icontains_without_index(self):
+        with mock.patch.object(search, "is_available", return_value=False):
+            self.assertEqual(sorted(self.search("ough")), ["Bread"])
+
+    def test_post_migrate_reinstalls_sync_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {search.FTS_TABLE}_ai")
+        reinstall_search_triggers(sender=apps.get_app_config("store"), using="default")
+        create_product(self.fruit, "Mango")
+        self.assertEqual(self.search("mango"), ["Mango"])
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.collection = Collection.objects.create(title="Fruit")
+        self.apple = create_product(self.collection, "Apple")
+
+    def later(self, seconds):
+        #Last-Modified is only sent once the second of the last write is over
+        return mock.patch("store.cache.time.time", return_value=time.time() + seconds)
+
+    def test_current_etag_gets_304_without_queries(self):
+        for url in [f"/store/products/{self.apple.pk}/", "/store/products/", "/store/collections/",
+                    f"/store/collections/{self.collection.pk}/"]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+            self.assertTrue(response["ETag"])
+
+    def test_etag_varies_with_the_request(self):
+        etags = {self.client.get(url, params)["ETag"] for url, params in [
+            ("/store/products/", {}), ("/store/products/", {"ordering": "unit_price"}),
+            (f"/store/products/{self.apple.pk}/", {}), (f"/store/products/{self.apple.pk}/", {"format": "api"})]}
+        self.assertEqual(len(etags), 4)
+
+    def test_catalog_writes_change_the_validators(self):
+        url = f"/store/products/{self.apple.pk}/"
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.apple.pk).update(inventory=3)
+            catalog_cache.invalidate()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["inventory"], 3)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_modified_since(self):
+        url = "/store/collections/"
+        self.assertFalse(self.client.get(url).has_header("Last-Modified"))
+        with self.later(2):
+            last_modified = self.client.get(url)["Last-Modified"]
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            with self.captureOnCommitCallbacks(execute=True):
+                Collection.objects.create(title="Vegetables")
+        with self.later(4):
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_errors_are_not_tagged(self):
+        response = self.client.get("/store/products/0/")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header("ETag"))
+
+
+@override_settings(CATALOG_CACHE={"ENABLED": False}, PRICING={"TAX_RATE": "0.1"})
+class FastSerializerParityTests(TestCase):
+    """Every row-serializer endpoint must send the bytes the ModelSerializers and DRF's JSONRenderer would."""
+
+    def setUp(self):
+        self.client = create_customer_client()
+        fruit = Collection.objects.create(title="Fruit")
+        Collection.objects.create(title="Empty \u2028 shelf")
+        self.products = [create_product(fruit, f"Fruit {i:02}", unit_price=Decimal("1.5") * (i + 1), description=None if i % 3 else "é\u2029\"")
+                         for i in range(13)]
+        promotion = Promotion.objects.create(description="Sale", discount=12.5)
+        self.products[1].promotions.add(promotion)
+        ProductImage.objects.bulk_create([
+            ProductImage(product=self.products[0], image="store/images/a.jpg", thumbnail="store/images/derivatives/a.jpg"),
+            ProductImage(product=self.products[0], image="store/images/b.jpg"),
+            ProductImage(product=self.products[2], image="store/images/c d.jpg"),
+        ])
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.products[3], quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+        self.order = Order.objects.create(customer=Customer.objects.get(user__username="customer"))
+        OrderItem.objects.create(order=self.order, product=self.products[4], quantity=3, unit_price=Decimal("7.1"))
+
+    def assertParity(self, url, params=None):
+        with override_settings(FAST_SERIALIZERS={"ENABLED": False}):
+            expected = self.client.get(url, params)
+        #the ModelSerializers must not run at all on the fast path
+        with mock.patch("rest_framework.serializers.Serializer.to_representation", side_effect=AssertionError):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, JSONRenderer().render(expected.data))
+        return response
+
+    def test_products(self):
+        first = self.assertParity("/store/products/")
+        next_page = first.data["next"]
+        self.assertParity(next_page)
+        for params in [{"ordering": "-unit_price"}, {"ordering": "last_update"}, {"page": 2},
+                       {"collection_id": self.products[0].collection_id, "unit_price__lt": 10},
+                       {"facets": "collection,price"}, {"search": "fruit"}]:
+            with self.subTest(params=params):
+                self.assertParity("/store/products/", params)
+        for product in self.products[:3]:
+            self.assertParity(f"/store/products/{product.pk}/")
+        self.assertParity("/store/products/0/")
+
+    def test_collections(self):
+        self.assertParity("/store/collections/")
+        self.assertParity(f"/store/collections/{self.products[0].collection_id}/")
+
+    def test_cart_and_order_items(self):
+        items = self.assertParity(f"/store/carts/{self.cart.pk}/cartitems/")
+        self.assertParity(f"/store/carts/{self.cart.pk}/cartitems/{items.data[0]['id']}/")
+        self.assertParity(f"/store/orders/{self.order.pk}/orderitems/")
+        self.assertParity(f"/store/orders/{self.order.pk}/orderitems/{self.order.orderitem_set.get().pk}/")
+
+    def test_query_counts_match(self):
+        for url in ["/store/products/", f"/store/products/{self.products[0].pk}/", f"/store/carts/{self.cart.pk}/cartitems/"]:
+            with self.subTest(url=url):
+                with override_settings(FAST_SERIALIZERS={"ENABLED": False}), CaptureQueriesContext(connection) as expected:
+                    self.client.get(url)
+                with CaptureQueriesContext(connection) as fast:
+                    self.client.get(url)
+                self.assertEqual(len(fast), len(expected))
+
+    def test_renderer(self):
+        values = [
+            {"price": Decimal("19.90"), "id": uuid4(), "at": timezone.now(), "day": timezone.now().date(), "none": None,
+             "text": "tab\t\u2028\u2029 é \x00 \"quoted\"", "nested": [[], {}, (1, 2.5, True)], "big": Decimal("12345678901234567890.5")},
+            [Decimal("0.1"), Decimal("1E+2"), Decimal("-0.00"), 1e-05, 10 ** 20],
+            "plain", None,
+        ]
+        for value in values:
+            with self.subTest(value=value):
+                self.assertEqual(FastJSONRenderer().render(value), JSONRenderer().render(value))
+                self.assertEqual(FastJSONRenderer().render(value, "application/json; indent=4"),
+                                 JSONRenderer().render(value, "application/json; indent=4"))
+        with self.assertRaises(ValueError):
+            FastJSONRenderer().render(float("nan"))
@@ -7,6 +7,8 @@ router.register("products",viewset=views.ProductViewSet)
 router.register("customers",viewset=views.CustomerViewSet,basename="customers")
 router.register("carts",viewset=views.CartViewSet)
 router.register("orders",viewset=views.OrderViewSet,basename="orders")
+router.register("sales/products",viewset=views.ProductSalesViewSet,basename="product-sales")
+router.register("sales/collections",viewset=views.CollectionSalesViewSet,basename="collection-sales")
 
 cart_router = routers.NestedSimpleRouter(router,"carts",lookup="cart")
 cart_router.register("cartitems",viewset=views.CartItemViewSet,basename="cartitems")
@@ -1,42 +1,104 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.db.models import Sum
 from django.shortcuts import render,get_object_or_404
+from django.utils import timezone
+from django.views import static
+from uuid import UUID
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.viewsets import ModelViewSet,GenericViewSet
+from rest_framework.viewsets import ModelViewSet,GenericViewSet,ReadOnlyModelViewSet
 from rest_framework.mixins import RetrieveModelMixin,DestroyModelMixin,CreateModelMixin
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAdminUser,IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework import status
-from rest_framework.filters import SearchFilter,OrderingFilter
-from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem,Product, ProductImage
-from store.serializers import AddCartItemSerializer, AddOrderSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, OrderItemSerializer, OrderSerializer, ProductImageSerializer,ProductSerializer,CustomerSerializer, UpdateCartItemSerializer, UpdateOrderItemSerializer, UpdateOrderSerializer
-from store.pagination import CustomPagePagination
+from rest_framework import generics, status
+from rest_framework.filters import OrderingFilter
+from store.models import Cart, CartItem, Collection, Customer, DailyCollectionSales, DailyProductSales, Order, OrderItem,Product, ProductImage
+from store.serializers import AddCartItemSerializer, StoredCartSerializer, AddOrderSerializer, BatchAddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, DailyCollectionSalesSerializer, DailyProductSalesSerializer, OrderItemSerializer, OrderSerializer, ProductImageSerializer,ProductSerializer,CustomerSerializer, UpdateCartItemSerializer, UpdateOrderItemSerializer, UpdateOrderSerializer
+from store.pagination import KeysetPagination
 from store.permissions import IsAdminOrReadOnly
-from store.filters import ProductFilter
+from store.filters import DailyCollectionSalesFilter, DailyProductSalesFilter, OrderExportFilter, ProductFilter, ProductSearchFilter
+from store.cache import catalog_cache
+from store import exports, facets, fastserializers, metrics
+from store.tagsets import tag_sets
+from store.cartstore import cart_store
+from store.storage import is_content_addressed
 
 
 # Create your views here.
-class CollectionViewSet(ModelViewSet):
+class ConditionalCatalogMixin:
+    """Answer catalog GETs carrying a current If-None-Match or If-Modified-Since with 304.
+
+    The validators come from the catalog version (see CatalogCache.validators),
+    so the check runs before any query or serialization.
+    """
+
+    def conditional_response(self, kind, render, *key_parts):
+        etag, last_modified = catalog_cache.validators(kind, self.request, *key_parts)
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+class FastReadMixin:
+    """Serve GET list and retrieve from .values() rows through row_serializer_class (see store.fastserializers)."""
+    row_serializer_class = None
+
+    def use_rows(self):
+        #the browsable API's forms override the method, and get the regular serializer
+        return (fastserializers.enabled() and self.action in ("list","retrieve")
+                and self.request.method in ("GET","HEAD"))
+
+    def get_serializer(self, *args, **kwargs):
+        if self.use_rows():
+            kwargs.setdefault("context", self.get_serializer_context())
+            return self.row_serializer_class(*args, **kwargs)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.use_rows():
+            return queryset.prefetch_related(None).values(*self.row_serializer_class.columns)
+        return queryset
+
+
+class CollectionViewSet(ConditionalCatalogMixin, FastReadMixin, ModelViewSet):
     queryset = Collection.objects.all().order_by("id")
     serializer_class = CollectionSerializer
+    row_serializer_class = fastserializers.CollectionRowSerializer
     permission_classes = [IsAdminOrReadOnly]
 
     def get_serializer_context(self):
         return {"request":self.request}
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response("collections", lambda: super(CollectionViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response("collection", lambda: super(CollectionViewSet, self).retrieve(request, *args, **kwargs), kwargs["pk"])
     
     def destroy(self, request, *args, **kwargs):
-        products_count = self.get_object().product_set.count()
-        if products_count > 0:
+        if self.get_object().products_count > 0:
             raise ValidationError({"error":"Can't delete the collection as it has products associated with it."})
         return super().destroy(request, *args, **kwargs)
     
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalCatalogMixin, FastReadMixin, ModelViewSet):
     queryset = Product.objects.prefetch_related("images").all().order_by("id")
     serializer_class = ProductSerializer
-    pagination_class = CustomPagePagination
+    row_serializer_class = fastserializers.ProductRowSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAdminOrReadOnly]
-    filter_backends = [DjangoFilterBackend,SearchFilter,OrderingFilter]
+    filter_backends = [DjangoFilterBackend,ProductSearchFilter,OrderingFilter]
     filterset_class = ProductFilter
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price', 'last_update']
@@ -44,6 +106,61 @@ class ProductViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def filter_queryset(self, queryset):
+        #kept for the facet counts, which cover every page of the filtered list
+        self.filtered_queryset = super().filter_queryset(queryset)
+        return self.filtered_queryset
+
+    def list(self, request, *args, **kwargs):
+        facet_names = facets.requested(request)
+
+        def render():
+            response = super(ProductViewSet, self).list(request, *args, **kwargs)
+            if facet_names:
+                response.data["facets"] = self.facet_counts(facet_names)
+            return response
+        return self.conditional_response("list", lambda: self.cached_response("list", render))
+
+    def facet_counts(self, names):
+        if not catalog_cache.enabled:
+            return facets.count(self.filtered_queryset, names)
+        #shared by every page and ordering of the same filters
+        key = catalog_cache.make_key("facets", self.request, *names, ignore=facets.PAGE_PARAMS)
+        hit, counts = catalog_cache.get(key)
+        if not hit:
+            counts = facets.count(self.filtered_queryset, names)
+            catalog_cache.set(key, counts)
+        return counts
+
+    def retrieve(self, request, *args, **kwargs):
+        def render():
+            return self.cached_response("detail", lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs), kwargs["pk"])
+        return self.conditional_response("detail", render, kwargs["pk"])
+
+    def cached_response(self, kind, render, *key_parts):
+        if not catalog_cache.enabled:
+            return render()
+        key = catalog_cache.make_key(kind, self.request, *key_parts)
+        hit, data = catalog_cache.get(key)
+        if hit:
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+        response = render()
+        if response.status_code == status.HTTP_200_OK:
+            catalog_cache.set(key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
+    @action(detail=False, methods=["get"])
+    def tags(self, request):
+        #counted from the in-memory tag sets, not from TaggedItem
+        return Response([{"label": label, "products_count": count} for label, count in tag_sets.counts()])
+
+    @action(detail=False, methods=["get"], url_path="cache-stats", permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(catalog_cache.stats())
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Product cannot be deleted because it is associated with an order item.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -63,12 +180,14 @@ class ProductImageViewSet(ModelViewSet):
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all().order_by("id")
     serializer_class = CustomerSerializer
+    pagination_class = KeysetPagination
     http_method_names = ["get","post","patch","options","put"]
     permission_classes = [IsAdminUser]
 
     @action(detail=False,methods=["get","options","patch"],permission_classes=[IsAuthenticated])
     def me(self,request):
-        customer = Customer.objects.get(user=self.request.user.id)
+        #attached by CachedJWTAuthentication; loaded on access otherwise
+        customer = self.request.user.customer
         if request.method == "GET":
             serializer = CustomerSerializer(instance=customer)
             return Response(data=serializer.data)
@@ -80,29 +199,141 @@ class CustomerViewSet(ModelViewSet):
             return Response(data=serializer.data,status=status.HTTP_200_OK)
 
 
+def stored_cart_id(value):
+    #the key-value cart store has no UUIDField to reject malformed ids
+    try:
+        return UUID(str(value))
+    except ValueError:
+        raise Http404
+
+
 class CartViewSet(RetrieveModelMixin,
                   CreateModelMixin,
                   DestroyModelMixin,
                   GenericViewSet):
-    queryset = Cart.objects.all()
+    #with CARTS["BACKEND"] set to a key-value store, every action goes to cart_store instead (no SQL writes)
+    queryset = Cart.objects.with_totals()
     serializer_class = CartSerializer
 
+    def create(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().create(request, *args, **kwargs)
+        return Response(StoredCartSerializer(cart_store.create()).data,status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().retrieve(request, *args, **kwargs)
+        cart = cart_store.get(stored_cart_id(kwargs["pk"]))
+        if cart is None:
+            raise Http404
+        return Response(StoredCartSerializer(cart).data)
+
     def destroy(self, request, *args, **kwargs):
+        if cart_store.enabled:
+            cart_id = stored_cart_id(kwargs["pk"])
+            lines = cart_store.lines(cart_id)
+            if lines is None:
+                raise Http404
+            if lines:
+                raise ValidationError({'error':"Can't delete the cart as it has items in it."})
+            cart_store.delete(cart_id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
         cart = get_object_or_404(Cart,id=self.kwargs["pk"])
         if cart.cartitem_set.count() > 0:
             raise ValidationError({'error':"Can't delete the cart as it has items in it."})
         return super().destroy(request, *args, **kwargs)
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(FastReadMixin, ModelViewSet):
     http_method_names = ["get","options","post","patch","delete"]
+    row_serializer_class = fastserializers.CartItemRowSerializer
+
     def get_serializer_context(self):
         return {'cart_id':self.kwargs["cart_pk"]}
     
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related('product')
+        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).with_totals()
+
+    def stored_cart(self):
+        cart = cart_store.get(stored_cart_id(self.kwargs["cart_pk"]))
+        if cart is None:
+            raise Http404
+        return cart
+
+    def stored_item(self):
+        for item in self.stored_cart().items:
+            if str(item.id) == self.kwargs["pk"]:
+                return item
+        raise Http404
+
+    def list(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().list(request, *args, **kwargs)
+        return Response(CartItemSerializer(self.stored_cart().items,many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(CartItemSerializer(self.stored_item()).data)
+
+    def sql_cart(self):
+        #the item upserts would otherwise send an unknown or malformed cart id straight into the INSERT
+        return generics.get_object_or_404(Cart.objects.only("id"),pk=self.kwargs["cart_pk"])
+
+    def create(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            self.sql_cart()
+            return super().create(request, *args, **kwargs)
+        serializer = AddCartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = self.add_stored_products({serializer.validated_data["product_id"]:serializer.validated_data["quantity"]})
+        if not items:
+            raise ValidationError({"product_id":["No product with the given ID was found."]})
+        return Response(AddCartItemSerializer(items[0]).data,status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().partial_update(request, *args, **kwargs)
+        serializer = UpdateCartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            item_id = int(kwargs["pk"])
+        except ValueError:
+            raise Http404
+        item = cart_store.set_quantity(stored_cart_id(kwargs["cart_pk"]),item_id,serializer.validated_data["quantity"])
+        if item is None:
+            raise Http404
+        return Response(UpdateCartItemSerializer(item).data)
+
+    def destroy(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().destroy(request, *args, **kwargs)
+        item = self.stored_item()
+        cart_store.remove(item.cart_id,item.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def add_stored_products(self, quantities, require_all=False):
+        items = cart_store.add_products(stored_cart_id(self.kwargs["cart_pk"]),quantities,require_all)
+        if items is None:
+            raise Http404
+        return items
+
+    @action(detail=False,methods=["post"])
+    def batch(self,request,cart_pk=None):
+        serializer = BatchAddCartItemSerializer(data=request.data,context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        if cart_store.enabled:
+            quantities = serializer.merged_quantities()
+            items = self.add_stored_products(quantities,require_all=True)
+            serializer.check_all_found(quantities,items)
+        else:
+            self.sql_cart()
+            items = serializer.save()
+        return Response(data=AddCartItemSerializer(instance=items,many=True).data,status=status.HTTP_201_CREATED)
     
     def get_serializer_class(self):
+        if self.action == "batch":
+            return BatchAddCartItemSerializer
         if self.request.method == "POST":
             return AddCartItemSerializer
         if self.request.method == "PATCH":
@@ -110,12 +341,12 @@ class CartItemViewSet(ModelViewSet):
         return CartItemSerializer
     
 class OrderViewSet(ModelViewSet):
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         if self.request.user.is_staff:
             return Order.objects.all().order_by("id")
-        customer = Customer.objects.get(user__id=self.request.user.id)
-        return Order.objects.filter(customer=customer)
+        return Order.objects.filter(customer_id=self.request.user.customer.pk).order_by("id")
     
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -125,23 +356,38 @@ class OrderViewSet(ModelViewSet):
         return OrderSerializer
     
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE','PUT']:
+        if self.request.method in ['PATCH', 'DELETE','PUT'] or self.action == "export":
             return [IsAdminUser()]
         return [IsAuthenticated()]
     
     def get_serializer_context(self):
-        return {"user_id":self.request.user.id}
+        return {"request":self.request}
     
     def create(self, request, *args, **kwargs):
-        serializer = AddOrderSerializer(data=request.data,context={'user_id':self.request.user.id})
+        serializer = AddOrderSerializer(data=request.data,context={"customer_id":self.request.user.customer.pk})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         serializer = OrderSerializer(instance=order)
         return Response(data=serializer.data,status=status.HTTP_201_CREATED)
+
+    @action(detail=False,methods=["get"])
+    def export(self, request):
+        #streams ?file_format=csv (one line per item, default) or ndjson (one order per line);
+        #DRF reserves ?format= for renderer selection
+        file_format = request.query_params.get("file_format","csv")
+        if file_format not in exports.FORMATS:
+            raise ValidationError({"file_format":[f"Choose one of: {', '.join(exports.FORMATS)}."]})
+        filterset = OrderExportFilter(request.query_params,queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        response = StreamingHttpResponse(exports.export_lines(filterset.qs,file_format),content_type=exports.FORMATS[file_format])
+        response["Content-Disposition"] = f'attachment; filename="orders-{timezone.now():%Y%m%d-%H%M%S}.{file_format}"'
+        return response
     
 
-class OrderItemViewSet(ModelViewSet):
+class OrderItemViewSet(FastReadMixin, ModelViewSet):
     http_method_names = ["get","post","options","patch","delete"]
+    row_serializer_class = fastserializers.OrderItemRowSerializer
 
     def get_permissions(self):
         if self.request.method in ["PATCH","DELETE","POST"]:
@@ -158,4 +404,61 @@ class OrderItemViewSet(ModelViewSet):
         if self.request.method == "PATCH":
             return UpdateOrderItemSerializer
         return OrderItemSerializer
-        
\ No newline at end of file
+        
+
+class SalesRollupViewSet(ReadOnlyModelViewSet):
+    #daily rows of the rollup tables kept by the refresh_sales_rollups job; they trail orders by one run
+    pagination_class = KeysetPagination
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend]
+    group_field = None
+
+    @action(detail=False,methods=["get"])
+    def summary(self, request):
+        #totals per product/collection over the filtered days, best sellers first
+        rows = (self.filter_queryset(self.get_queryset())
+                .order_by().values(self.group_field)
+                .annotate(units=Sum("units"),revenue=Sum("revenue"))
+                .order_by("-revenue",self.group_field))
+        return Response(list(rows))
+
+class ProductSalesViewSet(SalesRollupViewSet):
+    queryset = DailyProductSales.objects.order_by("date")
+    serializer_class = DailyProductSalesSerializer
+    filterset_class = DailyProductSalesFilter
+    group_field = "product_id"
+
+class CollectionSalesViewSet(SalesRollupViewSet):
+    queryset = DailyCollectionSales.objects.order_by("date")
+    serializer_class = DailyCollectionSalesSerializer
+    filterset_class = DailyCollectionSalesFilter
+    group_field = "collection_id"
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """Development media server; content-addressed files never change, so they are cacheable forever.
+
+    In production the web server serving MEDIA_ROOT should send the same headers
+    for paths matching store.storage.CONTENT_ADDRESSED_NAME.
+    """
+    response = static.serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+def metrics_view(request):
+    """Prometheus scrape target merging the metrics of every worker (see store.metrics).
+
+    When METRICS["TOKEN"] is set, scrapers must send it as a bearer token.
+    Without one, only staff users may read them, unless DEBUG is on.
+    """
+    config = metrics.get_config()
+    if not config["ENABLED"]:
+        raise Http404()
+    if config["TOKEN"]:
+        if not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {config['TOKEN']}"):
+            return HttpResponse(status=401)
+    elif not (settings.DEBUG or request.user.is_staff):
+        return HttpResponse(status=403 if request.user.is_authenticated else 401)
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -14,3 +14,9 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType,on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            #the tags of an object are looked up by its generic key
+            models.Index(fields=["content_type","object_id"]),
+        ]